@@ -0,0 +1,70 @@
+"""Время последней активности пользователей (profiles.last_active).
+
+Каждое сообщение и нажатие кнопки, прошедшее через роутер, вызывает touch()
+(handlers._ActivityMiddleware). Время обновляется в памяти, а в БД уходит
+через WriteBehindBuffer видом 'last_active' не чаще раза в WRITE_EVERY
+секунд на пользователя — строкой в общей пачке со свайпами, без своей записи
+на каждое сообщение. Кому и когда уже записано, помнит TTLCache на
+WRITTEN_SIZE пользователей: запись живёт WRITE_EVERY секунд, а вытесненный
+пользователь просто запишется лишний раз. Неактивность меряется днями (matching.INACTIVE_DAYS,
+ranking), так что отставание БД на WRITE_EVERY ничего не меняет.
+
+Значения в БД — текст в формате CURRENT_TIMESTAMP (UTC), как created_at у
+лайков: сравнение строк совпадает со сравнением моментов времени.
+"""
+import datetime
+from typing import Any, Dict, Optional
+
+from cache import MISSING, TTLCache
+
+# Не чаще раза в WRITE_EVERY секунд на пользователя
+WRITE_EVERY = 600  # секунды
+WRITTEN_SIZE = 50_000  # пользователей, для которых помним время записи
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+_EPOCH_DAY = datetime.date(1970, 1, 1).toordinal()
+
+
+def timestamp(days_ago: float = 0.0) -> str:
+    """Момент days_ago дней назад в формате profiles.last_active."""
+    moment = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days_ago)
+    return moment.strftime(TIMESTAMP_FORMAT)
+
+
+def day(value: Optional[str]) -> Optional[float]:
+    """Значение profiles.last_active как дробный номер дня (date.toordinal()); None, если его нет."""
+    if not value:
+        return None
+    try:
+        moment = datetime.datetime.strptime(value, TIMESTAMP_FORMAT).replace(tzinfo=datetime.timezone.utc)
+    except ValueError:
+        return None
+    return moment.timestamp() / 86400 + _EPOCH_DAY
+
+
+class ActivityTracker:
+    """Когда пользователь последний раз писал боту; в БД — пачками через buffer."""
+
+    def __init__(self, buffer, write_every: float = WRITE_EVERY, written_size: int = WRITTEN_SIZE):
+        self.buffer = buffer
+        self.write_every = write_every
+        self.written_size = written_size
+        buffer.register('last_active', 'UPDATE profiles SET last_active = ? WHERE user_id = ?')
+        # Пользователи, чья активность ушла в буфер меньше write_every секунд назад
+        self._written = TTLCache(written_size, write_every)
+        self._stats = dict.fromkeys(('touches', 'writes'), 0)
+
+    def reset(self):
+        """Забывает, кому уже записана активность (бенчмарки переключают БД)."""
+        self._written = TTLCache(self.written_size, self.write_every)
+
+    async def touch(self, user_id: int):
+        """Пользователь активен сейчас."""
+        self._stats['touches'] += 1
+        if self._written.get(user_id) is not MISSING:
+            return
+        self._written.put(user_id, True)
+        self._stats['writes'] += 1
+        await self.buffer.add('last_active', user_id, (timestamp(), user_id), replace=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, tracked=len(self._written))
@@ -0,0 +1,71 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+# Значение-маркер «в кэше нет»: None сам по себе кэшируется (отрицательный кэш)
+MISSING = object()
+
+
+class TTLCache:
+    """Ограниченный LRU-кэш со временем жизни записей.
+
+    Хранит не более maxsize ключей, вытесняя давно не использованные;
+    запись старше ttl секунд считается промахом. None — обычное значение,
+    так кэшируются и отрицательные ответы («анкеты нет»).
+
+    На каждый ключ ведётся поколение: invalidate() увеличивает его, а put()
+    с поколением, взятым до чтения из БД, игнорируется, если ключ за это
+    время успели инвалидировать. Так медленное чтение не вернёт в кэш
+    значение, устаревшее из-за параллельной записи.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._generations: Dict[Hashable, int] = {}
+        self._stats = dict.fromkeys(('hits', 'misses', 'expired', 'evictions', 'invalidations'), 0)
+
+    def generation(self, key: Hashable) -> int:
+        return self._generations.get(key, 0)
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self._stats['misses'] += 1
+            return MISSING
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self._stats['expired'] += 1
+            self._stats['misses'] += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self._stats['hits'] += 1
+        return value
+
+    def put(self, key: Hashable, value: Any, generation: int = None):
+        if generation is not None and generation != self.generation(key):
+            return
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def invalidate(self, key: Hashable):
+        self._generations[key] = self.generation(key) + 1
+        self._data.pop(key, None)
+        self._stats['invalidations'] += 1
+
+    def clear(self):
+        for key in list(self._data):
+            self.invalidate(key)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats['hits'] + self._stats['misses']
+        hit_rate = round(self._stats['hits'] / lookups, 3) if lookups else 0.0
+        return dict(self._stats, size=len(self._data), hit_rate=hit_rate)
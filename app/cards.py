@@ -0,0 +1,105 @@
+"""Кэш готовых карточек анкет.
+
+Карточка — текст (уже с экранированием Markdown) и медиагруппа из
+InputMediaPhoto для одной анкеты в одном варианте оформления. Пока анкета
+не менялась, повторная отправка берёт карточку из кэша. Ключ — (user_id,
+версия анкеты, вариант); любое изменение анкеты через data.py сбрасывает
+все её карточки.
+"""
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from aiogram.types import InputMediaPhoto
+
+from cache import MISSING, TTLCache
+from data import on_profile_change, profile_version
+from keyboards import freeze
+
+CARD_CACHE_SIZE = 2000
+CARD_CACHE_TTL = 3600  # секунды
+
+# Варианты, которые отправляются медиагруппой; горячие и рулетка показывают одно фото
+GROUP_VARIANTS = {'browse', 'browse_revisit', 'card', 'like'}
+
+
+class Card(NamedTuple):
+    text: str
+    photos: Tuple[str, ...]
+    # Медиагруппа с text в подписи к первому фото; пустая, если фото меньше двух
+    # или вариант не отправляется группой
+    media: Tuple[InputMediaPhoto, ...]
+
+
+def esc(text: str) -> str:
+    """Экранирует спецсимволы Markdown v1 в пользовательском тексте."""
+    for char in ('_', '*', '`', '['):
+        text = text.replace(char, f'\\{char}')
+    return text
+
+
+def _media_group(photos: Tuple[str, ...], text: str, tail: Tuple[InputMediaPhoto, ...] = None):
+    if len(photos) < 2:
+        return ()
+    # Карточка из кэша уходит многим получателям, поэтому фото заморожены
+    # (keyboards.freeze); фото без подписи можно переиспользовать между вариантами
+    if tail is None:
+        tail = tuple(freeze(InputMediaPhoto(media=file_id)) for file_id in photos[1:])
+    return (freeze(InputMediaPhoto(media=photos[0], caption=text, parse_mode="Markdown")),) + tail
+
+
+def _render_text(profile: Dict[str, Any], variant: str) -> str:
+    name, age = profile['name'], profile['age']
+    verified_mark = " ✅" if profile.get('verified') else ""
+    if variant == 'browse':
+        return f"👤 **Анкета:**\n{esc(name)}, {age}{verified_mark}\nОписание: {esc(profile['description'])}"
+    if variant == 'browse_revisit':
+        return (f"👤 **Анкета:**\n{esc(name)}, {age}{verified_mark}\n"
+                f"\n_Вы уже лайкнули эту анкету_\nОписание: {esc(profile['description'])}")
+    if variant == 'card':
+        return f"👤 **Анкета:**\n{esc(name)}, {age}\nОписание: {esc(profile['description'])}"
+    if variant == 'like':
+        return f"💌 Пользователь {esc(name)} лайкнул вашу анкету!\n\n" + _render_text(profile, 'card')
+    if variant == 'hot':
+        return f"👤 {esc(name)}, {age}{verified_mark}\n{esc(profile['description'])}"
+    if variant == 'roulette':
+        return f"🎰 **Рулетка! Анкета из {profile['institute']}:**\n{name}, {age}{verified_mark}\n{profile['description']}"
+    raise ValueError(f"Неизвестный вариант карточки: {variant}")
+
+
+def _source(profile: Dict[str, Any]) -> tuple:
+    # Поля, из которых собирается карточка. Анкету может поменять и другой
+    # процесс (ModeratorBot ставит verified) — тогда версия та же, а поля нет
+    return (profile['name'], profile['age'], profile['description'], tuple(profile.get('photos') or ()),
+            profile.get('verified') or 0, profile.get('institute'))
+
+
+_cards = TTLCache(CARD_CACHE_SIZE, CARD_CACHE_TTL)
+on_profile_change(_cards.invalidate)
+
+
+def get_card(user_id: int, profile: Dict[str, Any], variant: str) -> Card:
+    """Карточка анкеты user_id; profile — результат data.get_profile."""
+    version, source = profile_version(user_id), _source(profile)
+    entry = _cards.get(user_id)
+    if entry is MISSING or entry[0] != version or entry[1] != source:
+        entry = (version, source, {})
+        _cards.put(user_id, entry)
+    variants = entry[2]
+    card = variants.get(variant)
+    if card is None:
+        photos = source[3]
+        text = _render_text(profile, variant)
+        media = _media_group(photos, text) if variant in GROUP_VARIANTS else ()
+        card = variants[variant] = Card(text, photos, media)
+    return card
+
+
+def with_header(card: Card, header: Optional[str]) -> Card:
+    """Карточка с уникальным заголовком (суперлайк, личное сообщение): в кэш не кладётся."""
+    if not header:
+        return card
+    text = header + card.text
+    return Card(text, card.photos, _media_group(card.photos, text, card.media[1:]))
+
+
+def stats() -> Dict[str, Any]:
+    return _cards.stats()
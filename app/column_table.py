@@ -0,0 +1,84 @@
+"""Общая основа колоночных таблиц анкет в памяти.
+
+Таблица — user_ids (по возрастанию) и параллельные массивы NumPy той же
+длины. Строки читает один загрузчик data.get_profile_columns, поля задаёт
+подкласс (COLUMNS). Часть полей (рейтинг, активность, верификация) меняется
+в обход data._profile_changed, поэтому таблица целиком перечитывается раз в
+TTL секунд; анкеты, о которых сообщил data.on_profile_change (mark_dirty),
+перечитываются точечно перед следующим обращением.
+
+Подклассы: ranking.FeatureTable и profile_store.ProfileStore.
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from data import get_profile_columns
+
+
+class ColumnTable:
+    """Колонки анкет: user_ids (по возрастанию) и массивы той же длины.
+
+    Подкласс задаёт COLUMNS — выражения SELECT после user_id (p. — profiles,
+    s. — user_streaks), TTL и _columns(rows), который строит колонки из строк
+    (user_id, *COLUMNS).
+    """
+
+    COLUMNS: Tuple[str, ...] = ()
+    TTL = 300  # секунды
+
+    def __init__(self):
+        self._institutes: Dict[Optional[str], int] = {}
+        self.institute_names: List[Optional[str]] = []
+        self._set_columns(self._columns([]))
+        self._dirty: Set[int] = set()
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    def institute_code(self, institute: Optional[str]) -> int:
+        code = self._institutes.get(institute)
+        if code is None:
+            code = self._institutes[institute] = len(self.institute_names)
+            self.institute_names.append(institute)
+        return code
+
+    def _columns(self, rows: List[tuple]) -> Dict[str, np.ndarray]:
+        raise NotImplementedError
+
+    def _set_columns(self, columns: Dict[str, np.ndarray]):
+        for column, values in columns.items():
+            setattr(self, column, values)
+
+    def mark_dirty(self, user_id: int):
+        self._dirty.add(user_id)
+
+    def reset(self):
+        """Забывает загруженные колонки (после подмены файла БД)."""
+        self._institutes.clear()
+        self.institute_names.clear()
+        self._set_columns(self._columns([]))
+        self._dirty.clear()
+        self._loaded_at = None
+
+    async def refresh(self):
+        async with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.TTL:
+                self._dirty.clear()
+                self._set_columns(self._columns(await get_profile_columns(self.COLUMNS)))
+                self._loaded_at = time.monotonic()
+            elif self._dirty:
+                dirty, self._dirty = self._dirty, set()
+                self._update(dirty, await get_profile_columns(self.COLUMNS, list(dirty)))
+
+    def _update(self, user_ids: Set[int], rows: List[tuple]):
+        """Заменяет строки user_ids на rows; анкет, которых нет в rows, больше нет."""
+        keep = ~np.isin(self.user_ids, np.fromiter(user_ids, dtype=np.int64, count=len(user_ids)))
+        fresh = self._columns(rows)
+        order = np.argsort(np.concatenate([self.user_ids[keep], fresh['user_ids']]), kind='stable')
+        self._set_columns({column: np.concatenate([getattr(self, column)[keep], values])[order]
+                           for column, values in fresh.items()})
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
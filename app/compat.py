@@ -0,0 +1,48 @@
+"""Совместимость анкет по полу и интересам.
+
+Класс анкеты — пара (пол, интересы), упакованная в маленький код
+(profiles.compat_class, считается при сохранении анкеты). Две анкеты
+подходят друг другу, если каждая по полу попадает в интересы другой;
+MUTUAL заранее содержит для каждого класса все совместимые с ним классы,
+поэтому подбор не проверяет пары анкет по одной, а объединяет карты
+(matching.CandidateIndex) или строки индекса (data.py) нужных классов.
+"""
+from typing import Dict, Optional, Tuple
+
+GENDERS = ("Парень", "Девушка")
+
+# Какой пол анкет показывать при данных интересах
+INTEREST_GENDERS = {
+    "Парни": ("Парень",),
+    "Девушки": ("Девушка",),
+    "Все": ("Парень", "Девушка"),
+}
+
+# Код класса: номер пола * число вариантов интересов + номер интересов.
+# UNKNOWN — анкеты с незаполненным или неизвестным полом/интересами:
+# они никому не подходят
+UNKNOWN = -1
+CLASSES: Tuple[Tuple[str, str], ...] = tuple(
+    (gender, interests) for gender in GENDERS for interests in INTEREST_GENDERS
+)
+_CODES: Dict[Tuple[str, str], int] = {pair: code for code, pair in enumerate(CLASSES)}
+
+
+def is_compatible(liker_gender: str, target_interests: str) -> bool:
+    """Подходит ли пол liker_gender под интересы target_interests (в одну сторону)."""
+    return liker_gender in INTEREST_GENDERS.get(target_interests, ())
+
+
+def class_of(gender: Optional[str], interests: Optional[str]) -> int:
+    return _CODES.get((gender, interests), UNKNOWN)
+
+
+# Класс -> классы, с которыми совместимость взаимная
+MUTUAL: Dict[int, Tuple[int, ...]] = {
+    code: tuple(
+        other for other, (other_gender, other_interests) in enumerate(CLASSES)
+        if is_compatible(other_gender, interests) and is_compatible(gender, other_interests)
+    )
+    for code, (gender, interests) in enumerate(CLASSES)
+}
+MUTUAL[UNKNOWN] = ()
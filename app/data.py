@@ -1,241 +1,153 @@
-import aiosqlite
 import json
 import datetime
+import itertools
 import random
-from typing import Optional, Dict, Any, Set, Tuple, List
+import re
+from typing import Optional, Dict, Any, Set, Tuple, List, Callable
 from aiogram import Bot
+import compat
+import elo
+from activity import ActivityTracker
+from cache import MISSING, TTLCache
+from db_pool import ConnectionPool
+from delivery import DeliveryHealth
+from exposure import ExposureScheduler
+from migrations import migrate
+from seen_sets import SeenSets
+from write_behind import WriteBehindBuffer
 
 DB_PATH = "bot_database.db"
 
+# Общий пул соединений (WAL: один писатель, несколько читателей):
+# открывается в main.py, используется всеми модулями
+pool = ConnectionPool(DB_PATH)
+
+# Лайки, дизлайки и просмотры пишутся пачками (см. write_behind.py):
+# фоновый сброс запускается и останавливается в main.py
+swipes = WriteBehindBuffer(pool)
+swipes.register('likes', 'INSERT OR IGNORE INTO likes (user_id, liked_user_id, created_at) VALUES (?, ?, ?)')
+swipes.register('dislikes', 'INSERT OR IGNORE INTO dislikes (user_id, disliked_user_id) VALUES (?, ?)')
+swipes.register('views', 'INSERT OR REPLACE INTO profile_views (viewer_id, viewed_id, viewed_at) VALUES (?, ?, ?)')
+
+# Журнал взаимодействий для офлайн-прогона алгоритмов подбора (см. replay.py):
+# показы и оценки дописываются в interaction_log через swipes. Ключ строки —
+# (порядковый номер, кто, кого): номер делает его уникальным, а id нужны
+# delete_profile, чтобы выбросить ещё не записанные события
+INTERACTION_LOG = True
+INTERACTION_EVENTS = ('shown', 'like', 'dislike', 'superlike')
+swipes.register('interactions', 'INSERT INTO interaction_log (created_at, viewer_id, target_id, event) VALUES (?, ?, ?, ?)')
+_interaction_seq = itertools.count()
+
+# Те же оценки в виде битовых карт для подбора анкет (см. seen_sets.py)
+seen = SeenSets(pool, swipes)
+
+# Счётчики показов анкет для выравнивания показов (см. exposure.py)
+exposure = ExposureScheduler(pool, swipes)
+
+# Время последней активности пользователей (см. activity.py): в памяти на
+# каждое обновление, в profiles.last_active — через swipes
+activity = ActivityTracker(swipes)
+
+# Кэш анкет: user_id -> профиль (или None, если анкеты нет). Сбрасывается
+# при каждом изменении анкеты в этом модуле; TTL ограничивает устаревание
+# после правок из других процессов (ModeratorBot ставит verified)
+PROFILE_CACHE_SIZE = 5000
+PROFILE_CACHE_TTL = 60  # секунды
+profile_cache = TTLCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+
+# Привлекательность анкет (elo.py): текущие значения держатся в кэше, а
+# запись идёт через swipes — за один сброс по строке на анкету
+DESIRABILITY_CACHE_SIZE = 20000
+DESIRABILITY_CACHE_TTL = 600  # секунды
+desirability_cache = TTLCache(DESIRABILITY_CACHE_SIZE, DESIRABILITY_CACHE_TTL)
+swipes.register('desirability', 'UPDATE profiles SET desirability = ? WHERE user_id = ?')
+
+# Очередь новых анкет (fan-out on write, таблица candidate_queue): анкета при
+# создании и смене класса (compat.py) добавляется в очереди всех, с кем
+# взаимно совместима,
+# оценка удаляет её из очереди оценившего. Тогда пул новых для
+# matching.POOL_SOURCE = 'queue' — одно чтение диапазона по первичному ключу.
+# Цена — строки на каждую подходящую пару и запись на каждую регистрацию
+# (сравнение: benchmarks/bench_candidate_queue.py). Выключенная очередь не
+# ведётся и очищается при старте; включённая заполняется в init_db
+CANDIDATE_QUEUE = False
+swipes.register('unqueue', 'DELETE FROM candidate_queue WHERE user_id = ? AND candidate_id = ?')
+
+# Подписчики на изменение анкеты (кэши карточек и т.п.): callback(user_id)
+_profile_listeners: List[Callable[[int], None]] = []
+
+def on_profile_change(callback: Callable[[int], None]):
+    _profile_listeners.append(callback)
+
+def _profile_changed(user_id: int):
+    profile_cache.invalidate(user_id)
+    for callback in _profile_listeners:
+        callback(user_id)
+
+def profile_version(user_id: int) -> int:
+    """Номер версии анкеты в этом процессе: растёт при каждом изменении."""
+    return profile_cache.generation(user_id)
+
+# Кто заблокировал бота или недоступен (см. delivery.py): такие анкеты не
+# попадают в пулы и рулетку, а уведомления им не отправляются
+delivery = DeliveryHealth(pool, _profile_changed)
+_UNREACHABLE_SQL = 'SELECT user_id FROM delivery_health WHERE unreachable = 1'
+
 # Список институтов (фиксированный)
 INSTITUTES = ["ИИТ", "ИИИ", "ИТУ", "ИКБ", "ИТХТ", "ИПТИП"]
 
-async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Таблица профилей (создаётся без новых колонок, они будут добавлены позже)
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS profiles (
-                user_id INTEGER PRIMARY KEY,
-                name TEXT NOT NULL,
-                age INTEGER NOT NULL,
-                gender TEXT NOT NULL,
-                interests TEXT NOT NULL,
-                description TEXT NOT NULL,
-                photos TEXT NOT NULL
-            )
-        ''')
-        # Таблица лайков
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS likes (
-                user_id INTEGER,
-                liked_user_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (user_id, liked_user_id)
-            )
-        ''')
-        # Таблица дизлайков
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS dislikes (
-                user_id INTEGER,
-                disliked_user_id INTEGER,
-                PRIMARY KEY (user_id, disliked_user_id)
-            )
-        ''')
-        # Таблица заданий на встречу (с новыми колонками)
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS meet_tasks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user1_id INTEGER NOT NULL,
-                user2_id INTEGER NOT NULL,
-                initiator_id INTEGER NOT NULL,
-                institute TEXT NOT NULL,
-                location TEXT NOT NULL,
-                status TEXT NOT NULL,
-                user1_confirmed INTEGER DEFAULT 0,
-                user2_confirmed INTEGER DEFAULT 0,
-                msg1_id INTEGER,
-                msg2_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                deadline TIMESTAMP,
-                video_message_id INTEGER,
-                admin_decision INTEGER
-            )
-        ''')
-        # Таблица очков
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS user_points (
-                user_id INTEGER NOT NULL,
-                year_month TEXT NOT NULL,
-                points INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, year_month)
-            )
-        ''')
-        # Таблица рейтингов
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS ratings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                from_user_id INTEGER NOT NULL,
-                to_user_id INTEGER NOT NULL,
-                value INTEGER NOT NULL,
-                voter_weight REAL NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(from_user_id, to_user_id)
-            )
-        ''')
-
-        # === Проверка и добавление новых колонок в существующие таблицы ===
-
-        # Для таблицы profiles
-        cursor = await db.execute("PRAGMA table_info(profiles)")
-        columns = await cursor.fetchall()
-        column_names = [col[1] for col in columns]
-        if 'institute' not in column_names:
-            await db.execute("ALTER TABLE profiles ADD COLUMN institute TEXT DEFAULT 'ИИТ'")
-            print("Добавлена колонка institute в profiles")
-        if 'rating_sum' not in column_names:
-            await db.execute("ALTER TABLE profiles ADD COLUMN rating_sum REAL DEFAULT 0")
-            print("Добавлена колонка rating_sum в profiles")
-        if 'rating_weight' not in column_names:
-            await db.execute("ALTER TABLE profiles ADD COLUMN rating_weight REAL DEFAULT 0")
-            print("Добавлена колонка rating_weight в profiles")
-
-        # Для таблицы meet_tasks
-        cursor = await db.execute("PRAGMA table_info(meet_tasks)")
-        columns = await cursor.fetchall()
-        column_names = [col[1] for col in columns]
-        if 'user1_confirmed' not in column_names:
-            await db.execute("ALTER TABLE meet_tasks ADD COLUMN user1_confirmed INTEGER DEFAULT 0")
-            print("Добавлена колонка user1_confirmed в meet_tasks")
-        if 'user2_confirmed' not in column_names:
-            await db.execute("ALTER TABLE meet_tasks ADD COLUMN user2_confirmed INTEGER DEFAULT 0")
-            print("Добавлена колонка user2_confirmed в meet_tasks")
-        if 'msg1_id' not in column_names:
-            await db.execute("ALTER TABLE meet_tasks ADD COLUMN msg1_id INTEGER")
-            print("Добавлена колонка msg1_id в meet_tasks")
-        if 'msg2_id' not in column_names:
-            await db.execute("ALTER TABLE meet_tasks ADD COLUMN msg2_id INTEGER")
-            print("Добавлена колонка msg2_id в meet_tasks")
-
-        # Таблица стриков
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS user_streaks (
-                user_id INTEGER PRIMARY KEY,
-                current_streak INTEGER DEFAULT 0,
-                longest_streak INTEGER DEFAULT 0,
-                last_active_date TEXT
-            )
-        ''')
-        # Таблица бейджей
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS user_badges (
-                user_id INTEGER,
-                badge_type TEXT,
-                awarded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (user_id, badge_type)
-            )
-        ''')
-        # Таблица ежедневных заданий
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS daily_task_completions (
-                user_id INTEGER,
-                task_date TEXT,
-                task_type TEXT,
-                PRIMARY KEY (user_id, task_date, task_type)
-            )
-        ''')
-        # Таблица кулдауна рулетки
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS roulette_cooldowns (
-                user_id INTEGER PRIMARY KEY,
-                last_date TEXT
-            )
-        ''')
-        # Таблица просмотров профилей
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS profile_views (
-                viewer_id INTEGER,
-                viewed_id INTEGER,
-                viewed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (viewer_id, viewed_id)
-            )
-        ''')
-
-        # Новые колонки в profiles
-        cursor = await db.execute("PRAGMA table_info(profiles)")
-        columns = await cursor.fetchall()
-        column_names = [col[1] for col in columns]
-        if 'verified' not in column_names:
-            await db.execute("ALTER TABLE profiles ADD COLUMN verified INTEGER DEFAULT 0")
-            print("Добавлена колонка verified в profiles")
-        if 'video_file_id' not in column_names:
-            await db.execute("ALTER TABLE profiles ADD COLUMN video_file_id TEXT")
-            print("Добавлена колонка video_file_id в profiles")
-
-        # created_at в likes
-        cursor = await db.execute("PRAGMA table_info(likes)")
-        columns = await cursor.fetchall()
-        column_names = [col[1] for col in columns]
-        if 'created_at' not in column_names:
-            await db.execute("ALTER TABLE likes ADD COLUMN created_at TIMESTAMP")
-            print("Добавлена колонка created_at в likes")
-
-        # Таблица запросов на верификацию (для ModeratorBot)
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS pending_verifications (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                photo_file_id TEXT NOT NULL,
-                photo_path TEXT,
-                status TEXT DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                admin_notified INTEGER DEFAULT 0
-            )
-        ''')
-
-        # Миграция: добавляем photo_path если её нет
-        cursor = await db.execute("PRAGMA table_info(pending_verifications)")
-        pv_cols = {row[1] for row in await cursor.fetchall()}
-        if 'photo_path' not in pv_cols:
-            await db.execute("ALTER TABLE pending_verifications ADD COLUMN photo_path TEXT")
-            print("Добавлена колонка photo_path в pending_verifications")
-
-        # Колонки для ModeratorBot в meet_tasks
-        cursor = await db.execute("PRAGMA table_info(meet_tasks)")
-        columns = await cursor.fetchall()
-        column_names = [col[1] for col in columns]
-        if 'admin_notified' not in column_names:
-            await db.execute("ALTER TABLE meet_tasks ADD COLUMN admin_notified INTEGER DEFAULT 0")
-            print("Добавлена колонка admin_notified в meet_tasks")
-        if 'video_file_id' not in column_names:
-            await db.execute("ALTER TABLE meet_tasks ADD COLUMN video_file_id TEXT")
-            print("Добавлена колонка video_file_id в meet_tasks")
-        if 'video_path' not in column_names:
-            await db.execute("ALTER TABLE meet_tasks ADD COLUMN video_path TEXT")
-            print("Добавлена колонка video_path в meet_tasks")
-
-        await db.commit()
+async def init_db() -> int:
+    """Доводит схему БД до актуальной версии (см. migrations.py)."""
+    version = await migrate(pool)
+    await _sync_candidate_queue()
+    return version
+
+def _utc_timestamp() -> str:
+    """Текущее время в формате CURRENT_TIMESTAMP (UTC), чтобы отложенная запись хранила момент действия."""
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
 
 # ---------- Профили ----------
 async def save_profile(user_id: int, name: str, age: int, gender: str, interests: str, institute: str, description: str, photos: list):
     photos_json = json.dumps(photos)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write() as db:
         # Получаем текущие значения рейтинга и новых колонок, если профиль уже существует
-        async with db.execute('SELECT rating_sum, rating_weight, verified, video_file_id FROM profiles WHERE user_id = ?', (user_id,)) as cursor:
+        async with db.execute('SELECT rating_sum, rating_weight, verified, video_file_id, desirability, compat_class, last_active FROM profiles WHERE user_id = ?', (user_id,)) as cursor:
             row = await cursor.fetchone()
         if row:
-            rating_sum, rating_weight, verified, video_file_id = row
+            rating_sum, rating_weight, verified, video_file_id, desirability, previous_class, last_active = row
         else:
-            rating_sum, rating_weight, verified, video_file_id = 0.0, 0.0, 0, None
+            rating_sum, rating_weight, verified, video_file_id, desirability = 0.0, 0.0, 0, None, elo.BASE
+            previous_class, last_active = None, _utc_timestamp()
+        compat_class = compat.class_of(gender, interests)
 
         await db.execute('''
             INSERT OR REPLACE INTO profiles
-            (user_id, name, age, gender, interests, institute, description, photos, rating_sum, rating_weight, verified, video_file_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, name, age, gender, interests, institute, description, photos_json, rating_sum, rating_weight, verified, video_file_id))
-        await db.commit()
+            (user_id, name, age, gender, interests, institute, description, photos, rating_sum, rating_weight, verified, video_file_id, desirability, compat_class, last_active)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, name, age, gender, interests, institute, description, photos_json, rating_sum, rating_weight, verified, video_file_id, desirability, compat_class, last_active))
+        # Плотный номер для битовых карт (seen_sets.py)
+        await db.execute('INSERT OR IGNORE INTO user_index (user_id) VALUES (?)', (user_id,))
+        if CANDIDATE_QUEUE and compat_class != previous_class:
+            await _fan_out(db, user_id, previous_class is not None, compat_class)
+    _profile_changed(user_id)
+
+def _copy_profile(profile: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    # Обработчики редактирования меняют полученный dict, поэтому наружу отдаём копию
+    if profile is None:
+        return None
+    return dict(profile, photos=list(profile['photos']))
 
 async def get_profile(user_id: int) -> Optional[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    cached = profile_cache.get(user_id)
+    if cached is not MISSING:
+        return _copy_profile(cached)
+    generation = profile_cache.generation(user_id)
+    profile = await _load_profile(user_id)
+    profile_cache.put(user_id, profile, generation)
+    return _copy_profile(profile)
+
+async def _load_profile(user_id: int) -> Optional[Dict[str, Any]]:
+    async with pool.read() as db:
         async with db.execute('SELECT name, age, gender, interests, institute, description, photos, verified, video_file_id FROM profiles WHERE user_id = ?', (user_id,)) as cursor:
             row = await cursor.fetchone()
             if row:
@@ -258,7 +170,7 @@ async def get_profile(user_id: int) -> Optional[Dict[str, Any]]:
             return None
 
 async def get_all_profiles() -> Dict[int, Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.read() as db:
         async with db.execute('SELECT user_id, name, age, gender, interests, institute, description, photos FROM profiles') as cursor:
             rows = await cursor.fetchall()
             profiles = {}
@@ -279,32 +191,140 @@ async def get_all_profiles() -> Dict[int, Dict[str, Any]]:
                 }
             return profiles
 
+async def get_profile_partitions(user_ids: Optional[List[int]] = None
+                                 ) -> Dict[int, Tuple[int, str, Optional[int], int, Optional[str]]]:
+    """Класс совместимости (compat.py), институт, возраст, verified и last_active анкет (все или только user_ids) — для индекса кандидатов."""
+    result = {}
+    async with pool.read() as db:
+        if user_ids is None:
+            async with db.execute('SELECT user_id, compat_class, institute, age, verified, last_active FROM profiles') as cursor:
+                rows = await cursor.fetchall()
+        else:
+            rows = []
+            user_ids = list(user_ids)
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                async with db.execute(
+                    f'SELECT user_id, compat_class, institute, age, verified, last_active FROM profiles WHERE user_id IN ({placeholders})', chunk
+                ) as cursor:
+                    rows.extend(await cursor.fetchall())
+    for user_id, compat_class, institute, age, verified, last_active in rows:
+        result[user_id] = (compat_class, institute, age, verified or 0, last_active)
+    return result
+
+async def get_profile_columns(columns: Tuple[str, ...], user_ids: Optional[List[int]] = None) -> List[tuple]:
+    """Поля анкет для колоночных таблиц (column_table.py): (user_id, *columns).
+
+    columns — выражения по profiles p и user_streaks s (она присоединяется,
+    только если нужна); user_ids читаются пачками по 500.
+    """
+    sql = f'SELECT p.user_id, {", ".join(columns)} FROM profiles p'
+    if any(column.startswith('s.') for column in columns):
+        sql += ' LEFT JOIN user_streaks s ON s.user_id = p.user_id'
+    async with pool.read() as db:
+        if user_ids is None:
+            async with db.execute(sql) as cursor:
+                return await cursor.fetchall()
+        rows = []
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            async with db.execute(f'{sql} WHERE p.user_id IN ({placeholders})', chunk) as cursor:
+                rows.extend(await cursor.fetchall())
+    return rows
+
 async def update_profile_institute(user_id: int, institute: str):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write() as db:
         await db.execute('UPDATE profiles SET institute = ? WHERE user_id = ?', (institute, user_id))
-        await db.commit()
+    _profile_changed(user_id)
+
+# ---------- Журнал взаимодействий (replay.py) ----------
+async def log_interaction(viewer_id: int, target_id: int, event: str):
+    if INTERACTION_LOG:
+        await swipes.add('interactions', (next(_interaction_seq), viewer_id, target_id),
+                         (_utc_timestamp(), viewer_id, target_id, event))
 
 # ---------- Оценки (лайки/дизлайки) ----------
-async def add_like(user_id: int, target_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute('INSERT OR IGNORE INTO likes (user_id, liked_user_id) VALUES (?, ?)', (user_id, target_id))
-        await db.commit()
+async def add_like(user_id: int, target_id: int, event: str = 'like'):
+    """Лайк; event — как записать его в журнал взаимодействий ('like' или 'superlike')."""
+    await swipes.add('likes', (user_id, target_id), (user_id, target_id, _utc_timestamp()))
+    await log_interaction(user_id, target_id, event)
+    await seen.add(user_id, 'likes', target_id)
+    await _update_desirability(user_id, target_id, liked=True)
+    if CANDIDATE_QUEUE:
+        await swipes.add('unqueue', (user_id, target_id), (user_id, target_id))
 
 async def check_like_exists(liker_id: int, target_id: int) -> bool:
     """Проверяет, поставил ли liker_id лайк target_id."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    if swipes.has('likes', (liker_id, target_id)):
+        return True
+    async with pool.read() as db:
         async with db.execute(
             'SELECT 1 FROM likes WHERE user_id = ? AND liked_user_id = ?', (liker_id, target_id)
         ) as cursor:
             return await cursor.fetchone() is not None
 
 async def add_dislike(user_id: int, target_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute('INSERT OR IGNORE INTO dislikes (user_id, disliked_user_id) VALUES (?, ?)', (user_id, target_id))
-        await db.commit()
+    await swipes.add('dislikes', (user_id, target_id), (user_id, target_id))
+    await log_interaction(user_id, target_id, 'dislike')
+    await seen.add(user_id, 'dislikes', target_id)
+    await _update_desirability(user_id, target_id, liked=False)
+    if CANDIDATE_QUEUE:
+        await swipes.add('unqueue', (user_id, target_id), (user_id, target_id))
+
+# ---------- Привлекательность (elo.py) ----------
+def _cached_desirability(user_id: int):
+    pending = swipes.get('desirability', user_id)
+    if pending is not None:
+        return pending[0]
+    return desirability_cache.get(user_id)
+
+async def get_desirability(user_ids: List[int]) -> Dict[int, float]:
+    """Текущая привлекательность анкет (с учётом ещё не записанных изменений)."""
+    result, missing = {}, []
+    for user_id in user_ids:
+        value = _cached_desirability(user_id)
+        if value is MISSING:
+            missing.append(user_id)
+        else:
+            result[user_id] = value
+    if missing:
+        generations = {user_id: desirability_cache.generation(user_id) for user_id in missing}
+        placeholders = ','.join('?' * len(missing))
+        async with pool.read() as db:
+            async with db.execute(
+                f'SELECT user_id, desirability FROM profiles WHERE user_id IN ({placeholders})', missing
+            ) as cursor:
+                rows = dict(await cursor.fetchall())
+        for user_id in missing:
+            # Пока читали, значение могло обновиться — тогда берём его
+            value = _cached_desirability(user_id)
+            if value is MISSING:
+                value = rows.get(user_id)
+                value = elo.BASE if value is None else value
+                desirability_cache.put(user_id, value, generations[user_id])
+            result[user_id] = value
+    return result
+
+async def _update_desirability(voter_id: int, target_id: int, liked: bool):
+    await get_desirability([voter_id, target_id])
+    # Дальше без await: чтение и запись нового значения не перемежаются с другим свайпом
+    voter, target = _cached_desirability(voter_id), _cached_desirability(target_id)
+    if voter is MISSING or target is MISSING:
+        return
+    value = elo.update(target, voter, liked)
+    desirability_cache.put(target_id, value)
+    await swipes.add('desirability', target_id, (value, target_id), replace=True)
+
+async def get_most_desirable(limit: int = 10) -> List[int]:
+    async with pool.read() as db:
+        async with db.execute('SELECT user_id FROM profiles ORDER BY desirability DESC LIMIT ?', (limit,)) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
 
 async def get_ratings(user_id: int) -> Dict[str, Set[int]]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.read() as db:
         liked = set()
         async with db.execute('SELECT liked_user_id FROM likes WHERE user_id = ?', (user_id,)) as cursor:
             rows = await cursor.fetchall()
@@ -315,11 +335,297 @@ async def get_ratings(user_id: int) -> Dict[str, Set[int]]:
             rows = await cursor.fetchall()
             for row in rows:
                 disliked.add(row[0])
-        return {'liked': liked, 'disliked': disliked}
+    # Оценки, которые ещё лежат в буфере отложенной записи
+    liked.update(target for (uid, target), _ in swipes.pending('likes') if uid == user_id)
+    disliked.update(target for (uid, target), _ in swipes.pending('dislikes') if uid == user_id)
+    return {'liked': liked, 'disliked': disliked}
+
+async def get_likers(user_id: int) -> Set[int]:
+    """Кто лайкнул анкету user_id (с учётом ещё не записанных лайков)."""
+    async with pool.read() as db:
+        async with db.execute('SELECT user_id FROM likes WHERE liked_user_id = ?', (user_id,)) as cursor:
+            likers = {row[0] for row in await cursor.fetchall()}
+    likers.update(uid for (uid, target), _ in swipes.pending('likes') if target == user_id)
+    return likers
+
+async def get_recommendations(user_id: int) -> List[int]:
+    """Рекомендации из последнего прогона recommender.py, лучшие первыми."""
+    async with pool.read() as db:
+        async with db.execute('SELECT target_id FROM recommendations WHERE user_id = ? ORDER BY rank', (user_id,)) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+# ---------- Фильтры просмотра ----------
+# Фильтры пользователя: {'age_min', 'age_max', 'institutes', 'verified_only'}
+# (None в границе возраста — без ограничения, None в institutes — все).
+# Нет строки в browse_filters — нет фильтров, get_browse_filters вернёт None
+async def get_browse_filters(user_id: int) -> Optional[Dict[str, Any]]:
+    async with pool.read() as db:
+        async with db.execute(
+            'SELECT age_min, age_max, institutes, verified_only FROM browse_filters WHERE user_id = ?', (user_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+    if not row:
+        return None
+    age_min, age_max, institutes, verified_only = row
+    return {
+        'age_min': age_min,
+        'age_max': age_max,
+        'institutes': json.loads(institutes) if institutes else None,
+        'verified_only': bool(verified_only),
+    }
+
+async def save_browse_filters(user_id: int, age_min: Optional[int] = None, age_max: Optional[int] = None,
+                              institutes: Optional[List[str]] = None, verified_only: bool = False):
+    """Сохраняет фильтры; без единого ограничения строка удаляется."""
+    async with pool.write() as db:
+        if age_min is None and age_max is None and not institutes and not verified_only:
+            await db.execute('DELETE FROM browse_filters WHERE user_id = ?', (user_id,))
+            return
+        await db.execute(
+            'INSERT OR REPLACE INTO browse_filters (user_id, age_min, age_max, institutes, verified_only) VALUES (?, ?, ?, ?, ?)',
+            (user_id, age_min, age_max, json.dumps(sorted(institutes), ensure_ascii=False) if institutes else None,
+             int(verified_only))
+        )
+
+def _filters_sql(filters: Optional[Dict[str, Any]], params: Dict[str, Any], alias: str = 'p',
+                 active_since: Optional[str] = None) -> str:
+    """Условия фильтров для WHERE (с AND в начале); параметры дописываются в params.
+
+    Вместе с compat_class IN (...) они идут по idx_profiles_browse
+    (compat_class, age, institute, verified): класс и возраст — диапазоном по
+    индексу, институт и verified проверяются по той же записи индекса.
+    active_since — только анкеты, активные с этого момента (формат
+    profiles.last_active, см. activity.py); без last_active анкета проходит.
+    Недоступные пользователи (delivery_health) исключаются всегда: подзапрос
+    считается один раз на запрос.
+    """
+    conditions = [f'{alias}.user_id NOT IN ({_UNREACHABLE_SQL})']
+    if active_since is not None:
+        conditions.append(f'({alias}.last_active IS NULL OR {alias}.last_active >= :active_since)')
+        params['active_since'] = active_since
+    if not filters:
+        return ''.join(f' AND {condition}' for condition in conditions)
+    if filters['age_min'] is not None:
+        conditions.append(f'{alias}.age >= :age_min')
+        params['age_min'] = filters['age_min']
+    if filters['age_max'] is not None:
+        conditions.append(f'{alias}.age <= :age_max')
+        params['age_max'] = filters['age_max']
+    if filters['institutes']:
+        params.update({f'inst{i}': institute for i, institute in enumerate(filters['institutes'])})
+        placeholders = ', '.join(f':inst{i}' for i in range(len(filters['institutes'])))
+        conditions.append(f'{alias}.institute IN ({placeholders})')
+    if filters['verified_only']:
+        conditions.append(f'{alias}.verified = 1')
+    return ''.join(f' AND {condition}' for condition in conditions)
+
+# ---------- Подбор анкет на стороне SQLite ----------
+# Пулы для get_candidate_pools: лайкнутые (2) и дизлайкнутые (1) берутся из
+# своих строк пользователя, новые (0) — анти-join профилей с его оценками.
+_LIKED_SQL = '''
+    SELECT l.liked_user_id, 2 FROM likes l JOIN profiles p ON p.user_id = l.liked_user_id
+    WHERE l.user_id = :user_id AND p.compat_class IN ({classes}) {filters}
+'''
+_DISLIKED_SQL = '''
+    SELECT d.disliked_user_id, 1 FROM dislikes d JOIN profiles p ON p.user_id = d.disliked_user_id
+    WHERE d.user_id = :user_id AND p.compat_class IN ({classes}) {filters}
+      AND d.disliked_user_id NOT IN (SELECT liked_user_id FROM likes WHERE user_id = :user_id)
+'''
+_NEW_SQL = '''
+    SELECT p.user_id, 0 FROM profiles p
+    WHERE p.compat_class IN ({classes}) AND p.user_id != :user_id {filters} {window}
+      AND p.user_id NOT IN (SELECT liked_user_id FROM likes WHERE user_id = :user_id)
+      AND p.user_id NOT IN (SELECT disliked_user_id FROM dislikes WHERE user_id = :user_id)
+'''
+# Случайная точка между минимальным и максимальным user_id (min и max по
+# первичному ключу — отдельными подзапросами, так SQLite берёт их из индекса)
+_WINDOW_START = (
+    '(SELECT min(user_id) FROM profiles) + CAST(:offset * '
+    '((SELECT max(user_id) FROM profiles) - (SELECT min(user_id) FROM profiles)) AS INTEGER)'
+)
+
+async def get_candidate_pools(user_id: int, classes: Tuple[int, ...], limit: Optional[int] = None,
+                              filters: Optional[Dict[str, Any]] = None, active_since: Optional[str] = None
+                              ) -> Tuple[List[int], List[int], List[int]]:
+    """(новые, дизлайкнутые, лайкнутые) анкеты классов совместимости classes одним запросом.
+
+    filters — фильтры просмотра (get_browse_filters), active_since — нижняя
+    граница last_active (_filters_sql); проверяются в том же запросе.
+
+    С limit в каждом пуле не больше limit id: лайкнутые и дизлайкнутые —
+    случайная выборка, новые — limit анкет подряд по user_id начиная со
+    случайной точки (с переходом в начало). Так SQLite не сортирует и не
+    отдаёт в Python всю таблицу анкет.
+    """
+    if not classes:
+        return [], [], []
+    params = {'user_id': user_id, 'limit': limit, 'offset': random.random()}
+    params.update({f'c{i}': code for i, code in enumerate(classes)})
+    placeholders = ', '.join(f':c{i}' for i in range(len(classes)))
+    conditions = _filters_sql(filters, params, active_since=active_since)
+    liked_sql, disliked_sql = (part.format(classes=placeholders, filters=conditions) for part in (_LIKED_SQL, _DISLIKED_SQL))
+    if limit is None:
+        new_sql = _NEW_SQL.format(classes=placeholders, filters=conditions, window='')
+        sql = ' UNION ALL '.join((liked_sql, disliked_sql, new_sql))
+    else:
+        parts = [f'SELECT * FROM ({part} ORDER BY random() LIMIT :limit)' for part in (liked_sql, disliked_sql)]
+        for op in ('>=', '<'):
+            new_sql = _NEW_SQL.format(classes=placeholders, filters=conditions, window=f'AND p.user_id {op} {_WINDOW_START}')
+            parts.append(f'SELECT * FROM ({new_sql} ORDER BY p.user_id LIMIT :limit)')
+        sql = ' UNION ALL '.join(parts)
+    pools = ([], [], [])
+    async with pool.read() as db:
+        async with db.execute(sql, params) as cursor:
+            async for candidate_id, kind in cursor:
+                pools[kind].append(candidate_id)
+    if limit is not None:
+        del pools[0][limit:]
+    # Оценки, ещё не записанные из буфера
+    liked = {target for (uid, target), _ in swipes.pending('likes') if uid == user_id}
+    disliked = {target for (uid, target), _ in swipes.pending('dislikes') if uid == user_id} - liked
+    if liked or disliked:
+        new_ids, disliked_ids, liked_ids = pools
+        pools = (
+            [uid for uid in new_ids if uid not in liked and uid not in disliked],
+            [uid for uid in disliked_ids if uid not in liked] + [uid for uid in new_ids if uid in disliked],
+            liked_ids + [uid for uid in new_ids + disliked_ids if uid in liked],
+        )
+    return pools
+
+# ---------- Поиск по описанию (FTS5, profiles_fts) ----------
+# Индекс profiles_fts держат в актуальном виде триггеры на profiles
+# (миграция 12), поэтому save_profile и delete_profile о нём не знают.
+# bm25 считается для каждого совпадения, а частое слово («музыка») есть в
+# десятках тысяч анкет — поэтому ранжируются только SEARCH_WINDOW самых
+# новых подходящих анкет (FTS5 отдаёт их по rowid = user_id с конца)
+SEARCH_LIMIT = 50
+SEARCH_WINDOW = 1000
+SEARCH_MAX_TERMS = 8
+_WORD_RE = re.compile(r'\w+')
+
+
+def _fts_query(text: str) -> Optional[str]:
+    """Запрос FTS5 из слов пользователя: любое из слов, каждое — как префикс.
+
+    У слов длиннее 4 букв отрезается последняя: «музыку» найдёт и «музыка»,
+    а анкеты, где совпало больше слов, bm25 поставит выше. Слова берутся в
+    кавычки, так что синтаксис FTS5 (AND, NEAR, *) из ввода не применяется.
+    """
+    words = _WORD_RE.findall(text.lower())[:SEARCH_MAX_TERMS]
+    if not words:
+        return None
+    return ' OR '.join(f'"{word[:-1] if len(word) > 4 else word}"*' for word in words)
+
+
+async def search_profiles(user_id: int, text: str, classes: Tuple[int, ...], limit: int = SEARCH_LIMIT,
+                          filters: Optional[Dict[str, Any]] = None, active_since: Optional[str] = None) -> List[int]:
+    """Анкеты классов classes, в описании которых есть слова из text, — самые подходящие (bm25) первыми."""
+    query = _fts_query(text)
+    if not query or not classes:
+        return []
+    params = {'user_id': user_id, 'query': query, 'limit': limit, 'window': SEARCH_WINDOW}
+    params.update({f'c{i}': code for i, code in enumerate(classes)})
+    placeholders = ', '.join(f':c{i}' for i in range(len(classes)))
+    conditions = _filters_sql(filters, params, active_since=active_since)
+    sql = f'''
+        SELECT user_id FROM (
+            SELECT p.user_id, f.rank AS score FROM profiles_fts f JOIN profiles p ON p.user_id = f.rowid
+            WHERE profiles_fts MATCH :query AND p.compat_class IN ({placeholders})
+              AND p.user_id != :user_id{conditions}
+            ORDER BY f.rowid DESC LIMIT :window
+        ) ORDER BY score LIMIT :limit
+    '''
+    async with pool.read() as db:
+        async with db.execute(sql, params) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+# ---------- Очередь новых анкет (CANDIDATE_QUEUE) ----------
+# Кому анкета :user_id взаимно подходит (и кто её ещё не оценил)
+_QUEUE_VIEWERS_SQL = '''
+    INSERT OR IGNORE INTO candidate_queue (user_id, candidate_id)
+    SELECT v.user_id, :user_id FROM profiles v
+    WHERE v.compat_class IN ({classes}) AND v.user_id != :user_id
+      AND NOT EXISTS (SELECT 1 FROM likes WHERE user_id = v.user_id AND liked_user_id = :user_id)
+      AND NOT EXISTS (SELECT 1 FROM dislikes WHERE user_id = v.user_id AND disliked_user_id = :user_id)
+'''
+# Очередь самого :user_id — те же анти-join'ы, что и в _NEW_SQL
+_QUEUE_OWN_SQL = '''
+    INSERT OR IGNORE INTO candidate_queue (user_id, candidate_id)
+    SELECT :user_id, p.user_id FROM profiles p
+    WHERE p.compat_class IN ({classes}) AND p.user_id != :user_id
+      AND p.user_id NOT IN (SELECT liked_user_id FROM likes WHERE user_id = :user_id)
+      AND p.user_id NOT IN (SELECT disliked_user_id FROM dislikes WHERE user_id = :user_id)
+'''
+
+async def _fan_out(db, user_id: int, existed: bool, compat_class: int):
+    """Обновляет очереди после смены класса анкеты в save_profile (existed — анкета была и раньше).
+
+    Совместимость взаимная, поэтому очереди в обе стороны строятся по одному
+    списку классов compat.MUTUAL. Оценки, которые ещё лежат в swipes,
+    анти-join'ы не видят, но вместе с ними в буфере лежат и их 'unqueue' —
+    лишние строки удалятся при сбросе.
+    """
+    if existed:
+        await db.execute('DELETE FROM candidate_queue WHERE user_id = ? OR candidate_id = ?', (user_id, user_id))
+    classes = compat.MUTUAL[compat_class]
+    if not classes:
+        return
+    params = {'user_id': user_id}
+    params.update({f'c{i}': code for i, code in enumerate(classes)})
+    placeholders = ', '.join(f':c{i}' for i in range(len(classes)))
+    for template in (_QUEUE_VIEWERS_SQL, _QUEUE_OWN_SQL):
+        await db.execute(template.format(classes=placeholders), params)
+
+async def _rebuild_candidate_queue(db) -> int:
+    """Заполняет candidate_queue заново по profiles, likes и dislikes. Возвращает число строк."""
+    await db.execute('DELETE FROM candidate_queue')
+    for compat_class, classes in compat.MUTUAL.items():
+        if not classes:
+            continue
+        placeholders = ', '.join('?' * len(classes))
+        await db.execute(f'''
+            INSERT OR IGNORE INTO candidate_queue (user_id, candidate_id)
+            SELECT v.user_id, p.user_id FROM profiles v CROSS JOIN profiles p
+            WHERE v.compat_class = ? AND p.compat_class IN ({placeholders}) AND p.user_id != v.user_id
+              AND NOT EXISTS (SELECT 1 FROM likes WHERE user_id = v.user_id AND liked_user_id = p.user_id)
+              AND NOT EXISTS (SELECT 1 FROM dislikes WHERE user_id = v.user_id AND disliked_user_id = p.user_id)
+        ''', (compat_class, *classes))
+    async with db.execute('SELECT COUNT(*) FROM candidate_queue') as cursor:
+        return (await cursor.fetchone())[0]
+
+async def _sync_candidate_queue():
+    """Приводит очередь в соответствие с CANDIDATE_QUEUE: включённую заполняет, выключенную очищает."""
+    async with pool.read() as db:
+        async with db.execute('SELECT 1 FROM candidate_queue LIMIT 1') as cursor:
+            filled = await cursor.fetchone() is not None
+    if filled == CANDIDATE_QUEUE:
+        return
+    await swipes.flush()
+    async with pool.write() as db:
+        if CANDIDATE_QUEUE:
+            await _rebuild_candidate_queue(db)
+        else:
+            await db.execute('DELETE FROM candidate_queue')
+
+async def get_candidate_queue(user_id: int, filters: Optional[Dict[str, Any]] = None,
+                              active_since: Optional[str] = None) -> List[int]:
+    """Новые анкеты из очереди user_id (с учётом ещё не записанных оценок, фильтров просмотра filters,
+    active_since и недоступных пользователей)."""
+    params = {'user_id': user_id}
+    conditions = _filters_sql(filters, params, active_since=active_since)
+    sql = ('SELECT q.candidate_id FROM candidate_queue q JOIN profiles p ON p.user_id = q.candidate_id '
+           f'WHERE q.user_id = :user_id{conditions}')
+    async with pool.read() as db:
+        async with db.execute(sql, params) as cursor:
+            queue = [row[0] for row in await cursor.fetchall()]
+    rated = {target for (uid, target), _ in swipes.pending('unqueue') if uid == user_id}
+    if rated:
+        queue = [candidate_id for candidate_id in queue if candidate_id not in rated]
+    return queue
 
 # ---------- Статистика ----------
 async def get_user_stats() -> Dict[str, Any]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.read() as db:
         async with db.execute('SELECT COUNT(*) FROM profiles') as cursor:
             total = (await cursor.fetchone())[0]
         async with db.execute('SELECT gender, COUNT(*) FROM profiles GROUP BY gender') as cursor:
@@ -328,34 +634,34 @@ async def get_user_stats() -> Dict[str, Any]:
         return {'total': total, 'gender': gender_stats}
 
 async def get_all_usernames(bot: Bot) -> dict:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.read() as db:
         async with db.execute('SELECT user_id, name FROM profiles') as cursor:
             rows = await cursor.fetchall()
-            result = {}
-            for user_id, name in rows:
-                try:
-                    chat = await bot.get_chat(user_id)
-                    if chat.username:
-                        display = f"{name} (@{chat.username})"
-                    else:
-                        display = f"{name} (нет username)"
-                except Exception:
-                    display = f"{name} (чат недоступен)"
-                result[user_id] = display
-            return result
+    # Запросы к Telegram идут уже после возврата соединения в пул
+    result = {}
+    for user_id, name in rows:
+        try:
+            chat = await bot.get_chat(user_id)
+            if chat.username:
+                display = f"{name} (@{chat.username})"
+            else:
+                display = f"{name} (нет username)"
+        except Exception:
+            display = f"{name} (чат недоступен)"
+        result[user_id] = display
+    return result
 
 # ---------- Задания на встречу (meet_tasks) ----------
 async def create_meet_task(user1_id: int, user2_id: int, initiator_id: int, institute: str, location: str, deadline: datetime.datetime, msg1_id: int = None, msg2_id: int = None):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write() as db:
         cursor = await db.execute(
             'INSERT INTO meet_tasks (user1_id, user2_id, initiator_id, institute, location, status, deadline, user1_confirmed, user2_confirmed, msg1_id, msg2_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
             (user1_id, user2_id, initiator_id, institute, location, 'pending', deadline, 0, 0, msg1_id, msg2_id)
         )
-        await db.commit()
         return cursor.lastrowid
 
 async def get_meet_task_by_id(task_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.read() as db:
         async with db.execute('SELECT * FROM meet_tasks WHERE id = ?', (task_id,)) as cursor:
             row = await cursor.fetchone()
             if row:
@@ -364,7 +670,7 @@ async def get_meet_task_by_id(task_id: int):
             return None
 
 async def get_active_meet_task_for_user(user_id: int, status: str = 'waiting_video'):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.read() as db:
         async with db.execute(
             'SELECT * FROM meet_tasks WHERE (user1_id = ? OR user2_id = ?) AND status = ? AND deadline > CURRENT_TIMESTAMP',
             (user_id, user_id, status)
@@ -376,7 +682,7 @@ async def get_active_meet_task_for_user(user_id: int, status: str = 'waiting_vid
             return None
 
 async def update_meet_task_status(task_id: int, status: str, video_message_id: int = None, admin_decision: int = None):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write() as db:
         query = 'UPDATE meet_tasks SET status = ?'
         params = [status]
         if video_message_id is not None:
@@ -388,7 +694,6 @@ async def update_meet_task_status(task_id: int, status: str, video_message_id: i
         query += ' WHERE id = ?'
         params.append(task_id)
         await db.execute(query, params)
-        await db.commit()
 
 async def update_meet_agreement(task_id: int, user_id: int, agreed: bool):
     """Обновляет статус согласия пользователя в задании.
@@ -398,63 +703,52 @@ async def update_meet_agreement(task_id: int, user_id: int, agreed: bool):
          - 'declined', если пользователь отказался (статус задания меняется на declined)
          - None, если задание не найдено или уже не в статусе pending
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        # BEGIN IMMEDIATE: исключает гонку при одновременном нажатии обоими
-        await db.execute('BEGIN IMMEDIATE')
-        try:
-            async with db.execute('SELECT user1_id, user2_id, status FROM meet_tasks WHERE id = ?', (task_id,)) as cursor:
-                row = await cursor.fetchone()
-                if not row:
-                    await db.execute('ROLLBACK')
-                    return None
-                user1, user2, status = row
-
-            if status != 'pending':
-                await db.execute('ROLLBACK')
-                return None  # уже обработано
-
-            if user_id == user1:
-                column = 'user1_confirmed'
-            elif user_id == user2:
-                column = 'user2_confirmed'
-            else:
-                await db.execute('ROLLBACK')
+    # pool.write() открывает BEGIN IMMEDIATE: исключает гонку при одновременном
+    # нажатии обоими; при любом return ниже транзакция коммитится, при исключении — откатывается
+    async with pool.write() as db:
+        async with db.execute('SELECT user1_id, user2_id, status FROM meet_tasks WHERE id = ?', (task_id,)) as cursor:
+            row = await cursor.fetchone()
+            if not row:
                 return None
+            user1, user2, status = row
 
-            # Allowlist: column должен быть одним из двух допустимых значений
-            assert column in {'user1_confirmed', 'user2_confirmed'}
-
-            if agreed:
-                await db.execute(f'UPDATE meet_tasks SET {column} = 1 WHERE id = ?', (task_id,))
-                async with db.execute('SELECT user1_confirmed, user2_confirmed FROM meet_tasks WHERE id = ?', (task_id,)) as cursor:
-                    row = await cursor.fetchone()
-                    if row and row[0] == 1 and row[1] == 1:
-                        await db.execute('UPDATE meet_tasks SET status = ? WHERE id = ?', ('waiting_video', task_id))
-                        await db.execute('COMMIT')
-                        return 'both_agreed'
-                await db.execute('COMMIT')
-                return 'agreed'
-            else:
-                await db.execute('UPDATE meet_tasks SET status = ? WHERE id = ?', ('declined', task_id))
-                await db.execute('COMMIT')
-                return 'declined'
-        except Exception:
-            await db.execute('ROLLBACK')
-            raise
+        if status != 'pending':
+            return None  # уже обработано
+
+        if user_id == user1:
+            column = 'user1_confirmed'
+        elif user_id == user2:
+            column = 'user2_confirmed'
+        else:
+            return None
+
+        # Allowlist: column должен быть одним из двух допустимых значений
+        assert column in {'user1_confirmed', 'user2_confirmed'}
+
+        if agreed:
+            await db.execute(f'UPDATE meet_tasks SET {column} = 1 WHERE id = ?', (task_id,))
+            async with db.execute('SELECT user1_confirmed, user2_confirmed FROM meet_tasks WHERE id = ?', (task_id,)) as cursor:
+                row = await cursor.fetchone()
+                if row and row[0] == 1 and row[1] == 1:
+                    await db.execute('UPDATE meet_tasks SET status = ? WHERE id = ?', ('waiting_video', task_id))
+                    return 'both_agreed'
+            return 'agreed'
+        else:
+            await db.execute('UPDATE meet_tasks SET status = ? WHERE id = ?', ('declined', task_id))
+            return 'declined'
 
 # ---------- Очки ----------
 async def add_points(user_id: int, points: int):
     year_month = datetime.datetime.now().strftime('%Y-%m')
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write() as db:
         await db.execute('''
             INSERT INTO user_points (user_id, year_month, points) VALUES (?, ?, ?)
             ON CONFLICT(user_id, year_month) DO UPDATE SET points = points + ?
         ''', (user_id, year_month, points, points))
-        await db.commit()
 
 async def get_top_users(limit: int = 10):
     year_month = datetime.datetime.now().strftime('%Y-%m')
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.read() as db:
         async with db.execute(
             'SELECT user_id, points FROM user_points WHERE year_month = ? ORDER BY points DESC LIMIT ?',
             (year_month, limit)
@@ -463,30 +757,48 @@ async def get_top_users(limit: int = 10):
             return [(row[0], row[1]) for row in rows]
 
 async def reset_all_points():
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write() as db:
         await db.execute('DELETE FROM user_points')
-        await db.commit()
 
 # ---------- Удаление профиля ----------
 async def delete_profile(user_id: int):
     """Полностью удаляет профиль пользователя и все связанные записи."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Удаляем из таблиц likes, dislikes, ratings, meet_tasks, user_points, profiles
+    for kind in ('likes', 'dislikes', 'views'):
+        swipes.discard(kind, lambda key: user_id in key)
+    swipes.discard('desirability', lambda key: key == user_id)
+    swipes.discard('unqueue', lambda key: user_id in key)
+    swipes.discard('interactions', lambda key: user_id in key[1:])
+    desirability_cache.invalidate(user_id)
+    seen.forget(user_id)
+    exposure.forget(user_id)
+    delivery.forget(user_id)
+    async with pool.write() as db:
+        # Удаляем из таблиц likes, dislikes, ratings, meet_tasks, user_points, seen_bitmaps, user_index, recommendations, candidate_queue, profile_impressions, interaction_log, browse_filters, delivery_health, profiles
         await db.execute('DELETE FROM likes WHERE user_id = ? OR liked_user_id = ?', (user_id, user_id))
         await db.execute('DELETE FROM dislikes WHERE user_id = ? OR disliked_user_id = ?', (user_id, user_id))
         await db.execute('DELETE FROM ratings WHERE from_user_id = ? OR to_user_id = ?', (user_id, user_id))
         await db.execute('DELETE FROM meet_tasks WHERE user1_id = ? OR user2_id = ? OR initiator_id = ?', (user_id, user_id, user_id))
         await db.execute('DELETE FROM user_points WHERE user_id = ?', (user_id,))
+        await db.execute('DELETE FROM seen_bitmaps WHERE user_id = ?', (user_id,))
+        await db.execute('DELETE FROM user_index WHERE user_id = ?', (user_id,))
+        await db.execute('DELETE FROM recommendations WHERE user_id = ?', (user_id,))
+        await db.execute('DELETE FROM candidate_queue WHERE user_id = ? OR candidate_id = ?', (user_id, user_id))
+        await db.execute('DELETE FROM profile_impressions WHERE user_id = ?', (user_id,))
+        await db.execute('DELETE FROM interaction_log WHERE viewer_id = ? OR target_id = ?', (user_id, user_id))
+        await db.execute('DELETE FROM browse_filters WHERE user_id = ?', (user_id,))
+        await db.execute('DELETE FROM delivery_health WHERE user_id = ?', (user_id,))
         await db.execute('DELETE FROM profiles WHERE user_id = ?', (user_id,))
-        await db.commit()
+    _profile_changed(user_id)
 
 # ---------- Горячие сегодня (фича 1) ----------
 async def get_hot_profiles(limit: int = 3) -> List[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.read() as db:
         async with db.execute(
             "SELECT liked_user_id, COUNT(*) as cnt FROM likes "
             "WHERE created_at >= datetime('now', '-24 hours') "
-            "GROUP BY liked_user_id ORDER BY cnt DESC LIMIT ?",
+            # «+» не даёт планировщику выбрать полный обход индекса ради GROUP BY
+            # вместо диапазона по idx_likes_created
+            "GROUP BY +liked_user_id ORDER BY cnt DESC LIMIT ?",
             (limit,)
         ) as cursor:
             rows = await cursor.fetchall()
@@ -497,7 +809,7 @@ async def update_streak(user_id: int) -> dict:
     """Обновляет стрик пользователя. Возвращает {current, milestone}."""
     today = datetime.date.today().isoformat()
     yesterday = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write() as db:
         async with db.execute('SELECT current_streak, longest_streak, last_active_date FROM user_streaks WHERE user_id = ?', (user_id,)) as cursor:
             row = await cursor.fetchone()
         if row:
@@ -519,7 +831,6 @@ async def update_streak(user_id: int) -> dict:
                 'INSERT INTO user_streaks (user_id, current_streak, longest_streak, last_active_date) VALUES (?, ?, ?, ?)',
                 (user_id, current, longest, today)
             )
-        await db.commit()
 
     milestone = None
     if current in (7, 30):
@@ -527,7 +838,7 @@ async def update_streak(user_id: int) -> dict:
     return {'current': current, 'milestone': milestone}
 
 async def get_streak(user_id: int) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.read() as db:
         async with db.execute('SELECT current_streak FROM user_streaks WHERE user_id = ?', (user_id,)) as cursor:
             row = await cursor.fetchone()
             return row[0] if row else 0
@@ -535,7 +846,7 @@ async def get_streak(user_id: int) -> int:
 # ---------- Счётчик входящих лайков (фича 4) ----------
 async def count_pending_likes(user_id: int) -> int:
     """Количество пользователей, лайкнувших user_id, которым user_id ещё не ответил лайком."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.read() as db:
         async with db.execute(
             'SELECT COUNT(*) FROM likes WHERE liked_user_id = ? '
             'AND user_id NOT IN (SELECT liked_user_id FROM likes WHERE user_id = ?)',
@@ -547,7 +858,7 @@ async def count_pending_likes(user_id: int) -> int:
 # ---------- Топ института (фича 5) ----------
 async def get_top_users_by_institute(institute: str, limit: int = 10) -> List[tuple]:
     year_month = datetime.datetime.now().strftime('%Y-%m')
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.read() as db:
         async with db.execute(
             'SELECT p.user_id, p.name, up.points FROM profiles p '
             'JOIN user_points up ON p.user_id = up.user_id '
@@ -561,17 +872,16 @@ async def get_top_users_by_institute(institute: str, limit: int = 10) -> List[tu
 # ---------- Бейджи (фича 6) ----------
 async def award_badge(user_id: int, badge_type: str) -> bool:
     """Выдаёт бейдж. Возвращает True если бейдж новый."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write() as db:
         async with db.execute('SELECT 1 FROM user_badges WHERE user_id = ? AND badge_type = ?', (user_id, badge_type)) as cursor:
             exists = await cursor.fetchone()
         if exists:
             return False
         await db.execute('INSERT INTO user_badges (user_id, badge_type) VALUES (?, ?)', (user_id, badge_type))
-        await db.commit()
         return True
 
 async def get_user_badges(user_id: int) -> List[str]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.read() as db:
         async with db.execute('SELECT badge_type FROM user_badges WHERE user_id = ?', (user_id,)) as cursor:
             rows = await cursor.fetchall()
             return [row[0] for row in rows]
@@ -579,7 +889,7 @@ async def get_user_badges(user_id: int) -> List[str]:
 # ---------- Ежедневные задания (фича 7) ----------
 async def get_daily_task_completions(user_id: int) -> List[str]:
     today = datetime.date.today().isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.read() as db:
         async with db.execute(
             'SELECT task_type FROM daily_task_completions WHERE user_id = ? AND task_date = ?',
             (user_id, today)
@@ -590,7 +900,7 @@ async def get_daily_task_completions(user_id: int) -> List[str]:
 async def complete_daily_task(user_id: int, task_type: str) -> bool:
     """Отмечает задание выполненным. Возвращает True если впервые сегодня."""
     today = datetime.date.today().isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write() as db:
         async with db.execute(
             'SELECT 1 FROM daily_task_completions WHERE user_id = ? AND task_date = ? AND task_type = ?',
             (user_id, today, task_type)
@@ -602,18 +912,24 @@ async def complete_daily_task(user_id: int, task_type: str) -> bool:
             'INSERT INTO daily_task_completions (user_id, task_date, task_type) VALUES (?, ?, ?)',
             (user_id, today, task_type)
         )
-        await db.commit()
         return True
 
 async def count_today_likes(user_id: int) -> int:
-    today = datetime.date.today().isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
+    today = datetime.date.today()
+    tomorrow = today + datetime.timedelta(days=1)
+    start, end = today.isoformat(), tomorrow.isoformat()
+    async with pool.read() as db:
+        # Диапазон вместо date(created_at) = ?, чтобы работал индекс (user_id, created_at)
         async with db.execute(
-            "SELECT COUNT(*) FROM likes WHERE user_id = ? AND date(created_at) = ?",
-            (user_id, today)
+            "SELECT liked_user_id FROM likes WHERE user_id = ? AND created_at >= ? AND created_at < ?",
+            (user_id, start, end)
         ) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else 0
+            liked = {row[0] for row in await cursor.fetchall()}
+    liked.update(
+        target for (uid, target), (_, _, created_at) in swipes.pending('likes')
+        if uid == user_id and start <= created_at < end
+    )
+    return len(liked)
 
 # ---------- Сезонные события (фича 8) ----------
 def get_seasonal_info() -> dict:
@@ -628,7 +944,7 @@ def get_seasonal_info() -> dict:
 # ---------- Рулетка (фича 9) ----------
 async def can_use_roulette(user_id: int) -> bool:
     today = datetime.date.today().isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.read() as db:
         async with db.execute('SELECT last_date FROM roulette_cooldowns WHERE user_id = ?', (user_id,)) as cursor:
             row = await cursor.fetchone()
             if row and row[0] == today:
@@ -637,18 +953,21 @@ async def can_use_roulette(user_id: int) -> bool:
 
 async def set_roulette_used(user_id: int):
     today = datetime.date.today().isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write() as db:
         await db.execute(
             'INSERT OR REPLACE INTO roulette_cooldowns (user_id, last_date) VALUES (?, ?)',
             (user_id, today)
         )
-        await db.commit()
 
 async def get_random_profile_other_institute(user_id: int, own_institute: str) -> Optional[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    # IN по остальным институтам вместо institute != ?, чтобы работал индекс по institute
+    others = [inst for inst in INSTITUTES if inst != own_institute]
+    placeholders = ', '.join('?' for _ in others)
+    async with pool.read() as db:
         async with db.execute(
-            'SELECT user_id FROM profiles WHERE institute != ? AND user_id != ?',
-            (own_institute, user_id)
+            f'SELECT user_id FROM profiles WHERE institute IN ({placeholders}) AND user_id != ? '
+            f'AND user_id NOT IN ({_UNREACHABLE_SQL})',
+            (*others, user_id)
         ) as cursor:
             rows = await cursor.fetchall()
             if not rows:
@@ -657,14 +976,14 @@ async def get_random_profile_other_institute(user_id: int, own_institute: str) -
 
 # ---------- Верификация (фича 10) ----------
 async def set_verified(user_id: int, verified: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write() as db:
         await db.execute('UPDATE profiles SET verified = ? WHERE user_id = ?', (verified, user_id))
-        await db.commit()
+    _profile_changed(user_id)
 
 async def save_verification_request(user_id: int, photo_file_id: str, photo_path: str = None):
     """Сохраняет запрос на верификацию для обработки ModeratorBot.
     Обновляет фото если уже есть ожидающий запрос от этого пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write() as db:
         async with db.execute(
             "SELECT id FROM pending_verifications WHERE user_id = ? AND status = 'pending'",
             (user_id,)
@@ -680,21 +999,18 @@ async def save_verification_request(user_id: int, photo_file_id: str, photo_path
                 'INSERT INTO pending_verifications (user_id, photo_file_id, photo_path) VALUES (?, ?, ?)',
                 (user_id, photo_file_id, photo_path)
             )
-        await db.commit()
 
 # ---------- Кто смотрел (фича 12) ----------
 async def record_profile_view(viewer_id: int, viewed_id: int):
     if viewer_id == viewed_id:
         return
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            'INSERT OR REPLACE INTO profile_views (viewer_id, viewed_id, viewed_at) VALUES (?, ?, CURRENT_TIMESTAMP)',
-            (viewer_id, viewed_id)
-        )
-        await db.commit()
+    await swipes.add('views', (viewer_id, viewed_id), (viewer_id, viewed_id, _utc_timestamp()), replace=True)
+    await seen.add(viewer_id, 'views', viewed_id)
+    await exposure.record(viewed_id)
+    await log_interaction(viewer_id, viewed_id, 'shown')
 
 async def get_recent_viewers(user_id: int, limit: int = 5) -> List[dict]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.read() as db:
         async with db.execute(
             'SELECT pv.viewer_id, p.name, pv.viewed_at FROM profile_views pv '
             'JOIN profiles p ON pv.viewer_id = p.user_id '
@@ -706,6 +1022,6 @@ async def get_recent_viewers(user_id: int, limit: int = 5) -> List[dict]:
 
 # ---------- Видео в анкете (фича 13) ----------
 async def save_profile_video(user_id: int, video_file_id: Optional[str]):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write() as db:
         await db.execute('UPDATE profiles SET video_file_id = ? WHERE user_id = ?', (video_file_id, user_id))
-        await db.commit()
\ No newline at end of file
+    _profile_changed(user_id)
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import random
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+
+import aiosqlite
+
+# Размер кэша подготовленных выражений sqlite3 на одно соединение.
+# Соединения живут всё время работы бота, поэтому повторяющиеся запросы
+# компилируются один раз и дальше берутся из кэша.
+STATEMENT_CACHE_SIZE = 256
+
+# Прагмы для всех соединений. busy_timeout — ожидание блокировки внутри SQLite,
+# поверх него работают повторы с backoff (см. ConnectionPool._retry_busy).
+BUSY_TIMEOUT_MS = 2000
+CACHE_SIZE_KB = 16 * 1024
+MMAP_SIZE = 64 * 1024 * 1024
+
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.05  # секунды, удваивается на каждой попытке
+
+
+def _is_busy(error: Exception) -> bool:
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class ConnectionPool:
+    """Соединения с БД: один писатель и несколько читателей.
+
+    В режиме WAL (по умолчанию) все записи идут через единственное
+    соединение-писатель: `async with pool.write() as db:` встаёт в очередь
+    (asyncio.Lock отдаёт его в порядке FIFO), открывает BEGIN IMMEDIATE и
+    коммитит при выходе, откатывает при исключении. Чтение идёт через
+    пул read-only соединений `async with pool.read() as db:` и не блокируется
+    писателем. Если wal=False, чтение тоже идёт через писателя.
+
+    Соединения открываются один раз (в main.py при старте). Если пул не был
+    открыт явно (скрипты, ModeratorBot), он откроется при первом обращении.
+    """
+
+    def __init__(self, path: str, readers: int = 3, wal: bool = True):
+        self.path = path
+        self.readers = readers
+        self.wal = wal
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._reader_conns: List[aiosqlite.Connection] = []
+        self._idle_readers: Optional[asyncio.Queue] = None
+        self._write_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        self._stats: Dict[str, float] = dict.fromkeys((
+            'reads', 'writes', 'read_waits', 'write_waits',
+            'write_wait_ms', 'max_write_wait_ms', 'busy_retries', 'busy_failures',
+        ), 0)
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _apply_pragmas(self, db: aiosqlite.Connection):
+        await db.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        await db.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+        await db.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        await db.execute('PRAGMA temp_store = MEMORY')
+
+    async def open(self):
+        async with self._open_lock:
+            if self.is_open:
+                return
+            # isolation_level=None: транзакциями управляет write(), а не модуль sqlite3
+            writer = await aiosqlite.connect(
+                self.path, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE
+            )
+            await self._apply_pragmas(writer)
+            if self.wal:
+                await writer.execute('PRAGMA journal_mode = WAL')
+                await writer.execute('PRAGMA synchronous = NORMAL')
+                idle = asyncio.Queue()
+                uri = Path(self.path).absolute().as_uri() + '?mode=ro'
+                for _ in range(self.readers):
+                    reader = await aiosqlite.connect(
+                        uri, uri=True, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE
+                    )
+                    await self._apply_pragmas(reader)
+                    self._reader_conns.append(reader)
+                    idle.put_nowait(reader)
+                self._idle_readers = idle
+            self._writer = writer
+            mode = f"WAL, читателей: {self.readers}" if self.wal else "rollback journal"
+            logging.info(f"Пул соединений открыт: {self.path} ({mode})")
+
+    async def close(self):
+        async with self._open_lock:
+            if not self.is_open:
+                return
+            for reader in self._reader_conns:
+                await reader.close()
+            self._reader_conns.clear()
+            self._idle_readers = None
+            await self._writer.close()
+            self._writer = None
+
+    async def _retry_busy(self, sql: str):
+        """Выполняет служебную команду писателя, повторяя её при SQLITE_BUSY/LOCKED."""
+        for attempt in range(BUSY_RETRIES + 1):
+            try:
+                await self._writer.execute(sql)
+                return
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e) or attempt == BUSY_RETRIES:
+                    if _is_busy(e):
+                        self._stats['busy_failures'] += 1
+                    raise
+                self._stats['busy_retries'] += 1
+                delay = BUSY_BACKOFF * (2 ** attempt)
+                await asyncio.sleep(delay + random.uniform(0, delay))
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[aiosqlite.Connection]:
+        if not self.is_open:
+            await self.open()
+        if self._write_lock.locked():
+            self._stats['write_waits'] += 1
+        started = time.perf_counter()
+        async with self._write_lock:
+            waited_ms = (time.perf_counter() - started) * 1000
+            self._stats['write_wait_ms'] += waited_ms
+            self._stats['max_write_wait_ms'] = max(self._stats['max_write_wait_ms'], waited_ms)
+            self._stats['writes'] += 1
+            db = self._writer
+            # ModeratorBot пишет в ту же БД из другого процесса — блокировку
+            # берём сразу и повторяем с backoff, если она занята
+            await self._retry_busy('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except BaseException:
+                if db.in_transaction:
+                    await db.execute('ROLLBACK')
+                raise
+            else:
+                if db.in_transaction:
+                    await self._retry_busy('COMMIT')
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[aiosqlite.Connection]:
+        if not self.is_open:
+            await self.open()
+        if not self.wal:
+            async with self.write() as db:
+                yield db
+            return
+        idle = self._idle_readers
+        if idle.empty():
+            self._stats['read_waits'] += 1
+        db = await idle.get()
+        self._stats['reads'] += 1
+        try:
+            yield db
+        finally:
+            idle.put_nowait(db)
+
+    async def set_trace_callback(self, callback):
+        """Передаёт callback в sqlite3 для всех соединений (отладка, проверка планов запросов)."""
+        if not self.is_open:
+            await self.open()
+        for db in [self._writer, *self._reader_conns]:
+            await db.set_trace_callback(callback)
+
+    def stats(self) -> Dict[str, float]:
+        """Счётчики конкуренции за соединения (для /stats и логов)."""
+        result = dict(self._stats)
+        result['write_wait_ms'] = round(result['write_wait_ms'], 1)
+        result['max_write_wait_ms'] = round(result['max_write_wait_ms'], 1)
+        return result
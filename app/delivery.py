@@ -0,0 +1,138 @@
+"""Доставляемость сообщений: кто заблокировал бота или стабильно недоступен.
+
+Пользователь, заблокировавший бота, остаётся в пулах других и на каждый
+лайк стоит отправки, которая заведомо упадёт. Здесь учитываются итоги
+отправок (handlers.send_profile_to_user, send_like_notification,
+send_superlike_notification):
+
+- TelegramForbiddenError — бот заблокирован: пользователь сразу недоступен;
+- ошибки, которые относятся к самому получателю (TelegramNotFound и
+  TelegramBadRequest с текстом из RECIPIENT_ERRORS), — неудачи подряд; после
+  MAX_FAILURES пользователь недоступен. Успешная отправка сбрасывает счётчик;
+- остальные ошибки не считаются: ошибка в самом сообщении (разметка чужого
+  описания, длинная подпись, битый file_id), сеть и сервер Telegram —
+  получатель в них не виноват.
+
+Недоступные не попадают в пулы (matching), рулетку и уведомления. Как только
+пользователь снова пишет боту или нажимает кнопку (handlers._DeliveryMiddleware),
+returned() возвращает его обратно.
+
+Состояние — таблица delivery_health (строка есть только у тех, у кого были
+неудачи) и её копия в памяти: множество недоступных для быстрой проверки и
+счётчики неудач. События редкие, поэтому пишутся сразу, без буфера: SQL-пулы
+(data._filters_sql) и рулетка видят таблицу без задержки. Переход между
+«доступен» и «недоступен» вызывает on_change(user_id) — data._profile_changed,
+чтобы индекс кандидатов перечитал анкету.
+"""
+import asyncio
+from typing import Any, Callable, Dict, Set
+
+# Неудач подряд, после которых пользователь считается недоступным
+MAX_FAILURES = 3
+# Тексты TelegramBadRequest, которые говорят о получателе, а не о сообщении
+RECIPIENT_ERRORS = ('chat not found', 'user is deactivated')
+
+
+def is_recipient_error(error: Exception) -> bool:
+    """Ошибка TelegramBadRequest из-за получателя (см. RECIPIENT_ERRORS), а не из-за сообщения."""
+    message = str(getattr(error, 'message', error)).lower()
+    return any(text in message for text in RECIPIENT_ERRORS)
+
+
+class DeliveryHealth:
+    """Недоступные пользователи (в памяти) и их учёт в таблице delivery_health."""
+
+    def __init__(self, pool, on_change: Callable[[int], None]):
+        self.pool = pool
+        self.on_change = on_change
+        self.unreachable: Set[int] = set()
+        self._failures: Dict[int, int] = {}
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._stats = dict.fromkeys(('blocked', 'failures', 'recovered'), 0)
+
+    def reset(self):
+        """Забывает состояние (бенчмарки переключают БД)."""
+        self.unreachable = set()
+        self._failures = {}
+        self._loaded = False
+
+    async def load(self):
+        async with self._lock:
+            if self._loaded:
+                return
+            async with self.pool.read() as db:
+                async with db.execute('SELECT user_id, failures, unreachable FROM delivery_health') as cursor:
+                    rows = await cursor.fetchall()
+            self.unreachable = {user_id for user_id, _, unreachable in rows if unreachable}
+            self._failures = {user_id: failures for user_id, failures, unreachable in rows
+                              if failures and not unreachable}
+            self._loaded = True
+
+    def is_unreachable(self, user_id: int) -> bool:
+        """Отправлять ли не стоит. До load() — всегда False."""
+        return user_id in self.unreachable
+
+    async def blocked(self, user_id: int, error: Exception):
+        """Отправка упала с TelegramForbiddenError."""
+        await self.load()
+        self._stats['blocked'] += 1
+        self._failures.pop(user_id, None)
+        await self._save(user_id, 1, 0, error)
+
+    async def failed(self, user_id: int, error: Exception):
+        """Отправка упала по причине на стороне получателя."""
+        await self.load()
+        self._stats['failures'] += 1
+        if user_id in self.unreachable:
+            return
+        failures = self._failures.get(user_id, 0) + 1
+        if failures >= MAX_FAILURES:
+            self._failures.pop(user_id, None)
+            await self._save(user_id, 0, failures, error)
+        else:
+            self._failures[user_id] = failures
+            async with self.pool.write() as db:
+                await db.execute(
+                    'INSERT OR REPLACE INTO delivery_health (user_id, failures, unreachable, last_error, updated_at) '
+                    'VALUES (?, ?, 0, ?, CURRENT_TIMESTAMP)', (user_id, failures, repr(error))
+                )
+
+    async def delivered(self, user_id: int):
+        """Отправка прошла: счётчик неудач подряд обнуляется."""
+        if user_id in self._failures:
+            await self._clear(user_id)
+
+    async def returned(self, user_id: int):
+        """Пользователь сам написал боту — значит, снова доступен. Вызывается на каждом обновлении."""
+        if not self._loaded:
+            await self.load()
+        if user_id in self.unreachable or user_id in self._failures:
+            self._stats['recovered'] += user_id in self.unreachable
+            await self._clear(user_id)
+
+    def forget(self, user_id: int):
+        """Забывает пользователя после удаления анкеты (строку в БД удаляет data.delete_profile)."""
+        self.unreachable.discard(user_id)
+        self._failures.pop(user_id, None)
+
+    async def _save(self, user_id: int, blocked: int, failures: int, error: Exception):
+        async with self.pool.write() as db:
+            await db.execute(
+                'INSERT OR REPLACE INTO delivery_health (user_id, blocked, failures, unreachable, last_error, updated_at) '
+                'VALUES (?, ?, ?, 1, ?, CURRENT_TIMESTAMP)', (user_id, blocked, failures, repr(error))
+            )
+        if user_id not in self.unreachable:
+            self.unreachable.add(user_id)
+            self.on_change(user_id)
+
+    async def _clear(self, user_id: int):
+        self._failures.pop(user_id, None)
+        async with self.pool.write() as db:
+            await db.execute('DELETE FROM delivery_health WHERE user_id = ?', (user_id,))
+        if user_id in self.unreachable:
+            self.unreachable.discard(user_id)
+            self.on_change(user_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, unreachable=len(self.unreachable), failing=len(self._failures))
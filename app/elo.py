@@ -0,0 +1,88 @@
+"""Привлекательность анкеты (desirability) в духе Elo.
+
+Каждый свайп — «партия» анкеты против оценившего: лайк — победа анкеты,
+дизлайк — поражение. Ожидаемый результат зависит от разницы их оценок,
+а шаг K умножается на вес оценившего: лайк от привлекательной анкеты
+значит больше. Меняется только оценка анкеты, которую оценили.
+
+update() — O(1) шаг на каждый add_like/add_dislike (см. data.py).
+replay() — полный пересчёт по всей истории likes/dislikes, векторно:
+события идут раундами по ROUND штук, внутри раунда все шаги считаются от
+оценок на начало раунда и складываются через np.add.at. Пересчёт:
+
+    python elo.py
+
+Бот держит текущие оценки в кэше (data.DESIRABILITY_CACHE_TTL), поэтому
+пересчитывать лучше при остановленном боте.
+"""
+import asyncio
+import logging
+from typing import Tuple
+
+import numpy as np
+
+BASE = 1500.0
+SCALE = 400.0
+K = 24.0
+# Вес оценившего: 10 ** ((его оценка - BASE) / VOTER_SCALE), в пределах VOTER_WEIGHT
+VOTER_SCALE = 800.0
+VOTER_WEIGHT = (0.5, 2.0)
+ROUND = 4096
+
+
+def expected(target: float, voter: float) -> float:
+    """Вероятность лайка, которую ожидает модель."""
+    return 1.0 / (1.0 + 10.0 ** ((voter - target) / SCALE))
+
+
+def voter_weight(voter: float) -> float:
+    return min(max(10.0 ** ((voter - BASE) / VOTER_SCALE), VOTER_WEIGHT[0]), VOTER_WEIGHT[1])
+
+
+def update(target: float, voter: float, liked: bool) -> float:
+    """Новая оценка анкеты target после лайка или дизлайка от voter."""
+    return target + K * voter_weight(voter) * ((1.0 if liked else 0.0) - expected(target, voter))
+
+
+def replay(voters: np.ndarray, targets: np.ndarray, outcomes: np.ndarray, size: int) -> np.ndarray:
+    """Оценки size анкет (плотные номера) после событий (voters[i] оценил targets[i], outcomes[i] = 1 — лайк)."""
+    scores = np.full(size, BASE)
+    for start in range(0, len(voters), ROUND):
+        v, t = voters[start:start + ROUND], targets[start:start + ROUND]
+        voter_scores, target_scores = scores[v], scores[t]
+        weight = np.clip(10.0 ** ((voter_scores - BASE) / VOTER_SCALE), *VOTER_WEIGHT)
+        exp = 1.0 / (1.0 + 10.0 ** ((voter_scores - target_scores) / SCALE))
+        np.add.at(scores, t, K * weight * (outcomes[start:start + ROUND] - exp))
+    return scores
+
+
+def interleave(likes: Tuple[np.ndarray, np.ndarray], dislikes: Tuple[np.ndarray, np.ndarray]):
+    """Одна лента событий: лайки по времени, дизлайки (у них нет времени) равномерно между ними."""
+    n_likes, n_dislikes = len(likes[0]), len(dislikes[0])
+    position = np.concatenate([
+        np.arange(n_likes) / max(n_likes, 1),
+        (np.arange(n_dislikes) + 0.5) / max(n_dislikes, 1),
+    ])
+    order = np.argsort(position, kind='stable')
+    voters = np.concatenate([likes[0], dislikes[0]])[order]
+    targets = np.concatenate([likes[1], dislikes[1]])[order]
+    outcomes = np.concatenate([np.ones(n_likes), np.zeros(n_dislikes)])[order]
+    return voters, targets, outcomes
+
+
+async def main():
+    from data import init_db, pool
+    from migrations import rebuild_desirability
+    await pool.open()
+    await init_db()
+    try:
+        async with pool.write() as db:
+            count = await rebuild_desirability(db)
+        logging.info(f"Привлекательность пересчитана для {count} анкет")
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
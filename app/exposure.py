@@ -0,0 +1,207 @@
+"""Выравнивание показов анкет.
+
+Ранжирование (ranking.py) раз за разом ставит вперёд одни и те же сильные
+анкеты: они набирают тысячи показов, а новые не получают ни одного. Здесь у
+каждой анкеты есть счётчик показов shown, +1 за каждый показ (в духе stride
+scheduling). Дефицит показов анкеты — насколько её счётчик ниже, чем у
+остальных анкет пула. schedule() отдаёт каждое SLOT_EVERY-е место в начале
+пула анкете с наибольшим дефицитом, доставая их из кучи (heapq) по shown.
+Остальные места идут в порядке ranking, а в пул попадают только те анкеты,
+которые в нём и так были.
+
+Холодный старт — тот же механизм: новая анкета начинает со среднего shown
+минус COLD_START (но не ниже нуля). Первые COLD_START показов она впереди
+всех, а дальше идёт наравне с остальными.
+
+Пул приходит массивом NumPy на десятки тысяч id, поэтому schedule() не
+обходит его в Python: счётчики пула берутся из копии в массивах (id по
+возрастанию, np.searchsorted), а в кучу попадают только HEAD анкет с
+наименьшим shown — больше за HEAD мест из неё не достать.
+
+Счётчики загружаются в память один раз (таблица profile_impressions) и
+пишутся через WriteBehindBuffer видом 'impressions': за один сброс — одна
+строка на анкету, сколько бы показов она ни набрала. Начальное значение
+новой анкеты живёт только в памяти и попадает в БД с первым показом:
+свежий пул на десятки тысяч новых анкет не превращается в столько же строк
+буфера.
+"""
+import asyncio
+import heapq
+from typing import Dict, Set
+
+import numpy as np
+
+COLD_START = 20.0
+# Каждое SLOT_EVERY-е место в начале пула — анкете с наибольшим дефицитом
+SLOT_EVERY = 2
+# Сколько первых мест пула перестраивается; дальше порядок не меняется
+HEAD = 200
+
+
+def _argsort(ids: np.ndarray):
+    """ids по возрастанию и их места в ids (как ids[np.argsort(ids)], np.argsort(ids))."""
+    shift = len(ids).bit_length()
+    if len(ids) and ids.min() >= 0 and ids.max() < 1 << (63 - shift):
+        # id и место в одном int64: np.sort в разы быстрее np.argsort
+        keys = np.sort(ids << shift | np.arange(len(ids)))
+        return keys >> shift, keys & ((1 << shift) - 1)
+    order = np.argsort(ids)
+    return ids[order], order
+
+
+class ExposureScheduler:
+    """Счётчики показов анкет и порядок пула с учётом дефицита показов."""
+
+    def __init__(self, pool, buffer):
+        self.pool = pool
+        self.buffer = buffer
+        buffer.register('impressions', 'INSERT OR REPLACE INTO profile_impressions (user_id, shown) VALUES (?, ?)')
+        self._shown: Dict[int, float] = {}
+        self._total = 0.0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._clear_arrays()
+
+    def _clear_arrays(self):
+        # Копия _shown для schedule(): id по возрастанию и их счётчики (NaN —
+        # анкета забыта). Изменённые с последней синхронизации id — в _changed
+        self._ids = np.empty(0, dtype=np.int64)
+        self._values = np.empty(0, dtype=np.float64)
+        self._changed: Set[int] = set()
+
+    def reset(self):
+        """Забывает счётчики (бенчмарки переключают БД)."""
+        self._shown = {}
+        self._total = 0.0
+        self._loaded = False
+        self._clear_arrays()
+
+    async def load(self):
+        async with self._lock:
+            if self._loaded:
+                return
+            async with self.pool.read() as db:
+                async with db.execute('SELECT user_id, shown FROM profile_impressions') as cursor:
+                    self._shown = dict(await cursor.fetchall())
+            self._total = sum(self._shown.values())
+            self._clear_arrays()
+            self._changed = set(self._shown)
+            self._loaded = True
+
+    async def _set(self, user_id: int, value: float):
+        self._total += value - self._shown.get(user_id, 0.0)
+        self._shown[user_id] = value
+        self._changed.add(user_id)
+        await self.buffer.add('impressions', user_id, (user_id, value), replace=True)
+
+    def _start_value(self) -> float:
+        # Анкета, которой ещё нет в счётчиках, — новая: стартует ниже среднего.
+        # В БД значение уйдёт с первым показом (record)
+        mean = self._total / len(self._shown) if self._shown else 0.0
+        return max(mean - COLD_START, 0.0)
+
+    def _start(self, user_id: int):
+        value = self._start_value()
+        self._total += value
+        self._shown[user_id] = value
+        self._changed.add(user_id)
+
+    async def record(self, user_id: int):
+        """Учитывает показ анкеты user_id."""
+        if not self._loaded:
+            await self.load()
+        if user_id not in self._shown:
+            self._start(user_id)
+        await self._set(user_id, self._shown[user_id] + 1)
+
+    def _store(self, ids: np.ndarray, values: np.ndarray):
+        """Записывает в массивы values анкет ids (по возрастанию, без повторов; NaN — анкета забыта)."""
+        rows = np.searchsorted(self._ids, ids)
+        found = rows < len(self._ids)
+        found[found] = self._ids[rows[found]] == ids[found]
+        self._values[rows[found]] = values[found]
+        new = ~found & ~np.isnan(values)
+        if new.any():
+            merged = np.concatenate([self._ids, ids[new]])
+            order = np.argsort(merged)
+            self._ids, self._values = merged[order], np.concatenate([self._values, values[new]])[order]
+
+    def _sync(self):
+        """Переносит изменённые счётчики из _shown в массивы."""
+        if not self._changed:
+            return
+        changed = np.sort(np.fromiter(self._changed, dtype=np.int64, count=len(self._changed)))
+        self._changed = set()
+        shown = self._shown
+        self._store(changed, np.fromiter((shown.get(user_id, np.nan) for user_id in changed.tolist()),
+                                         dtype=np.float64, count=len(changed)))
+
+    def _values_of(self, ids: np.ndarray) -> np.ndarray:
+        """Счётчики анкет ids; анкетам без счётчика назначается стартовое значение."""
+        self._sync()
+        values = np.full(len(ids), np.nan)
+        if len(self._ids):
+            # Отсортированные запросы searchsorted проходит почти последовательно
+            sorted_ids, order = _argsort(ids)
+            rows = np.searchsorted(self._ids, sorted_ids)
+            rows[rows == len(self._ids)] = 0
+            shown = self._values[rows]
+            shown[self._ids[rows] != sorted_ids] = np.nan
+            values[order] = shown
+        new = np.isnan(values)
+        if new.any():
+            value = self._start_value()
+            fresh = np.sort(ids[new])
+            self._total += value * len(fresh)
+            self._shown.update(dict.fromkeys(fresh.tolist(), value))
+            self._store(fresh, np.full(len(fresh), value))
+            values[new] = value
+        return values
+
+    async def schedule(self, ids) -> np.ndarray:
+        """Пул ids (лучшие первыми) с каждым SLOT_EVERY-м из первых HEAD мест у анкеты с наибольшим дефицитом."""
+        if not self._loaded:
+            await self.load()
+        ids = np.asarray(ids, dtype=np.int64)
+        head = min(len(ids), HEAD)
+        if head < 2:
+            return ids
+        shown = self._values_of(ids)
+        # head анкет с наименьшим (shown, место в пуле): из кучи достаётся не
+        # больше head позиций. Место — вторая часть ключа: при равных показах
+        # первой идёт более релевантная
+        kth = np.partition(shown, head - 1)[head - 1]
+        lowest = np.flatnonzero(shown < kth)
+        lowest = np.concatenate([lowest, np.flatnonzero(shown == kth)[:head - len(lowest)]])
+        heap = list(zip(shown[lowest].tolist(), lowest.tolist()))
+        heapq.heapify(heap)
+        result, placed, ranked = [], set(), 0
+        while len(result) < head:
+            if len(result) % SLOT_EVERY == 0:
+                pos = heapq.heappop(heap)[1]
+                while pos in placed:
+                    pos = heapq.heappop(heap)[1]
+            else:
+                while ranked in placed:
+                    ranked += 1
+                pos = ranked
+            placed.add(pos)
+            result.append(pos)
+        rest = np.ones(len(ids), dtype=np.bool_)
+        rest[result] = False
+        return np.concatenate([ids[result], ids[rest]])
+
+    def forget(self, user_id: int):
+        """Удаление анкеты: счётчик и незаписанное значение больше не нужны."""
+        self._total -= self._shown.pop(user_id, 0.0)
+        self._changed.add(user_id)
+        self.buffer.discard('impressions', lambda key: key == user_id)
+
+    def stats(self) -> Dict[str, float]:
+        if not self._shown:
+            return {'profiles': 0}
+        return {
+            'profiles': len(self._shown),
+            'mean': round(self._total / len(self._shown), 1),
+            'max': max(self._shown.values()),
+        }
@@ -0,0 +1,359 @@
+"""FSM-хранилище aiogram в SQLite с горячим LRU в памяти.
+
+Активные сессии (просмотр анкет, черновики суперлайков, мастер анкеты)
+живут в памяти, как в MemoryStorage. Сессии сверх лимита и простаивающие
+дольше idle_seconds выгружаются в таблицу fsm_sessions одной транзакцией и
+поднимаются обратно при следующем обращении. Лимит — и по числу сессий, и
+по их примерному размеру (пулы просмотра — bytes на десятки килобайт).
+Сессия считается сохранённой и уходит из памяти только после того, как
+запись прошла; если БД занята или недоступна, сессии остаются в памяти и
+выгружаются в следующий раз. При остановке бота (aiogram вызывает close())
+в БД сбрасывается всё несохранённое, так что состояния переживают
+перезапуск.
+
+Формат строки — (state, data) в простом теговом двоичном виде (encode:
+None, bool, int, float, str, bytes, list, tuple, dict — всё, что бот кладёт
+в данные FSM), сжатый zlib, если он длиннее COMPRESS_FROM байт; первый байт —
+версия формата и признак сжатия. Строку, которую не удалось разобрать,
+хранилище считает пустой сессией, а не ошибкой на каждом апдейте
+пользователя.
+"""
+import asyncio
+import itertools
+import logging
+import struct
+import sys
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+MAX_SESSIONS = 5000       # сессий в памяти
+MAX_BYTES = 256 * 2**20   # примерный объём данных сессий в памяти
+IDLE_SECONDS = 600        # простой, после которого сессия уходит в БД
+SWEEP_INTERVAL = 60       # секунды между проверками простоя
+SPILL_BATCH = 256         # сессий за одну запись при превышении лимита
+COMPRESS_FROM = 256       # байт
+
+# Первый байт строки: версия формата, старший бит — сжата ли она zlib
+FORMAT_VERSION = 1
+_COMPRESSED = 0x80
+
+# Значения в данных FSM: тег и содержимое. Собственный формат, а не pickle:
+# таблицу fsm_sessions может переписать кто угодно с доступом к БД
+# (ModeratorBot пишет в тот же файл), и чтение не должно исполнять код
+_INT = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+_LEN = struct.Struct('<I')
+
+
+def _pack(value: Any, out: bytearray):
+    if value is None:
+        out += b'N'
+    elif value is True or value is False:
+        out += b'T' if value else b'F'
+    elif isinstance(value, int):
+        if -2**63 <= value < 2**63:
+            out += b'i' + _INT.pack(value)
+        else:
+            raw = value.to_bytes((value.bit_length() + 8) // 8, 'little', signed=True)
+            out += b'I' + _LEN.pack(len(raw)) + raw
+    elif isinstance(value, float):
+        out += b'f' + _FLOAT.pack(value)
+    elif isinstance(value, str):
+        raw = value.encode()
+        out += b's' + _LEN.pack(len(raw)) + raw
+    elif isinstance(value, (bytes, bytearray)):
+        out += b'b' + _LEN.pack(len(value)) + value
+    elif isinstance(value, (list, tuple)):
+        out += (b'l' if isinstance(value, list) else b't') + _LEN.pack(len(value))
+        for item in value:
+            _pack(item, out)
+    elif isinstance(value, dict):
+        out += b'd' + _LEN.pack(len(value))
+        for key, item in value.items():
+            _pack(key, out)
+            _pack(item, out)
+    else:
+        raise TypeError(f"{type(value).__name__} нельзя сохранить в данных FSM")
+
+
+def _unpack(blob: bytes, pos: int) -> Tuple[Any, int]:
+    tag = blob[pos:pos + 1]
+    pos += 1
+    if tag == b'N':
+        return None, pos
+    if tag in (b'T', b'F'):
+        return tag == b'T', pos
+    if tag == b'i':
+        return _INT.unpack_from(blob, pos)[0], pos + _INT.size
+    if tag == b'f':
+        return _FLOAT.unpack_from(blob, pos)[0], pos + _FLOAT.size
+    if tag in (b'I', b's', b'b', b'l', b't', b'd'):
+        length, = _LEN.unpack_from(blob, pos)
+        pos += _LEN.size
+        if tag in (b'I', b's', b'b'):
+            raw = blob[pos:pos + length]
+            if len(raw) != length:
+                raise ValueError("строка сессии обрезана")
+            pos += length
+            if tag == b'I':
+                return int.from_bytes(raw, 'little', signed=True), pos
+            return (raw.decode() if tag == b's' else raw), pos
+        if tag == b'd':
+            result = {}
+            for _ in range(length):
+                key, pos = _unpack(blob, pos)
+                result[key], pos = _unpack(blob, pos)
+            return result, pos
+        items = []
+        for _ in range(length):
+            item, pos = _unpack(blob, pos)
+            items.append(item)
+        return (items if tag == b'l' else tuple(items)), pos
+    raise ValueError(f"неизвестный тег {tag!r} в строке сессии")
+
+
+def encode(state: Optional[str], data: Dict[str, Any]) -> bytes:
+    """Строка fsm_sessions; TypeError, если в данных есть значение неподдерживаемого типа."""
+    raw = bytearray()
+    _pack((state, data), raw)
+    if len(raw) >= COMPRESS_FROM:
+        return bytes([FORMAT_VERSION | _COMPRESSED]) + zlib.compress(raw)
+    return bytes([FORMAT_VERSION]) + raw
+
+
+def decode(blob: bytes) -> Tuple[Optional[str], Dict[str, Any]]:
+    """(state, data) из строки fsm_sessions; ValueError, если строка не разбирается."""
+    if not blob or blob[0] & ~_COMPRESSED != FORMAT_VERSION:
+        raise ValueError(f"неизвестная версия формата сессии {blob[:1]!r}")
+    try:
+        payload = zlib.decompress(blob[1:]) if blob[0] & _COMPRESSED else bytes(blob[1:])
+        value, end = _unpack(payload, 0)
+    except (struct.error, zlib.error) as e:
+        raise ValueError(f"строка сессии обрезана: {e}") from None
+    if end != len(payload) or not isinstance(value, tuple) or len(value) != 2:
+        raise ValueError("строка сессии не (state, data)")
+    state, data = value
+    if not (state is None or isinstance(state, str)) or not isinstance(data, dict):
+        raise ValueError("строка сессии не (state, data)")
+    return state, data
+
+
+def _size(data: Dict[str, Any]) -> int:
+    """Примерный объём данных сессии: сам словарь, ключи и значения верхнего уровня."""
+    return sys.getsizeof(data) + sum(sys.getsizeof(key) + sys.getsizeof(value) for key, value in data.items())
+
+
+class _Session:
+    __slots__ = ('state', 'data', 'dirty', 'touched', 'size')
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None, dirty: bool = False):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.dirty = dirty
+        self.touched = time.monotonic()
+        self.size = _size(self.data)
+
+
+class SQLiteStorage(BaseStorage):
+    """BaseStorage для aiogram: LRU в памяти поверх таблицы fsm_sessions.
+
+    max_sessions ограничивает число сессий в памяти, max_bytes — их примерный
+    объём (_size); при превышении самые давние выгружаются пачкой по
+    SPILL_BATCH, чтобы не платить транзакцией за каждую новую сессию.
+    Фоновая задача (start()) раз в sweep_interval выгружает сессии, не
+    использованные дольше idle_seconds.
+    """
+
+    def __init__(self, pool, max_sessions: int = MAX_SESSIONS, idle_seconds: float = IDLE_SECONDS,
+                 sweep_interval: float = SWEEP_INTERVAL, max_bytes: int = MAX_BYTES):
+        self.pool = pool
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.sweep_interval = sweep_interval
+        self._key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+        self._hot: "OrderedDict[str, _Session]" = OrderedDict()
+        self._bytes = 0  # сумма size сессий в _hot
+        # Уже вытесненные, но ещё не записанные сессии: читаем их отсюда, а не из БД
+        self._spilling: Dict[str, _Session] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stats = dict.fromkeys(('hits', 'loads', 'misses', 'corrupt', 'spilled', 'flushes', 'failed'), 0)
+
+    # ---------- Сессии ----------
+    async def _session(self, key: StorageKey) -> _Session:
+        name = self._key_builder.build(key)
+        session = self._hot.get(name)
+        if session is not None:
+            self._hot.move_to_end(name)
+            self._stats['hits'] += 1
+        else:
+            session = self._spilling.get(name)
+            if session is None:
+                session = await self._load(name)
+            # Пока ждали БД, сессию мог поднять другой апдейт
+            session = self._put(name, session)
+            if len(self._hot) > self.max_sessions or self._bytes > self.max_bytes:
+                await self._spill(self._oldest())
+        session.touched = time.monotonic()
+        return session
+
+    def _put(self, name: str, session: _Session) -> _Session:
+        """Кладёт сессию в _hot последней; если там уже есть более новая — возвращает её."""
+        current = self._hot.get(name)
+        if current is None:
+            self._hot[name] = current = session
+            self._bytes += session.size
+        self._hot.move_to_end(name)
+        return current
+
+    def _pop(self, name: str) -> Optional[_Session]:
+        session = self._hot.pop(name, None)
+        if session is not None:
+            self._bytes -= session.size
+        return session
+
+    def _oldest(self) -> List[str]:
+        """Самые давние сессии, которые надо выгрузить, чтобы уложиться в лимиты (кроме последней)."""
+        overflow = len(self._hot) - self.max_sessions
+        count = max(overflow, min(SPILL_BATCH, self.max_sessions // 2)) if overflow > 0 else 0
+        excess = self._bytes - self.max_bytes
+        names, freed = [], 0
+        for name, session in itertools.islice(self._hot.items(), len(self._hot) - 1):
+            if len(names) >= count and freed >= excess:
+                break
+            names.append(name)
+            freed += session.size
+        return names
+
+    async def _load(self, name: str) -> _Session:
+        async with self.pool.read() as db:
+            async with db.execute('SELECT payload FROM fsm_sessions WHERE key = ?', (name,)) as cursor:
+                row = await cursor.fetchone()
+        if row is None:
+            self._stats['misses'] += 1
+            return _Session()
+        try:
+            session = _Session(*decode(row[0]))
+        except Exception as e:
+            logging.warning(f"FSM-сессия {name} не читается, начинаем с пустой: {e!r}")
+            self._stats['corrupt'] += 1
+            return _Session()
+        self._stats['loads'] += 1
+        return session
+
+    async def _spill(self, names: List[str]):
+        """Убирает сессии из памяти, записывая изменённые в БД одной транзакцией.
+
+        Если запись не прошла, изменённые сессии остаются в памяти.
+        """
+        batch = {}
+        for name in names:
+            session = self._pop(name)
+            if session is not None and session.dirty:
+                batch[name] = session
+        if batch:
+            self._spilling.update(batch)
+            try:
+                await self._write(batch)
+            except Exception as e:
+                logging.error(f"Не удалось выгрузить FSM-сессии ({len(batch)}), остаются в памяти: {e!r}")
+                for name, session in batch.items():
+                    self._put(name, session)
+                names = [name for name in names if name not in batch]
+            finally:
+                for name in batch:
+                    self._spilling.pop(name, None)
+        self._stats['spilled'] += len(names)
+
+    async def _write(self, sessions: Dict[str, _Session]):
+        """Записывает сессии одной транзакцией; чистыми они становятся только после неё."""
+        upserts, deletes, written = [], [], []
+        for name, session in sessions.items():
+            if session.state is None and not session.data:
+                deletes.append((name,))
+            else:
+                try:
+                    upserts.append((name, encode(session.state, session.data)))
+                except TypeError as e:
+                    # Одна такая сессия не должна мешать записи остальных
+                    logging.error(f"FSM-сессию {name} не сохранить: {e}")
+                    continue
+            # set_data заменяет словарь, так что по нему видно, менялась ли сессия во время записи
+            written.append((session, session.state, session.data))
+        try:
+            await self._execute(upserts, deletes)
+        except Exception:
+            self._stats['failed'] += 1
+            raise
+        for session, state, data in written:
+            if session.state == state and session.data is data:
+                session.dirty = False
+        self._stats['flushes'] += 1
+
+    async def _execute(self, upserts: list, deletes: list):
+        async with self.pool.write() as db:
+            if upserts:
+                await db.executemany(
+                    'INSERT INTO fsm_sessions (key, payload, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP) '
+                    'ON CONFLICT(key) DO UPDATE SET payload = excluded.payload, updated_at = excluded.updated_at',
+                    upserts
+                )
+            if deletes:
+                await db.executemany('DELETE FROM fsm_sessions WHERE key = ?', deletes)
+
+    # ---------- BaseStorage ----------
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        session = await self._session(key)
+        session.state = state.state if isinstance(state, State) else state
+        session.dirty = True
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._session(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        session = await self._session(key)
+        session.data = data.copy()
+        session.dirty = True
+        size = _size(session.data)
+        if self._hot.get(self._key_builder.build(key)) is session:
+            self._bytes += size - session.size
+        session.size = size
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._session(key)).data.copy()
+
+    # ---------- Фоновая выгрузка ----------
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            deadline = time.monotonic() - self.idle_seconds
+            idle = [name for name, session in self._hot.items() if session.touched < deadline]
+            if idle:
+                try:
+                    await self._spill(idle)
+                except Exception as e:
+                    logging.error(f"Не удалось выгрузить FSM-сессии: {e!r}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._sweep())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        dirty = {name: session for name, session in self._hot.items() if session.dirty}
+        if dirty:
+            await self._write(dirty)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats, hot=len(self._hot), hot_bytes=self._bytes)
@@ -1,38 +1,43 @@
 import logging
 import os
 import random
-from typing import Callable, Awaitable, Any
+from contextlib import asynccontextmanager
+from typing import Callable, Awaitable, Any, Optional
 from aiogram import Router, F, Bot, BaseMiddleware
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, CallbackQuery, InputMediaPhoto
-from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
-import aiosqlite
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNotFound
 import config
+from compat import is_compatible
+from delivery import is_recipient_error
 from meetings import create_meet_after_like, router as meet_router
-from matching import get_next_profile
+from matching import get_next_profile, start_search
+from cards import get_card, with_header, esc as _esc
+import prefetch
+import profile_store
 from rating_system import get_user_rating, add_rating, get_voter_weight
-from states import CreateProfile, EditProfile, BrowseProfiles, SuperLike, Verification, RouletteState
+from states import CreateProfile, EditProfile, BrowseProfiles, SearchProfiles, SuperLike, Verification, RouletteState
 from keyboards import (
     get_main_keyboard, get_edit_keyboard, get_done_keyboard,
     get_back_keyboard, remove_keyboard, get_like_dislike_superlike_keyboard,
     get_reply_keyboard, get_gender_keyboard, get_interests_keyboard,
     get_admin_keyboard, get_delete_confirm_keyboard, get_institute_keyboard,
     get_rating_keyboard, get_roulette_keyboard, get_verification_admin_keyboard,
-    get_more_keyboard
+    get_more_keyboard, get_filters_keyboard, get_filter_institutes_keyboard
 )
 from data import (
     save_profile, get_profile, get_all_profiles,
     add_like, add_dislike, get_ratings,
     get_user_stats, get_all_usernames, get_top_users,
-    DB_PATH, delete_profile, INSTITUTES, add_points,
-    get_hot_profiles, update_streak, get_streak,
+    DB_PATH, pool, profile_cache, exposure, activity, delivery, delete_profile, INSTITUTES, add_points,
+    get_hot_profiles, get_most_desirable, update_streak, get_streak,
     count_pending_likes, get_top_users_by_institute,
     award_badge, get_user_badges,
     get_daily_task_completions, complete_daily_task, count_today_likes,
     can_use_roulette, set_roulette_used, get_random_profile_other_institute,
     set_verified, record_profile_view, get_recent_viewers, save_profile_video,
-    save_verification_request, check_like_exists
+    save_verification_request, check_like_exists, get_browse_filters, save_browse_filters
 )
 
 router = Router()
@@ -40,26 +45,22 @@ router.include_router(meet_router)
 MAX_PHOTOS = 3
 
 
-def _esc(text: str) -> str:
-    """Экранирует спецсимволы Markdown v1 в пользовательском тексте."""
-    for char in ('_', '*', '`', '['):
-        text = text.replace(char, f'\\{char}')
-    return text
-
 # Тексты кнопок клавиатуры, которые нужно удалять из чата
 _BUTTON_TEXTS = {
     # Главное меню
     "Создать анкету", "Моя анкета", "Редактировать анкету",
     "Просмотр анкет", "Мой рейтинг", "Топ встреч", "Мои задания", "Рулетка",
     # Меню "Ещё"
-    "⚙️ Ещё...", "← Назад", "Горячие сегодня", "Топ института",
+    "⚙️ Ещё...", "← Назад", "Горячие сегодня", "Топ института", "Поиск по интересам",
     "Кто смотрел", "Верификация", "Статистика", "Удалить анкету",
     # Навигация
     "Назад в меню", "Назад",
     # Меню редактирования
     "Изменить имя", "Изменить возраст", "Изменить пол", "Изменить интересы",
     "Изменить институт", "Изменить описание", "Изменить фото",
-    "Добавить видео в анкету", "Пересоздать анкету",
+    "Добавить видео в анкету", "Пересоздать анкету", "Фильтры просмотра",
+    # Фильтры просмотра
+    "Возраст анкет", "Институты анкет", "Только верифицированные", "Сбросить фильтры", "Все институты",
     # Прочие кнопки
     "Готово", "Убрать видео",
     # Выбор пола и интересов
@@ -84,14 +85,41 @@ class _DeleteButtonMiddleware(BaseMiddleware):
 
 router.message.outer_middleware(_DeleteButtonMiddleware())
 
-def is_compatible(liker_gender: str, target_interests: str) -> bool:
-    if target_interests == "Парни":
-        return liker_gender == "Парень"
-    elif target_interests == "Девушки":
-        return liker_gender == "Девушка"
-    elif target_interests == "Все":
-        return True
-    return False
+
+class _ActivityMiddleware(BaseMiddleware):
+    """Отмечает активность пользователя (data.activity) на каждом сообщении и нажатии кнопки."""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is not None:
+            await activity.touch(user.id)
+        return await handler(event, data)
+
+router.message.outer_middleware(_ActivityMiddleware())
+router.callback_query.outer_middleware(_ActivityMiddleware())
+
+
+class _DeliveryMiddleware(BaseMiddleware):
+    """Пользователь, недоступный для отправки (data.delivery), снова доступен, как только сам пишет боту."""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is not None:
+            await delivery.returned(user.id)
+        return await handler(event, data)
+
+router.message.outer_middleware(_DeliveryMiddleware())
+router.callback_query.outer_middleware(_DeliveryMiddleware())
 
 # --------------------- СТАРТ ---------------------
 @router.message(CommandStart())
@@ -137,9 +165,24 @@ async def cmd_stats(message: Message, bot: Bot):
         await message.answer("У вас нет прав на просмотр статистики.")
         return
 
-    stats = await get_user_stats()
-    total = stats['total']
-    gender_stats = stats['gender']
+    store = profile_store.profiles
+    if profile_store.ENABLED:
+        # Счётчики, пол и рейтинги — из колонок в памяти, без запроса на каждого
+        await store.refresh()
+        total = len(store)
+        gender_stats = store.counts('gender')
+        genders = store.labels('gender')
+        ratings = store.values('rating')
+    else:
+        stats = await get_user_stats()
+        total = stats['total']
+        gender_stats = stats['gender']
+        # Пол всех пользователей одним запросом, чтобы не держать соединение
+        # из пула во время вызовов get_user_rating
+        async with pool.read() as db:
+            async with db.execute('SELECT user_id, gender FROM profiles') as cursor:
+                genders = {row[0]: row[1] for row in await cursor.fetchall()}
+        ratings = None
     male = gender_stats.get('Парень', 0)
     female = gender_stats.get('Девушка', 0)
 
@@ -148,36 +191,52 @@ async def cmd_stats(message: Message, bot: Bot):
     male_users = []
     female_users = []
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        for uid, display in all_usernames.items():
-            async with db.execute('SELECT gender FROM profiles WHERE user_id = ?', (uid,)) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    gender = row[0]
-                    rating = await get_user_rating(uid)
-                    if rating == 1.0:
-                        rating_display = "1⭐ (начальный)"
-                    else:
-                        if rating.is_integer():
-                            rating_display = f"{int(rating)}⭐"
-                        else:
-                            rating_display = f"{rating:.2f}⭐"
-                    line = f"{rating_display} {display}"
-                    if gender == "Парень":
-                        male_users.append(line)
-                    else:
-                        female_users.append(line)
+    for uid, display in all_usernames.items():
+        gender = genders.get(uid)
+        if gender is None:
+            continue
+        rating = ratings[uid] if ratings is not None else await get_user_rating(uid)
+        if rating == 1.0:
+            rating_display = "1⭐ (начальный)"
+        else:
+            if rating.is_integer():
+                rating_display = f"{int(rating)}⭐"
+            else:
+                rating_display = f"{rating:.2f}⭐"
+        line = f"{rating_display} {display}"
+        if gender == "Парень":
+            male_users.append(line)
+        else:
+            female_users.append(line)
 
     text = f"📊 **Статистика пользователей:**\n\n" \
            f"Всего анкет: {total}\n" \
            f"Парней: {male}\n" \
            f"Девушек: {female}\n\n"
+    if profile_store.ENABLED and total:
+        by_institute = ", ".join(f"{name} {count}" for name, count in sorted(store.counts('institute').items(),
+                                                                            key=lambda item: -item[1]))
+        text += f"По институтам: {by_institute}\n" \
+                f"Верифицировано: {int(store.verified.sum())}, средний рейтинг {float(store.rating.mean()):.2f}\n\n"
 
     if male_users:
         text += "👤 **Парни:**\n" + "\n".join(male_users) + "\n\n"
     if female_users:
         text += "👩 **Девушки:**\n" + "\n".join(female_users)
 
+    db_stats = pool.stats()
+    text = text.rstrip() + f"\n\n🗄 БД: записей {db_stats['writes']}, ожиданий писателя {db_stats['write_waits']} " \
+            f"(макс. {db_stats['max_write_wait_ms']} мс), повторов busy {db_stats['busy_retries']}"
+    cache_stats = profile_cache.stats()
+    text += f"\n🧠 Кэш анкет: попаданий {cache_stats['hits']}, промахов {cache_stats['misses']} " \
+            f"({cache_stats['hit_rate']:.0%}), в кэше {cache_stats['size']}"
+    prefetch_stats = prefetch.stats()
+    text += f"\n⏩ Предвыборка: использовано {prefetch_stats['used']}, устарело {prefetch_stats['stale']}, " \
+            f"промахов {prefetch_stats['missed']}"
+    exposure_stats = exposure.stats()
+    if exposure_stats['profiles']:
+        text += f"\n📊 Показы анкет: в среднем {exposure_stats['mean']}, максимум {exposure_stats['max']:.0f}"
+
     if len(text) > 4096:
         parts = [text[i:i + 4096] for i in range(0, len(text), 4096)]
         for part in parts:
@@ -439,7 +498,7 @@ async def cmd_edit(message: Message, state: FSMContext):
 @router.message(EditProfile.choosing_field, F.text.in_([
     "Изменить имя", "Изменить возраст", "Изменить пол", "Изменить интересы",
     "Изменить описание", "Изменить фото", "Изменить институт",
-    "Добавить видео в анкету", "Пересоздать анкету", "Назад"
+    "Добавить видео в анкету", "Фильтры просмотра", "Пересоздать анкету", "Назад"
 ]))
 async def process_edit_choice(message: Message, state: FSMContext):
     choice = message.text
@@ -485,6 +544,10 @@ async def process_edit_choice(message: Message, state: FSMContext):
     elif choice == "Изменить институт":
         await state.set_state(EditProfile.waiting_for_new_institute)
         await message.answer("Выберите новый институт:", reply_markup=get_institute_keyboard())
+    elif choice == "Фильтры просмотра":
+        await state.set_state(EditProfile.choosing_filter)
+        filters = await get_browse_filters(message.from_user.id)
+        await message.answer(_filters_text(filters), reply_markup=get_filters_keyboard())
     elif choice == "Добавить видео в анкету":
         await state.set_state(EditProfile.waiting_for_new_video)
         from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
@@ -695,6 +758,113 @@ async def finish_edit_photos(message: Message, state: FSMContext):
     await message.answer("Фотографии обновлены!", reply_markup=keyboard)
     await show_profile(message, user_id, edit_mode=True)
 
+# ---- Фильтры просмотра ----
+# Фильтры применяются при следующем «Просмотр анкет»: пулы собираются заново
+_NO_FILTERS = {'age_min': None, 'age_max': None, 'institutes': None, 'verified_only': False}
+
+def _filters_text(filters: Optional[dict]) -> str:
+    filters = filters or _NO_FILTERS
+    if filters['age_min'] is None and filters['age_max'] is None:
+        age = "любой"
+    else:
+        age = f"{filters['age_min'] or '…'}–{filters['age_max'] or '…'}"
+    institutes = ", ".join(filters['institutes']) if filters['institutes'] else "все"
+    verified = "да" if filters['verified_only'] else "нет"
+    return (
+        "Фильтры просмотра:\n"
+        f"Возраст: {age}\n"
+        f"Институты: {institutes}\n"
+        f"Только верифицированные: {verified}"
+    )
+
+@router.message(EditProfile.choosing_filter, F.text.in_([
+    "Возраст анкет", "Институты анкет", "Только верифицированные", "Сбросить фильтры", "Назад"
+]))
+async def process_filter_choice(message: Message, state: FSMContext):
+    choice = message.text
+    user_id = message.from_user.id
+    filters = await get_browse_filters(user_id) or dict(_NO_FILTERS)
+
+    if choice == "Назад":
+        await state.set_state(EditProfile.choosing_field)
+        await message.answer("Выберите, что хотите изменить:", reply_markup=get_edit_keyboard())
+    elif choice == "Возраст анкет":
+        await state.set_state(EditProfile.waiting_for_filter_age)
+        await message.answer(
+            "Введите возраст через дефис, например 18-25. Можно только одну границу: 20- или -25.\n"
+            "Отправьте «-», чтобы снять ограничение.",
+            reply_markup=remove_keyboard
+        )
+    elif choice == "Институты анкет":
+        await state.set_state(EditProfile.waiting_for_filter_institutes)
+        await state.update_data(filter_institutes=filters['institutes'] or [])
+        await message.answer(
+            "Нажимайте на институты, чтобы добавить или убрать их. Когда закончите, нажмите 'Готово'.",
+            reply_markup=get_filter_institutes_keyboard()
+        )
+    elif choice == "Только верифицированные":
+        filters['verified_only'] = not filters['verified_only']
+        await save_browse_filters(user_id, **filters)
+        await message.answer(_filters_text(filters), reply_markup=get_filters_keyboard())
+    elif choice == "Сбросить фильтры":
+        await save_browse_filters(user_id)
+        await message.answer(_filters_text(None), reply_markup=get_filters_keyboard())
+
+@router.message(EditProfile.waiting_for_filter_age)
+async def process_filter_age(message: Message, state: FSMContext):
+    text = (message.text or "").replace(" ", "")
+    low, sep, high = text.partition("-")
+    try:
+        if not sep:
+            raise ValueError
+        age_min = int(low) if low else None
+        age_max = int(high) if high else None
+        for age in (age_min, age_max):
+            if age is not None and (age <= 0 or age > 120):
+                raise ValueError
+        if age_min is not None and age_max is not None and age_min > age_max:
+            raise ValueError
+    except ValueError:
+        await message.answer("Пожалуйста, введите возраст в виде 18-25 (числа от 1 до 120) или «-».")
+        return
+
+    user_id = message.from_user.id
+    filters = await get_browse_filters(user_id) or dict(_NO_FILTERS)
+    filters['age_min'], filters['age_max'] = age_min, age_max
+    await save_browse_filters(user_id, **filters)
+    await state.set_state(EditProfile.choosing_filter)
+    await message.answer(_filters_text(filters), reply_markup=get_filters_keyboard())
+
+@router.message(EditProfile.waiting_for_filter_institutes, F.text.in_(INSTITUTES))
+async def process_filter_institute(message: Message, state: FSMContext):
+    data = await state.get_data()
+    chosen = data.get('filter_institutes', [])
+    if message.text in chosen:
+        chosen.remove(message.text)
+    else:
+        chosen.append(message.text)
+    await state.update_data(filter_institutes=chosen)
+    await message.answer(f"Выбрано: {', '.join(chosen) if chosen else 'все институты'}")
+
+@router.message(EditProfile.waiting_for_filter_institutes, F.text == "Все институты")
+async def process_filter_all_institutes(message: Message, state: FSMContext):
+    await state.update_data(filter_institutes=[])
+    await message.answer("Выбрано: все институты")
+
+@router.message(EditProfile.waiting_for_filter_institutes, F.text.casefold() == "готово")
+async def done_filter_institutes(message: Message, state: FSMContext):
+    data = await state.get_data()
+    user_id = message.from_user.id
+    filters = await get_browse_filters(user_id) or dict(_NO_FILTERS)
+    filters['institutes'] = data.get('filter_institutes') or None
+    await save_browse_filters(user_id, **filters)
+    await state.set_state(EditProfile.choosing_filter)
+    await message.answer(_filters_text(filters), reply_markup=get_filters_keyboard())
+
+@router.message(EditProfile.waiting_for_filter_institutes)
+async def handle_invalid_filter_institute(message: Message):
+    await message.answer("Пожалуйста, выберите институт из списка кнопок.", reply_markup=get_filter_institutes_keyboard())
+
 # --------------------- ВИДЕО В АНКЕТЕ (фича 13) ---------------------
 @router.message(EditProfile.waiting_for_new_video, F.video_note)
 async def process_profile_video(message: Message, state: FSMContext):
@@ -777,11 +947,12 @@ async def cmd_browse(message: Message, state: FSMContext):
     # Начинаем новый просмотр
     await state.set_state(BrowseProfiles.browsing)
     await state.update_data(
-        new_pool=[],
-        disliked_pool=[],
-        liked_pool=[],
+        new_pool=b'',
+        disliked_pool=b'',
+        liked_pool=b'',
         current_pool='new',
         pools_loaded=False,
+        search=False,
         current_profile_id=None,
         last_message_id=None
     )
@@ -792,28 +963,31 @@ async def cmd_browse(message: Message, state: FSMContext):
     await show_next_profile(message, user_id, state)
 
 
-async def show_profile_by_id(target_message: Message, profile_id: int, state: FSMContext, is_revisit: bool = False):
-    """Показывает анкету с заданным ID, обновляет состояние."""
-    viewer_id = target_message.from_user.id
+async def show_profile_by_id(target_message: Message, profile_id: int, state: FSMContext, is_revisit: bool = False,
+                            prefetched: Optional[prefetch.Prefetched] = None):
+    """Показывает анкету с заданным ID, обновляет состояние.
 
-    profile = await get_profile(profile_id)
-    if not profile:
-        # Если анкета исчезла, переходим к следующей
-        await show_next_profile(target_message, viewer_id, state)
-        return
+    prefetched — уже загруженная анкета и карточка из prefetch.take().
+    """
+    # В личном чате id чата совпадает с id пользователя; from_user у
+    # сообщения из callback — сам бот
+    viewer_id = target_message.chat.id
+
+    if prefetched:
+        profile, card = prefetched.profile, prefetched.card
+    else:
+        profile = await get_profile(profile_id)
+        if not profile:
+            # Если анкета исчезла, переходим к следующей
+            await show_next_profile(target_message, viewer_id, state)
+            return
+        card = get_card(profile_id, profile, 'browse_revisit' if is_revisit else 'browse')
 
     # Записываем просмотр
     await record_profile_view(viewer_id, profile_id)
 
-    name = profile['name']
-    age = profile['age']
-    description = profile['description']
-    photos = profile.get('photos', [])
     video_file_id = profile.get('video_file_id')
-
-    verified_mark = " ✅" if profile.get('verified') else ""
-    revisit_note = "\n_Вы уже лайкнули эту анкету_\n" if is_revisit else ""
-    text = f"👤 **Анкета:**\n{_esc(name)}, {age}{verified_mark}\n{revisit_note}Описание: {_esc(description)}"
+    text, photos = card.text, card.photos
 
     try:
         if not photos:
@@ -833,13 +1007,7 @@ async def show_profile_by_id(target_message: Message, profile_id: int, state: FS
             await state.update_data(last_message_id=sent.message_id)
         else:
             # Отправляем медиагруппу
-            media_group = []
-            for i, file_id in enumerate(photos):
-                if i == 0:
-                    media_group.append(InputMediaPhoto(media=file_id, caption=text, parse_mode="Markdown"))
-                else:
-                    media_group.append(InputMediaPhoto(media=file_id))
-            await target_message.answer_media_group(media=media_group)
+            await target_message.answer_media_group(media=list(card.media))
             # Отдельное сообщение с кнопками
             sent = await target_message.answer(
                 "Оцените анкету:",
@@ -862,8 +1030,9 @@ async def show_profile_by_id(target_message: Message, profile_id: int, state: FS
         except Exception as e:
             logging.warning(f"Не удалось отправить видео анкеты {profile_id}: {e}")
 
-    # Сохраняем ID текущей анкеты
+    # Сохраняем ID текущей анкеты и, пока её смотрят, готовим следующую
     await state.update_data(current_profile_id=profile_id)
+    prefetch.schedule(viewer_id, await state.get_data())
 
 
 async def show_next_profile(target_message: Message, user_id: int, state: FSMContext):
@@ -876,50 +1045,64 @@ async def show_next_profile(target_message: Message, user_id: int, state: FSMCon
         except Exception as e:
             logging.warning(f"Не удалось удалить предыдущее сообщение: {e}")
 
+    ready = await prefetch.take(user_id, data)
+    if ready:
+        await state.update_data(**ready.state_data)
+        await show_profile_by_id(target_message, ready.profile_id, state, ready.is_revisit, prefetched=ready)
+        return
+
     next_id, updated_data, is_revisit = await get_next_profile(user_id, data)
     if next_id is None:
-        await target_message.answer(
-            "Больше нет анкет, соответствующих вашим интересам. Попробуйте позже или измените настройки."
-        )
+        if data.get('search'):
+            await target_message.answer("Больше анкет по этому запросу нет. Попробуйте другие слова.")
+        else:
+            await target_message.answer(
+                "Больше нет анкет, соответствующих вашим интересам. Попробуйте позже или измените настройки."
+            )
         await state.clear()
         return
     await state.update_data(**updated_data)
     await show_profile_by_id(target_message, next_id, state, is_revisit=is_revisit)
 
-# --------------------- ВСПОМОГАТЕЛЬНАЯ ФУНКЦИЯ ДЛЯ ОТПРАВКИ АНКЕТЫ ---------------------
-async def send_profile_to_user(bot: Bot, to_user_id: int, profile: dict, custom_text: str = None):
-    name = profile['name']
-    age = profile['age']
-    description = profile['description']
-    photos = profile.get('photos', [])
-
-    if custom_text:
-        header = f"💌 {_esc(custom_text)}\n\n"
+# --------------------- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ДЛЯ ОТПРАВКИ ---------------------
+@asynccontextmanager
+async def _delivering(user_id: int, what: str):
+    """Отправка user_id: итог записывается в data.delivery, ошибки логируются и наружу не выходят."""
+    try:
+        yield
+    except TelegramForbiddenError as e:
+        logging.warning(f"User {user_id} has blocked the bot. Cannot send {what}.")
+        await delivery.blocked(user_id, e)
+    except (TelegramBadRequest, TelegramNotFound) as e:
+        logging.error(f"Failed to send {what} to {user_id}: {e}")
+        if isinstance(e, TelegramNotFound) or is_recipient_error(e):
+            await delivery.failed(user_id, e)
+    except Exception as e:
+        # Сеть или сервер Telegram — получатель тут ни при чём
+        logging.error(f"Failed to send {what} to {user_id}: {e}")
     else:
-        header = ""
+        await delivery.delivered(user_id)
 
-    text = f"{header}👤 **Анкета:**\n{_esc(name)}, {age}\nОписание: {_esc(description)}"
+async def send_profile_to_user(bot: Bot, to_user_id: int, profile_id: int, profile: dict, custom_text: str = None):
+    if delivery.is_unreachable(to_user_id):
+        return
+    header = f"💌 {_esc(custom_text)}\n\n" if custom_text else None
+    card = with_header(get_card(profile_id, profile, 'card'), header)
+    text, photos = card.text, card.photos
 
-    try:
-        if not photos:
+    async with _delivering(to_user_id, "profile"):
+        try:
+            if not photos:
+                await bot.send_message(to_user_id, text, parse_mode="Markdown")
+            elif len(photos) == 1:
+                await bot.send_photo(to_user_id, photo=photos[0], caption=text, parse_mode="Markdown")
+            else:
+                await bot.send_media_group(to_user_id, media=list(card.media))
+        except TelegramBadRequest as e:
+            if is_recipient_error(e):
+                raise
+            logging.error(f"Ошибка отправки фото пользователю {to_user_id}: {e}")
             await bot.send_message(to_user_id, text, parse_mode="Markdown")
-        elif len(photos) == 1:
-            await bot.send_photo(to_user_id, photo=photos[0], caption=text, parse_mode="Markdown")
-        else:
-            media_group = []
-            for i, file_id in enumerate(photos):
-                if i == 0:
-                    media_group.append(InputMediaPhoto(media=file_id, caption=text, parse_mode="Markdown"))
-                else:
-                    media_group.append(InputMediaPhoto(media=file_id))
-            await bot.send_media_group(to_user_id, media=media_group)
-    except TelegramBadRequest as e:
-        logging.error(f"Ошибка отправки фото пользователю {to_user_id}: {e}")
-        await bot.send_message(to_user_id, text, parse_mode="Markdown")
-    except TelegramForbiddenError:
-        logging.warning(f"User {to_user_id} has blocked the bot. Cannot send profile.")
-    except Exception as e:
-        logging.error(f"Failed to send profile to user {to_user_id}: {e}")
 
 # --------------------- ОБРАБОТКА РЕАКЦИЙ ---------------------
 @router.callback_query(BrowseProfiles.browsing, F.data.startswith(("like_", "dislike_", "superlike_")))
@@ -1024,7 +1207,7 @@ async def process_superlike_message(message: Message, state: FSMContext, bot: Bo
         return
 
     # Сохраняем лайк
-    await add_like(user_id, target_id)
+    await add_like(user_id, target_id, event='superlike')
 
     target_profile = await get_profile(target_id)
     user_profile = await get_profile(user_id)
@@ -1055,102 +1238,85 @@ async def process_superlike_message(message: Message, state: FSMContext, bot: Bo
 
 # --------------------- ФУНКЦИИ УВЕДОМЛЕНИЙ ---------------------
 async def send_like_notification(bot: Bot, liker_id: int, target_id: int):
+    if delivery.is_unreachable(target_id):
+        return
     liker_profile = await get_profile(liker_id)
     if not liker_profile:
         return
 
-    name = liker_profile['name']
-    age = liker_profile['age']
-    description = liker_profile['description']
-    photos = liker_profile.get('photos', [])
+    card = get_card(liker_id, liker_profile, 'like')
+    text, photos = card.text, card.photos
 
-    text = f"💌 Пользователь {_esc(name)} лайкнул вашу анкету!\n\n👤 **Анкета:**\n{_esc(name)}, {age}\nОписание: {_esc(description)}"
-
-    try:
-        if not photos:
-            await bot.send_message(
-                target_id,
-                text,
-                parse_mode="Markdown",
-                reply_markup=get_reply_keyboard(liker_id)
-            )
-        elif len(photos) == 1:
-            await bot.send_photo(
-                target_id,
-                photo=photos[0],
-                caption=text,
-                parse_mode="Markdown",
-                reply_markup=get_reply_keyboard(liker_id)
-            )
-        else:
-            media_group = []
-            for i, file_id in enumerate(photos):
-                if i == 0:
-                    media_group.append(InputMediaPhoto(media=file_id, caption=text, parse_mode="Markdown"))
-                else:
-                    media_group.append(InputMediaPhoto(media=file_id))
-            await bot.send_media_group(target_id, media=media_group)
-            await bot.send_message(
-                target_id,
-                "Этот пользователь лайкнул вашу анкету. Хотите ответить?",
-                reply_markup=get_reply_keyboard(liker_id)
-            )
-    except TelegramBadRequest as e:
-        logging.error(f"Ошибка отправки фото в like-уведомлении: {e}")
-        await bot.send_message(target_id, text, parse_mode="Markdown", reply_markup=get_reply_keyboard(liker_id))
-    except TelegramForbiddenError:
-        logging.warning(f"User {target_id} has blocked the bot. Cannot send like notification.")
-    except Exception as e:
-        logging.error(f"Failed to send like notification to {target_id}: {e}")
+    async with _delivering(target_id, "like notification"):
+        try:
+            if not photos:
+                await bot.send_message(
+                    target_id,
+                    text,
+                    parse_mode="Markdown",
+                    reply_markup=get_reply_keyboard(liker_id)
+                )
+            elif len(photos) == 1:
+                await bot.send_photo(
+                    target_id,
+                    photo=photos[0],
+                    caption=text,
+                    parse_mode="Markdown",
+                    reply_markup=get_reply_keyboard(liker_id)
+                )
+            else:
+                await bot.send_media_group(target_id, media=list(card.media))
+                await bot.send_message(
+                    target_id,
+                    "Этот пользователь лайкнул вашу анкету. Хотите ответить?",
+                    reply_markup=get_reply_keyboard(liker_id)
+                )
+        except TelegramBadRequest as e:
+            if is_recipient_error(e):
+                raise
+            logging.error(f"Ошибка отправки фото в like-уведомлении: {e}")
+            await bot.send_message(target_id, text, parse_mode="Markdown", reply_markup=get_reply_keyboard(liker_id))
 
 async def send_superlike_notification(bot: Bot, liker_id: int, target_id: int, custom_message: str):
+    if delivery.is_unreachable(target_id):
+        return
     liker_profile = await get_profile(liker_id)
     if not liker_profile:
         return
 
-    name = liker_profile['name']
-    age = liker_profile['age']
-    description = liker_profile['description']
-    photos = liker_profile.get('photos', [])
-
-    text = f"💌 Пользователь {_esc(name)} отправил вам суперлайк!\n\n✉️ Сообщение: {_esc(custom_message)}\n\n👤 **Анкета:**\n{_esc(name)}, {age}\nОписание: {_esc(description)}"
+    header = f"💌 Пользователь {_esc(liker_profile['name'])} отправил вам суперлайк!\n\n✉️ Сообщение: {_esc(custom_message)}\n\n"
+    card = with_header(get_card(liker_id, liker_profile, 'card'), header)
+    text, photos = card.text, card.photos
 
-    try:
-        if not photos:
-            await bot.send_message(
-                target_id,
-                text,
-                parse_mode="Markdown",
-                reply_markup=get_reply_keyboard(liker_id)
-            )
-        elif len(photos) == 1:
-            await bot.send_photo(
-                target_id,
-                photo=photos[0],
-                caption=text,
-                parse_mode="Markdown",
-                reply_markup=get_reply_keyboard(liker_id)
-            )
-        else:
-            media_group = []
-            for i, file_id in enumerate(photos):
-                if i == 0:
-                    media_group.append(InputMediaPhoto(media=file_id, caption=text, parse_mode="Markdown"))
-                else:
-                    media_group.append(InputMediaPhoto(media=file_id))
-            await bot.send_media_group(target_id, media=media_group)
-            await bot.send_message(
-                target_id,
-                "Этот пользователь отправил вам суперлайк. Хотите ответить?",
-                reply_markup=get_reply_keyboard(liker_id)
-            )
-    except TelegramBadRequest as e:
-        logging.error(f"Ошибка отправки фото в superlike-уведомлении: {e}")
-        await bot.send_message(target_id, text, parse_mode="Markdown", reply_markup=get_reply_keyboard(liker_id))
-    except TelegramForbiddenError:
-        logging.warning(f"User {target_id} has blocked the bot. Cannot send superlike notification.")
-    except Exception as e:
-        logging.error(f"Failed to send superlike notification to {target_id}: {e}")
+    async with _delivering(target_id, "superlike notification"):
+        try:
+            if not photos:
+                await bot.send_message(
+                    target_id,
+                    text,
+                    parse_mode="Markdown",
+                    reply_markup=get_reply_keyboard(liker_id)
+                )
+            elif len(photos) == 1:
+                await bot.send_photo(
+                    target_id,
+                    photo=photos[0],
+                    caption=text,
+                    parse_mode="Markdown",
+                    reply_markup=get_reply_keyboard(liker_id)
+                )
+            else:
+                await bot.send_media_group(target_id, media=list(card.media))
+                await bot.send_message(
+                    target_id,
+                    "Этот пользователь отправил вам суперлайк. Хотите ответить?",
+                    reply_markup=get_reply_keyboard(liker_id)
+                )
+        except TelegramBadRequest as e:
+            if is_recipient_error(e):
+                raise
+            logging.error(f"Ошибка отправки фото в superlike-уведомлении: {e}")
+            await bot.send_message(target_id, text, parse_mode="Markdown", reply_markup=get_reply_keyboard(liker_id))
 
 async def notify_mutual_like(bot: Bot, user_id: int, target_id: int):
     user_profile = await get_profile(user_id)
@@ -1158,8 +1324,8 @@ async def notify_mutual_like(bot: Bot, user_id: int, target_id: int):
     if not user_profile or not target_profile:
         return
 
-    await send_profile_to_user(bot, user_id, target_profile)
-    await send_profile_to_user(bot, target_id, user_profile)
+    await send_profile_to_user(bot, user_id, target_id, target_profile)
+    await send_profile_to_user(bot, target_id, user_id, user_profile)
 
     try:
         target_chat = await bot.get_chat(target_id)
@@ -1266,6 +1432,7 @@ async def handle_reply_callback(callback: CallbackQuery, bot: Bot):
 
 # --------------------- ВОЗВРАТ В МЕНЮ ИЗ РЕЖИМА ПРОСМОТРА ---------------------
 @router.message(BrowseProfiles.browsing, F.text == "Назад в меню")
+@router.message(SearchProfiles.waiting_for_query, F.text == "Назад в меню")
 async def back_to_menu(message: Message, state: FSMContext):
     data = await state.get_data()
     last_msg_id = data.get('last_message_id')
@@ -1340,7 +1507,7 @@ _MENU_BUTTONS = {
     "Горячие сегодня", "Рулетка", "Топ института", "Кто смотрел",
     "Мои задания", "Верификация", "Топ встреч", "Мой рейтинг",
     "Моя анкета", "Редактировать анкету", "Удалить анкету", "Статистика",
-    "⚙️ Ещё...", "← Назад",
+    "⚙️ Ещё...", "← Назад", "Поиск по интересам",
 }
 
 @router.message(BrowseProfiles.browsing, ~F.text.in_(_MENU_BUTTONS))
@@ -1369,20 +1536,21 @@ async def cmd_back_from_more(message: Message, state: FSMContext):
 @router.message(F.text == "Горячие сегодня")
 async def cmd_hot_today(message: Message):
     hot_ids = await get_hot_profiles(3)
-    if not hot_ids:
-        await message.answer("Пока нет активности за последние 24 часа.")
-        return
-    await message.answer("🔥 **Горячие анкеты за последние 24 часа:**", parse_mode="Markdown")
+    if hot_ids:
+        await message.answer("🔥 **Горячие анкеты за последние 24 часа:**", parse_mode="Markdown")
+    else:
+        # За сутки лайков не было — показываем самых привлекательных по свайпам
+        hot_ids = await get_most_desirable(3)
+        if not hot_ids:
+            await message.answer("Пока нет активности за последние 24 часа.")
+            return
+        await message.answer("🔥 **За сутки лайков не было. Самые популярные анкеты:**", parse_mode="Markdown")
     for uid in hot_ids:
         profile = await get_profile(uid)
         if not profile:
             continue
-        name = _esc(profile['name'])
-        age = profile['age']
-        description = _esc(profile['description'])
-        photos = profile.get('photos', [])
-        verified_mark = " ✅" if profile.get('verified') else ""
-        text = f"👤 {name}, {age}{verified_mark}\n{description}"
+        card = get_card(uid, profile, 'hot')
+        text, photos = card.text, card.photos
         try:
             if photos:
                 await message.answer_photo(photo=photos[0], caption=text)
@@ -1437,14 +1605,8 @@ async def cmd_roulette(message: Message, state: FSMContext):
     # Помечаем рулетку использованной сразу — до показа
     await set_roulette_used(user_id)
 
-    name = roulette_profile['name']
-    age = roulette_profile['age']
-    description = roulette_profile['description']
-    photos = roulette_profile.get('photos', [])
-    inst = roulette_profile['institute']
-    verified_mark = " ✅" if roulette_profile.get('verified') else ""
-
-    text = f"🎰 **Рулетка! Анкета из {inst}:**\n{name}, {age}{verified_mark}\n{description}"
+    card = get_card(random_id, roulette_profile, 'roulette')
+    text, photos = card.text, card.photos
 
     await state.set_state(RouletteState.viewing)
     await state.update_data(current_roulette_id=random_id)
@@ -1493,6 +1655,35 @@ async def handle_roulette_pass(callback: CallbackQuery, state: FSMContext):
     await callback.answer("Пропущено.")
     await state.clear()
 
+# --------------------- ПОИСК ПО ИНТЕРЕСАМ ---------------------
+@router.message(Command("search"))
+@router.message(F.text == "Поиск по интересам")
+async def cmd_search(message: Message, state: FSMContext):
+    user_id = message.from_user.id
+    if not await get_profile(user_id):
+        await message.answer("Сначала создайте свою анкету.", reply_markup=get_main_keyboard(False))
+        return
+    await state.clear()
+    await state.set_state(SearchProfiles.waiting_for_query)
+    await message.answer(
+        "Напишите, что вам интересно, например: «музыка походы кино». "
+        "Покажем анкеты, в описании которых это есть.",
+        reply_markup=get_back_keyboard()
+    )
+
+@router.message(SearchProfiles.waiting_for_query, F.text, ~F.text.in_(_MENU_BUTTONS))
+async def process_search_query(message: Message, state: FSMContext):
+    user_id = message.from_user.id
+    search_data = {}
+    found = await start_search(user_id, search_data, message.text)
+    if not found:
+        await message.answer("По такому запросу никого не нашлось. Попробуйте другие слова.")
+        return
+    await state.set_state(BrowseProfiles.browsing)
+    await state.set_data({**search_data, 'current_profile_id': None, 'last_message_id': None})
+    await message.answer(f"Нашлось анкет: {found}. Для возврата в меню нажмите кнопку ниже.")
+    await show_next_profile(message, user_id, state)
+
 # --------------------- КТО СМОТРЕЛ (фича 12) ---------------------
 @router.message(F.text == "Кто смотрел")
 async def cmd_who_viewed(message: Message):
@@ -1,3 +1,7 @@
+import copy
+from functools import lru_cache
+
+from pydantic import BaseModel
 from aiogram.types import (
     ReplyKeyboardMarkup, KeyboardButton,
     InlineKeyboardMarkup, InlineKeyboardButton,
@@ -5,7 +9,55 @@ from aiogram.types import (
 )
 from data import INSTITUTES
 
+# Клавиатуры собираются один раз и дальше отдаются из кэша. Сами модели
+# aiogram изменяемы, поэтому в кэш кладётся замороженная копия (freeze):
+# один экземпляр можно слать всем, и никто не испортит его соседям.
+# Inline-клавиатуры зависят от id анкеты — для них кэш ограничен.
+INLINE_KEYBOARD_CACHE = 1024
+
+
+class _FrozenRows(list):
+    """Список только для чтения: для aiogram и pydantic это обычный list."""
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("замороженная разметка не меняется")
+
+    append = extend = insert = remove = pop = clear = sort = reverse = _read_only
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(item, memo) for item in self]
+
+
+@lru_cache(maxsize=None)
+def _frozen_class(cls):
+    frozen = type(cls.__name__, (cls,), {
+        "__module__": cls.__module__,
+        "__qualname__": cls.__qualname__,
+        "model_config": {**cls.model_config, "frozen": True},
+    })
+    frozen.model_rebuild()
+    return frozen
+
+
+def freeze(value):
+    """Глубокая неизменяемая копия объекта aiogram (клавиатуры, InputMedia*).
+
+    Копия — подкласс исходного типа с frozen=True, списки внутри — только
+    для чтения; отправляется так же, как оригинал.
+    """
+    if isinstance(value, BaseModel):
+        fields = {name: freeze(getattr(value, name)) for name in value.model_fields_set}
+        return _frozen_class(type(value)).model_construct(_fields_set=value.model_fields_set, **fields)
+    if isinstance(value, list):
+        return _FrozenRows(freeze(item) for item in value)
+    return value
+
 # ------------- Reply-клавиатуры -------------
+@lru_cache(maxsize=None)
 def get_main_keyboard(has_profile: bool = False):
     buttons = []
     if not has_profile:
@@ -14,8 +66,9 @@ def get_main_keyboard(has_profile: bool = False):
     buttons.append([KeyboardButton(text="Рулетка"), KeyboardButton(text="Мой рейтинг")])
     buttons.append([KeyboardButton(text="Топ встреч"), KeyboardButton(text="Мои задания")])
     buttons.append([KeyboardButton(text="Редактировать анкету"), KeyboardButton(text="⚙️ Ещё...")])
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+    return freeze(ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True))
 
+@lru_cache(maxsize=None)
 def get_admin_keyboard(has_profile: bool = False):
     buttons = []
     if not has_profile:
@@ -25,11 +78,13 @@ def get_admin_keyboard(has_profile: bool = False):
     buttons.append([KeyboardButton(text="Топ встреч"), KeyboardButton(text="Мои задания")])
     buttons.append([KeyboardButton(text="Редактировать анкету"), KeyboardButton(text="⚙️ Ещё...")])
     buttons.append([KeyboardButton(text="Статистика")])
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+    return freeze(ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True))
 
+@lru_cache(maxsize=None)
 def get_more_keyboard(verified: bool = False, is_admin: bool = False) -> ReplyKeyboardMarkup:
     buttons = [
         [KeyboardButton(text="Горячие сегодня"), KeyboardButton(text="Топ института")],
+        [KeyboardButton(text="Поиск по интересам")],
     ]
     row2 = [KeyboardButton(text="Кто смотрел")]
     if not verified:
@@ -41,49 +96,75 @@ def get_more_keyboard(verified: bool = False, is_admin: bool = False) -> ReplyKe
     row3.append(KeyboardButton(text="Удалить анкету"))
     buttons.append(row3)
     buttons.append([KeyboardButton(text="← Назад")])
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+    return freeze(ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True))
 
 # остальные функции без изменений
+@lru_cache(maxsize=None)
 def get_edit_keyboard():
     buttons = [
         [KeyboardButton(text="Изменить имя"), KeyboardButton(text="Изменить возраст")],
         [KeyboardButton(text="Изменить пол"), KeyboardButton(text="Изменить интересы")],
         [KeyboardButton(text="Изменить институт"), KeyboardButton(text="Изменить описание")],
         [KeyboardButton(text="Изменить фото"), KeyboardButton(text="Добавить видео в анкету")],
+        [KeyboardButton(text="Фильтры просмотра")],
         [KeyboardButton(text="Пересоздать анкету")],
         [KeyboardButton(text="Назад")]
     ]
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+    return freeze(ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True))
 
+@lru_cache(maxsize=None)
 def get_gender_keyboard():
     buttons = [[KeyboardButton(text="Парень"), KeyboardButton(text="Девушка")]]
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=True)
+    return freeze(ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=True))
 
+@lru_cache(maxsize=None)
 def get_interests_keyboard():
     buttons = [
         [KeyboardButton(text="Парни"), KeyboardButton(text="Девушки")],
         [KeyboardButton(text="Все")]
     ]
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=True)
+    return freeze(ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=True))
 
+@lru_cache(maxsize=None)
 def get_institute_keyboard():
     buttons = []
     for i in range(0, len(INSTITUTES), 2):
         row = [KeyboardButton(text=inst) for inst in INSTITUTES[i:i+2]]
         buttons.append(row)
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=True)
+    return freeze(ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True, one_time_keyboard=True))
 
+@lru_cache(maxsize=None)
+def get_filters_keyboard():
+    buttons = [
+        [KeyboardButton(text="Возраст анкет"), KeyboardButton(text="Институты анкет")],
+        [KeyboardButton(text="Только верифицированные")],
+        [KeyboardButton(text="Сбросить фильтры"), KeyboardButton(text="Назад")],
+    ]
+    return freeze(ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True))
+
+@lru_cache(maxsize=None)
+def get_filter_institutes_keyboard():
+    buttons = []
+    for i in range(0, len(INSTITUTES), 2):
+        row = [KeyboardButton(text=inst) for inst in INSTITUTES[i:i+2]]
+        buttons.append(row)
+    buttons.append([KeyboardButton(text="Все институты"), KeyboardButton(text="Готово")])
+    return freeze(ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True))
+
+@lru_cache(maxsize=None)
 def get_done_keyboard():
     button = KeyboardButton(text="Готово")
-    return ReplyKeyboardMarkup(keyboard=[[button]], resize_keyboard=True)
+    return freeze(ReplyKeyboardMarkup(keyboard=[[button]], resize_keyboard=True))
 
+@lru_cache(maxsize=None)
 def get_back_keyboard():
     button = KeyboardButton(text="Назад в меню")
-    return ReplyKeyboardMarkup(keyboard=[[button]], resize_keyboard=True)
+    return freeze(ReplyKeyboardMarkup(keyboard=[[button]], resize_keyboard=True))
 
 remove_keyboard = ReplyKeyboardRemove()
 
 # ------------- Inline-клавиатуры -------------
+@lru_cache(maxsize=INLINE_KEYBOARD_CACHE)
 def get_like_dislike_superlike_keyboard(owner_id: int):
     buttons = [
         [
@@ -92,8 +173,9 @@ def get_like_dislike_superlike_keyboard(owner_id: int):
             InlineKeyboardButton(text="👎", callback_data=f"dislike_{owner_id}")
         ]
     ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return freeze(InlineKeyboardMarkup(inline_keyboard=buttons))
 
+@lru_cache(maxsize=INLINE_KEYBOARD_CACHE)
 def get_reply_keyboard(liker_id: int):
     buttons = [
         [
@@ -101,8 +183,9 @@ def get_reply_keyboard(liker_id: int):
             InlineKeyboardButton(text="👎 Дизлайк", callback_data=f"reply_dislike_{liker_id}")
         ]
     ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return freeze(InlineKeyboardMarkup(inline_keyboard=buttons))
 
+@lru_cache(maxsize=None)
 def get_delete_confirm_keyboard():
     buttons = [
         [
@@ -110,7 +193,7 @@ def get_delete_confirm_keyboard():
             InlineKeyboardButton(text="❌ Нет, отмена", callback_data="delete_cancel")
         ]
     ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return freeze(InlineKeyboardMarkup(inline_keyboard=buttons))
 
 def get_meet_keyboard(offer_id: int, user_id: int, other_id: int):
     """Клавиатура для предложения встречи (сейчас не используется, но оставим для совместимости)"""
@@ -122,14 +205,16 @@ def get_meet_keyboard(offer_id: int, user_id: int, other_id: int):
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@lru_cache(maxsize=INLINE_KEYBOARD_CACHE)
 def get_rating_keyboard(target_id: int):
     buttons = []
     row = []
     for i in range(1, 6):
         row.append(InlineKeyboardButton(text=str(i), callback_data=f"rate_{i}_{target_id}"))
     buttons.append(row)
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return freeze(InlineKeyboardMarkup(inline_keyboard=buttons))
 
+@lru_cache(maxsize=INLINE_KEYBOARD_CACHE)
 def get_roulette_keyboard(profile_id: int) -> InlineKeyboardMarkup:
     buttons = [
         [
@@ -137,8 +222,9 @@ def get_roulette_keyboard(profile_id: int) -> InlineKeyboardMarkup:
             InlineKeyboardButton(text="➡️ Пропустить", callback_data=f"roulette_pass_{profile_id}")
         ]
     ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return freeze(InlineKeyboardMarkup(inline_keyboard=buttons))
 
+@lru_cache(maxsize=INLINE_KEYBOARD_CACHE)
 def get_verification_admin_keyboard(user_id: int) -> InlineKeyboardMarkup:
     buttons = [
         [
@@ -146,4 +232,4 @@ def get_verification_admin_keyboard(user_id: int) -> InlineKeyboardMarkup:
             InlineKeyboardButton(text="❌ Отклонить", callback_data=f"verify_decline_{user_id}")
         ]
     ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
\ No newline at end of file
+    return freeze(InlineKeyboardMarkup(inline_keyboard=buttons))
\ No newline at end of file
@@ -1,23 +1,41 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from config import BOT_TOKEN
 from handlers import router
-from data import init_db
+from data import init_db, pool, swipes, profile_cache, activity, delivery
+import cards
+from fsm_storage import SQLiteStorage
 
 logging.basicConfig(level=logging.INFO)
 
 async def main():
-    await init_db()  # создаст таблицы, если их нет
+    await pool.open()
+    await init_db()  # применит недостающие миграции схемы
+    await delivery.load()  # кто заблокировал бота — до первых уведомлений
+    swipes.start()
+    storage = SQLiteStorage(pool)
+    storage.start()  # выгрузка простаивающих сессий в БД
     bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = Dispatcher(storage=storage)
     dp.include_router(router)
     try:
         await dp.start_polling(bot)
     finally:
-        await bot.session.close()
+        # Каждый шаг отдельно: ошибка одного не должна оставить незакрытыми остальные
+        for close in (bot.session.close,
+                      swipes.close,  # дописываем накопленные лайки и просмотры
+                      storage.close):  # обычно уже закрыт Dispatcher'ом; повторный вызов ничего не пишет
+            try:
+                await close()
+            except Exception as e:
+                logging.error(f"Ошибка при остановке ({close.__qualname__}): {e!r}")
+        logging.info(f"Счётчики БД: {pool.stats()}")
+        logging.info(f"Кэш анкет: {profile_cache.stats()}, карточек: {cards.stats()}")
+        logging.info(f"Сессии FSM: {storage.stats()}")
+        logging.info(f"Активность: {activity.stats()}, доставка: {delivery.stats()}")
+        await pool.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -1,55 +1,349 @@
+import asyncio
 import random
-from data import get_all_profiles, get_ratings, get_profile
+import struct
+import time
+from array import array
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+import numpy as np
+
+import activity
+import compat
+from data import (delivery, exposure, get_browse_filters, get_candidate_pools, get_candidate_queue, get_profile,
+                  get_profile_partitions, get_recommendations, on_profile_change, search_profiles, seen)
+from seen_sets import bits_from_indices
+import profile_store
+import ranking
+
+# Откуда берутся пулы анкет: 'index' — CandidateIndex и битовые карты в памяти,
+# 'sql' — один запрос с анти-join'ами (data.get_candidate_pools), 'queue' —
+# новые из очереди candidate_queue (нужно data.CANDIDATE_QUEUE = True),
+# лайкнутые и дизлайкнутые — как в 'index', 'columns' — маски по колонкам
+# profile_store.profiles
+POOL_SOURCE = 'index'
+# Для 'sql': сколько случайных id каждого пула забирать за раз (None — все)
+POOL_SAMPLE = 200
+# Новые анкеты показываются в порядке ranking.rank; False — в случайном
+RANK_NEW_POOL = True
+# Рекомендации recommender.py (если есть) идут в начале пула новых анкет
+USE_RECOMMENDATIONS = True
+# Часть мест в начале пула новых — анкетам, которым не хватает показов (exposure.py)
+BALANCE_EXPOSURE = True
+# Раз во сколько секунд CandidateIndex перечитывается целиком (verified от ModeratorBot)
+INDEX_TTL = 300  # секунды
+# Анкеты тех, кто не заходил в бот дольше INACTIVE_DAYS дней (profiles.last_active,
+# activity.py), не попадают в пулы и поиск; None — показывать всех. Кто
+# заходил недавно, но не сегодня, просто ниже в очереди (ranking, recency)
+INACTIVE_DAYS = 30
+
+
+class CandidateIndex:
+    """Анкеты, разбитые по классу совместимости (compat.py), институту, возрасту и верификации, в виде битовых карт над номерами seen_sets.
+
+    Загружается один раз (только user_id и эти четыре поля плюс last_active,
+    без описания и фото) и дальше обновляется точечно: data.py сообщает об
+    изменении анкеты, её id помечается, и перед следующей выборкой
+    перечитываются только помеченные строки. Удалённая анкета просто не
+    найдётся и выпадет из карт. Верификацию ставит ModeratorBot, а
+    last_active пишет activity.py — оба в обход data._profile_changed,
+    поэтому раз в INDEX_TTL секунд индекс перечитывается целиком. Карта
+    неактивных (_dormant) считается от момента загрузки: на сроке в дни
+    INDEX_TTL не заметен. Карта недоступных (_unreachable, delivery.py)
+    обновляется сразу: смена доступности вызывает data._profile_changed.
+    """
+
+    def __init__(self):
+        self._by_class: Dict[int, int] = {}
+        self._by_institute: Dict[str, int] = {}
+        self._by_age: Dict[Optional[int], int] = {}
+        self._verified = 0
+        self._dormant = 0
+        self._unreachable = 0
+        # Анкеты с last_active раньше этого момента — неактивные ('' — таких нет)
+        self._dormant_before = ''
+        # user_id -> (класс, институт, возраст, verified, номер бита); номер
+        # храним, потому что после удаления анкеты seen_sets его уже забыл
+        self._members: Dict[int, Tuple[int, str, Optional[int], int, int]] = {}
+        self._dirty: Set[int] = set()
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    def mark_dirty(self, user_id: int):
+        self._dirty.add(user_id)
+
+    def reset(self):
+        """Забывает загруженные карты (после подмены файла БД): следующая выборка загрузит их заново."""
+        self._dirty.clear()
+        self._loaded_at = None
+
+    def _remove(self, user_id: int):
+        compat_class, institute, age, verified, idx = self._members.pop(user_id)
+        bit = 1 << idx
+        self._by_class[compat_class] &= ~bit
+        self._by_institute[institute] &= ~bit
+        self._by_age[age] &= ~bit
+        self._verified &= ~bit
+        self._dormant &= ~bit
+        self._unreachable &= ~bit
+
+    def _is_dormant(self, last_active: Optional[str]) -> bool:
+        return last_active is not None and last_active < self._dormant_before
+
+    async def _apply(self, user_ids: Iterable[int],
+                     partitions: Dict[int, Tuple[int, str, Optional[int], int, Optional[str]]]):
+        indices = dict(zip(partitions, await seen.indices_of(partitions)))
+        for user_id in user_ids:
+            if user_id in self._members:
+                self._remove(user_id)
+            if user_id in partitions:
+                compat_class, institute, age, verified, last_active = partitions[user_id]
+                idx = indices[user_id]
+                bit = 1 << idx
+                self._by_class[compat_class] = self._by_class.get(compat_class, 0) | bit
+                self._by_institute[institute] = self._by_institute.get(institute, 0) | bit
+                self._by_age[age] = self._by_age.get(age, 0) | bit
+                if verified:
+                    self._verified |= bit
+                if self._is_dormant(last_active):
+                    self._dormant |= bit
+                if delivery.is_unreachable(user_id):
+                    self._unreachable |= bit
+                self._members[user_id] = (compat_class, institute, age, verified, idx)
+
+    async def _refresh(self):
+        async with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > INDEX_TTL:
+                self._dirty.clear()
+                await self._load_all()
+                self._loaded_at = time.monotonic()
+            if self._dirty:
+                dirty, self._dirty = self._dirty, set()
+                await self._apply(dirty, await get_profile_partitions(dirty))
+
+    async def _load_all(self):
+        # Полная загрузка: карты собираем целиком, а не по одному биту
+        partitions = await get_profile_partitions()
+        indices = await seen.indices_of(partitions)
+        self._dormant_before = activity.timestamp(INACTIVE_DAYS) if INACTIVE_DAYS is not None else ''
+        by_class: Dict[int, list] = {}
+        by_institute: Dict[str, list] = {}
+        by_age: Dict[Optional[int], list] = {}
+        verified_idx = []
+        dormant_idx = []
+        unreachable_idx = []
+        members = {}
+        for (user_id, (compat_class, institute, age, verified, last_active)), idx in zip(partitions.items(), indices):
+            by_class.setdefault(compat_class, []).append(idx)
+            by_institute.setdefault(institute, []).append(idx)
+            by_age.setdefault(age, []).append(idx)
+            if verified:
+                verified_idx.append(idx)
+            if self._is_dormant(last_active):
+                dormant_idx.append(idx)
+            if delivery.is_unreachable(user_id):
+                unreachable_idx.append(idx)
+            members[user_id] = (compat_class, institute, age, verified, idx)
+        self._members = members
+        self._by_class = {compat_class: bits_from_indices(idx) for compat_class, idx in by_class.items()}
+        self._by_institute = {institute: bits_from_indices(idx) for institute, idx in by_institute.items()}
+        self._by_age = {age: bits_from_indices(idx) for age, idx in by_age.items()}
+        self._verified = bits_from_indices(verified_idx)
+        self._dormant = bits_from_indices(dormant_idx)
+        self._unreachable = bits_from_indices(unreachable_idx)
+
+    async def bits(self, classes: Iterable[int], institutes: Optional[Iterable[str]] = None, exclude: int = None,
+                   filters: Optional[Dict[str, Any]] = None, active_only: bool = False,
+                   reachable_only: bool = False) -> int:
+        """Карта анкет одного из классов classes (и, если задано, из institutes, под фильтры просмотра filters,
+        только активных и только доступных)."""
+        await self._refresh()
+        result = 0
+        for compat_class in classes:
+            result |= self._by_class.get(compat_class, 0)
+        if filters and filters['institutes']:
+            institutes = filters['institutes'] if institutes is None else set(institutes) & set(filters['institutes'])
+        if institutes is not None:
+            by_institute = 0
+            for institute in institutes:
+                by_institute |= self._by_institute.get(institute, 0)
+            result &= by_institute
+        if filters and (filters['age_min'] is not None or filters['age_max'] is not None):
+            # Возрастов — пара десятков, объединяем карты тех, что в диапазоне
+            low = filters['age_min'] if filters['age_min'] is not None else 0
+            high = filters['age_max'] if filters['age_max'] is not None else float('inf')
+            by_age = 0
+            for age, age_bits in self._by_age.items():
+                if age is not None and low <= age <= high:
+                    by_age |= age_bits
+            result &= by_age
+        if filters and filters['verified_only']:
+            result &= self._verified
+        if active_only:
+            result &= ~self._dormant
+        if reachable_only:
+            result &= ~self._unreachable
+        if exclude in self._members:
+            result &= ~(1 << self._members[exclude][-1])
+        return result
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+
+candidates = CandidateIndex()
+on_profile_change(candidates.mark_dirty)
 
 
 async def get_profile_pools(user_id: int):
     """
     Возвращает (new_ids, disliked_ids, liked_ids) для пользователя.
-    new_ids     – анкеты, которые пользователь ещё не оценивал.
+    new_ids     – анкеты, которые пользователь ещё не оценивал (для 'index' и
+                  'columns' — np.ndarray: он сразу идёт в ranking.rank).
     disliked_ids – анкеты, которые пользователь дизлайкнул.
     liked_ids   – анкеты, которые пользователь уже лайкнул.
-    Все списки отфильтрованы по полу согласно интересам пользователя.
+    Во всех списках только взаимно совместимые анкеты: пол каждой подходит
+    под интересы другой (compat.MUTUAL), и только подходящие под фильтры
+    просмотра пользователя (data.get_browse_filters), активные за последние
+    INACTIVE_DAYS дней и доступные для сообщений (delivery.py).
     """
-    all_profiles = await get_all_profiles()
     current_user = await get_profile(user_id)
     if not current_user:
         return [], [], []
 
-    interests = current_user['interests']
-    allowed_genders = []
-    if interests == "Парни":
-        allowed_genders = ["Парень"]
-    elif interests == "Девушки":
-        allowed_genders = ["Девушка"]
-    elif interests == "Все":
-        allowed_genders = ["Парень", "Девушка"]
-
-    ratings = await get_ratings(user_id)
-    liked = ratings['liked']
-    disliked = ratings['disliked']
-
-    new_ids = []
-    disliked_ids = []
-    liked_ids = []
-    for uid, profile in all_profiles.items():
-        if uid == user_id:
-            continue
-        if profile.get('gender') not in allowed_genders:
-            continue
-        if uid in liked:
-            liked_ids.append(uid)
-        elif uid in disliked:
-            disliked_ids.append(uid)
-        else:
-            new_ids.append(uid)
+    classes = compat.MUTUAL[compat.class_of(current_user['gender'], current_user['interests'])]
+    filters = await get_browse_filters(user_id)
+    active_since = _active_since()
+    await delivery.load()
+    if POOL_SOURCE == 'sql':
+        return await get_candidate_pools(user_id, classes, POOL_SAMPLE, filters, active_since)
+    if POOL_SOURCE == 'columns':
+        return await _column_pools(user_id, classes, filters, active_since)
+
+    # Совместимые анкеты (CandidateIndex) и оценки пользователя — битовые
+    # карты над плотными номерами, пулы считаются через & и & ~
+    allowed = await candidates.bits(classes, exclude=user_id, filters=filters, active_only=active_since is not None,
+                                    reachable_only=True)
+    sets = await seen.load(user_id)
+    liked, disliked = sets['likes'], sets['dislikes']
+
+    liked_ids = await seen.to_ids(allowed & liked)
+    disliked_ids = await seen.to_ids(allowed & disliked & ~liked)
+    if POOL_SOURCE == 'queue':
+        new_ids = await get_candidate_queue(user_id, filters, active_since)
+    else:
+        new_ids = await seen.to_array(allowed & ~(liked | disliked))
 
     return new_ids, disliked_ids, liked_ids
 
 
-async def get_next_profile(user_id: int, state_data: dict) -> tuple:
+def _active_since() -> Optional[str]:
+    return activity.timestamp(INACTIVE_DAYS) if INACTIVE_DAYS is not None else None
+
+
+async def _column_pools(user_id: int, classes: Tuple[int, ...], filters: Optional[Dict[str, Any]],
+                        active_since: Optional[str]):
+    # Совместимые анкеты — маска по колонкам profile_store, оценки — id из seen_sets
+    store = profile_store.profiles
+    await store.refresh()
+    allowed = store.ids(store.mask(classes, filters=filters, exclude=user_id, active_since=activity.day(active_since)))
+    if delivery.unreachable:
+        allowed = allowed[~np.isin(allowed, np.fromiter(delivery.unreachable, dtype=np.int64))]
+    sets = await seen.load(user_id)
+    is_liked = np.isin(allowed, np.array(await seen.to_ids(sets['likes']), dtype=np.int64))
+    is_disliked = np.isin(allowed, np.array(await seen.to_ids(sets['dislikes']), dtype=np.int64)) & ~is_liked
+    return allowed[~(is_liked | is_disliked)], allowed[is_disliked].tolist(), allowed[is_liked].tolist()
+
+
+# ---------- Пулы в данных FSM ----------
+# Пул хранится как перетасованная перестановка id, упакованная в bytes
+# (array('q')), плюс курсор: взять следующую анкету — O(1), а данные FSM
+# на каждом свайпе меняются только в одном int. Ключи: <имя>_pool,
+# <имя>_pos и <имя>_seed (зерно перестановки или шума ранжирования, чтобы
+# порядок можно было повторить).
+_ITEM = struct.Struct('q')
+
+
+def _set_pool(state_data: dict, name: str, ids, seed: Optional[int] = None, ordered: bool = False):
+    if seed is None:
+        seed = random.getrandbits(32)
+    if ordered and isinstance(ids, np.ndarray):
+        state_data[f'{name}_pool'] = ids.astype(np.int64, copy=False).tobytes()
+    else:
+        ids = list(ids)
+        if not ordered:
+            random.Random(seed).shuffle(ids)
+        state_data[f'{name}_pool'] = array('q', ids).tobytes()
+    state_data[f'{name}_pos'] = 0
+    state_data[f'{name}_seed'] = seed
+
+
+async def _set_new_pool(user_id: int, state_data: dict, ids):
+    seed = random.getrandbits(32)
+    if RANK_NEW_POOL:
+        ids = await ranking.rank(user_id, ids, seed)
+    else:
+        ids = list(ids)
+        random.Random(seed).shuffle(ids)
+        ids = np.array(ids, dtype=np.int64)
+    if USE_RECOMMENDATIONS:
+        recommended = await get_recommendations(user_id)
+        if recommended:
+            # Только те, что и так есть в пуле: пол подходит, анкета не оценена
+            recommended = np.array(recommended, dtype=np.int64)
+            in_pool = np.isin(ids, recommended)
+            first = recommended[np.isin(recommended, ids[in_pool])]
+            ids = np.concatenate([first, ids[~in_pool]])
+    if BALANCE_EXPOSURE:
+        ids = await exposure.schedule(ids)
+    _set_pool(state_data, 'new', ids, seed, ordered=True)
+
+
+def _pool_left(state_data: dict, name: str) -> int:
+    return len(state_data.get(f'{name}_pool') or b'') // _ITEM.size - state_data.get(f'{name}_pos', 0)
+
+
+def _take(state_data: dict, name: str) -> int:
+    pos = state_data[f'{name}_pos']
+    state_data[f'{name}_pos'] = pos + 1
+    return _ITEM.unpack_from(state_data[f'{name}_pool'], pos * _ITEM.size)[0]
+
+
+def _pool_ids(state_data: dict, name: str):
+    return array('q', state_data.get(f'{name}_pool') or b'')
+
+
+async def start_search(user_id: int, state_data: dict, text: str) -> int:
+    """Режим поиска: пул новых — анкеты, найденные по описанию (data.search_profiles), в порядке bm25.
+
+    Только взаимно совместимые, под фильтры просмотра, активные за
+    INACTIVE_DAYS дней, доступные и ещё не оценённые.
+    Пока state_data['search'] стоит, get_next_profile берёт анкеты только из
+    этого пула. Возвращает, сколько анкет найдено.
+    """
+    current_user = await get_profile(user_id)
+    if not current_user:
+        return 0
+    classes = compat.MUTUAL[compat.class_of(current_user['gender'], current_user['interests'])]
+    found = await search_profiles(user_id, text, classes, filters=await get_browse_filters(user_id),
+                                  active_since=_active_since())
+    sets = await seen.load(user_id)
+    rated = sets['likes'] | sets['dislikes']
+    ids = [uid for uid, idx in zip(found, await seen.indices_of(found)) if not rated >> idx & 1]
+    _set_pool(state_data, 'new', ids, ordered=True)
+    for name in ('disliked', 'liked'):
+        _set_pool(state_data, name, ())
+    state_data.update(current_pool='new', pools_loaded=True, search=True)
+    return len(ids)
+
+
+async def get_next_profile(user_id: int, state_data: dict, reload: bool = True) -> tuple:
     """
     Возвращает (next_profile_id, updated_state_data, is_revisit).
     is_revisit=True означает, что анкета из пула уже лайкнутых (показывается повторно).
+    reload=False — только по уже загруженным пулам (предвыборка, prefetch.py):
+    если нужно загрузить пулы из БД, возвращает None и ничего не загружает.
+    Текущая анкета к этому моменту ещё не оценена, и загрузка
+    вернула бы её снова как новую.
 
     Иерархия фолбэков:
       1. new_pool     — непросмотренные анкеты
@@ -60,63 +354,74 @@ async def get_next_profile(user_id: int, state_data: dict) -> tuple:
     """
     # Инициализация пулов при первом вызове
     if not state_data.get('pools_loaded'):
+        if not reload:
+            return None, state_data, False
         new_ids, disliked_ids, liked_ids = await get_profile_pools(user_id)
-        state_data['new_pool'] = new_ids
-        state_data['disliked_pool'] = disliked_ids
-        state_data['liked_pool'] = liked_ids
+        await _set_new_pool(user_id, state_data, new_ids)
+        _set_pool(state_data, 'disliked', disliked_ids)
+        _set_pool(state_data, 'liked', liked_ids)
         state_data['current_pool'] = 'new'
         state_data['pools_loaded'] = True
 
     # Фаза 1: новые анкеты
-    if state_data['current_pool'] == 'new' and state_data['new_pool']:
-        next_id = random.choice(state_data['new_pool'])
-        state_data['new_pool'].remove(next_id)
-        return next_id, state_data, False
+    if state_data['current_pool'] == 'new' and _pool_left(state_data, 'new'):
+        return _take(state_data, 'new'), state_data, False
+
+    # Результаты поиска (start_search) закончились — фолбэков у поиска нет
+    if state_data.get('search'):
+        return None, state_data, False
+
+    # new_pool пуст — при выборке из SQL это лишь её конец, добираем следующую
+    if state_data['current_pool'] == 'new' and POOL_SOURCE == 'sql' and POOL_SAMPLE:
+        if not reload:
+            return None, state_data, False
+        new_ids, _, _ = await get_profile_pools(user_id)
+        if len(new_ids):
+            await _set_new_pool(user_id, state_data, new_ids)
+            return _take(state_data, 'new'), state_data, False
 
     # new_pool пуст — переходим к дизлайкнутым
-    if state_data['current_pool'] == 'new' and not state_data['new_pool']:
+    if state_data['current_pool'] == 'new':
         state_data['current_pool'] = 'disliked'
 
     # Фаза 2: дизлайкнутые анкеты
     if state_data['current_pool'] == 'disliked':
-        if state_data['disliked_pool']:
-            next_id = random.choice(state_data['disliked_pool'])
-            state_data['disliked_pool'].remove(next_id)
-            # Возвращаем в new_pool для следующего цикла
-            state_data['new_pool'].append(next_id)
-            return next_id, state_data, False
-
-        # disliked_pool пуст, но new_pool пополнился (из дизлайков)
-        if state_data['new_pool']:
+        if _pool_left(state_data, 'disliked'):
+            return _take(state_data, 'disliked'), state_data, False
+
+        # disliked_pool пуст — показанные дизлайкнутые возвращаются в new_pool
+        # на следующий цикл (в новом случайном порядке)
+        if not _pool_left(state_data, 'new') and state_data.get('disliked_pos'):
+            _set_pool(state_data, 'new', _pool_ids(state_data, 'disliked'))
+            _set_pool(state_data, 'disliked', ())
+        if _pool_left(state_data, 'new'):
             state_data['current_pool'] = 'new'
-            next_id = random.choice(state_data['new_pool'])
-            state_data['new_pool'].remove(next_id)
-            return next_id, state_data, False
+            return _take(state_data, 'new'), state_data, False
 
         # Полный цикл завершён — обновляем из БД (ловим новых пользователей)
+        if not reload:
+            return None, state_data, False
         new_ids, _, _ = await get_profile_pools(user_id)
-        if new_ids:
-            state_data['new_pool'] = new_ids
+        if len(new_ids):
+            await _set_new_pool(user_id, state_data, new_ids)
             state_data['current_pool'] = 'new'
             state_data['pools_loaded'] = True
-            next_id = random.choice(state_data['new_pool'])
-            state_data['new_pool'].remove(next_id)
-            return next_id, state_data, False
+            return _take(state_data, 'new'), state_data, False
 
         # Новых нет — переходим к лайкнутым
         state_data['current_pool'] = 'liked'
 
     # Фаза 3: уже лайкнутые анкеты (показываются с пометкой)
     if state_data['current_pool'] == 'liked':
-        if not state_data.get('liked_pool'):
+        if not _pool_left(state_data, 'liked'):
             # Пополняем из БД
+            if not reload:
+                return None, state_data, False
             _, _, liked_ids = await get_profile_pools(user_id)
-            state_data['liked_pool'] = liked_ids
+            _set_pool(state_data, 'liked', liked_ids)
 
-        if state_data['liked_pool']:
-            next_id = random.choice(state_data['liked_pool'])
-            state_data['liked_pool'].remove(next_id)
-            return next_id, state_data, True
+        if _pool_left(state_data, 'liked'):
+            return _take(state_data, 'liked'), state_data, True
 
     # Пользователь один в системе — нет никаких анкет
     return None, state_data, False
@@ -2,7 +2,6 @@ import os
 import random
 import datetime
 import logging
-import aiosqlite  # <-- добавлено
 from aiogram import Router, F, Bot
 from aiogram.filters import StateFilter
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
@@ -12,7 +11,7 @@ from states import EditProfile
 from data import (
     get_profile, create_meet_task, get_meet_task_by_id,
     update_meet_task_status, add_points, get_active_meet_task_for_user,
-    update_meet_agreement, DB_PATH, award_badge, get_seasonal_info
+    update_meet_agreement, DB_PATH, pool, award_badge, get_seasonal_info
 )
 import config
 
@@ -76,9 +75,8 @@ async def create_meet_after_like(bot: Bot, user1_id: int, user2_id: int, initiat
     )
 
     # Обновляем задание, добавляя ID сообщений
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write() as db:
         await db.execute('UPDATE meet_tasks SET msg1_id = ?, msg2_id = ? WHERE id = ?', (msg1.message_id, msg2.message_id, task_id))
-        await db.commit()
 
 @router.callback_query(F.data.startswith("meet_agree_"))
 async def meet_agree_callback(callback: CallbackQuery, bot: Bot):
@@ -218,12 +216,11 @@ async def handle_video_message(message: Message, bot: Bot):
         video_path = None
 
     # Сохраняем video_file_id и video_path, переводим в waiting_admin
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write() as db:
         await db.execute(
             'UPDATE meet_tasks SET status = ?, video_file_id = ?, video_path = ?, admin_notified = 0 WHERE id = ?',
             ('waiting_admin', video_file_id, video_path, task['id'])
         )
-        await db.commit()
 
     await message.answer("Видео отправлено на проверку. Ожидайте подтверждения администратора.")
 
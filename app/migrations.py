@@ -0,0 +1,614 @@
+"""Версионные миграции схемы bot_database.db.
+
+Текущая версия схемы хранится в PRAGMA user_version. Каждая миграция —
+(номер, описание, корутина(db)); номера идут подряд, начиная с 1, и каждая
+применяется ровно один раз в своей транзакции вместе с записью нового
+user_version. Новые изменения схемы добавляются только в конец MIGRATIONS.
+"""
+import logging
+
+import numpy as np
+
+import compat
+import elo
+from seen_sets import bits_from_indices, pack
+
+# ---------- Миграция 1: базовая схема ----------
+SCHEMA_V1 = [
+    '''
+    CREATE TABLE IF NOT EXISTS profiles (
+        user_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        age INTEGER NOT NULL,
+        gender TEXT NOT NULL,
+        interests TEXT NOT NULL,
+        description TEXT NOT NULL,
+        photos TEXT NOT NULL,
+        institute TEXT DEFAULT 'ИИТ',
+        rating_sum REAL DEFAULT 0,
+        rating_weight REAL DEFAULT 0,
+        verified INTEGER DEFAULT 0,
+        video_file_id TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS likes (
+        user_id INTEGER,
+        liked_user_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, liked_user_id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS dislikes (
+        user_id INTEGER,
+        disliked_user_id INTEGER,
+        PRIMARY KEY (user_id, disliked_user_id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS meet_tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user1_id INTEGER NOT NULL,
+        user2_id INTEGER NOT NULL,
+        initiator_id INTEGER NOT NULL,
+        institute TEXT NOT NULL,
+        location TEXT NOT NULL,
+        status TEXT NOT NULL,
+        user1_confirmed INTEGER DEFAULT 0,
+        user2_confirmed INTEGER DEFAULT 0,
+        msg1_id INTEGER,
+        msg2_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        deadline TIMESTAMP,
+        video_message_id INTEGER,
+        admin_decision INTEGER,
+        admin_notified INTEGER DEFAULT 0,
+        video_file_id TEXT,
+        video_path TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS user_points (
+        user_id INTEGER NOT NULL,
+        year_month TEXT NOT NULL,
+        points INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, year_month)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS ratings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        from_user_id INTEGER NOT NULL,
+        to_user_id INTEGER NOT NULL,
+        value INTEGER NOT NULL,
+        voter_weight REAL NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(from_user_id, to_user_id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS user_streaks (
+        user_id INTEGER PRIMARY KEY,
+        current_streak INTEGER DEFAULT 0,
+        longest_streak INTEGER DEFAULT 0,
+        last_active_date TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS user_badges (
+        user_id INTEGER,
+        badge_type TEXT,
+        awarded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, badge_type)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS daily_task_completions (
+        user_id INTEGER,
+        task_date TEXT,
+        task_type TEXT,
+        PRIMARY KEY (user_id, task_date, task_type)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS roulette_cooldowns (
+        user_id INTEGER PRIMARY KEY,
+        last_date TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS profile_views (
+        viewer_id INTEGER,
+        viewed_id INTEGER,
+        viewed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (viewer_id, viewed_id)
+    )
+    ''',
+    # Таблица запросов на верификацию (для ModeratorBot)
+    '''
+    CREATE TABLE IF NOT EXISTS pending_verifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        photo_file_id TEXT NOT NULL,
+        photo_path TEXT,
+        status TEXT DEFAULT 'pending',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        admin_notified INTEGER DEFAULT 0
+    )
+    ''',
+]
+
+# Колонки, которые старый init_db добавлял через ALTER TABLE. Нужны только
+# для баз, созданных до появления user_version.
+LEGACY_COLUMNS = {
+    'profiles': [
+        ('institute', "TEXT DEFAULT 'ИИТ'"),
+        ('rating_sum', 'REAL DEFAULT 0'),
+        ('rating_weight', 'REAL DEFAULT 0'),
+        ('verified', 'INTEGER DEFAULT 0'),
+        ('video_file_id', 'TEXT'),
+    ],
+    'meet_tasks': [
+        ('user1_confirmed', 'INTEGER DEFAULT 0'),
+        ('user2_confirmed', 'INTEGER DEFAULT 0'),
+        ('msg1_id', 'INTEGER'),
+        ('msg2_id', 'INTEGER'),
+        ('admin_notified', 'INTEGER DEFAULT 0'),
+        ('video_file_id', 'TEXT'),
+        ('video_path', 'TEXT'),
+    ],
+    'likes': [
+        ('created_at', 'TIMESTAMP'),
+    ],
+    'pending_verifications': [
+        ('photo_path', 'TEXT'),
+    ],
+}
+
+
+async def _table_exists(db, table: str) -> bool:
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)) as cursor:
+        return await cursor.fetchone() is not None
+
+
+async def _add_legacy_columns(db):
+    for table, columns in LEGACY_COLUMNS.items():
+        async with db.execute(f"PRAGMA table_info({table})") as cursor:
+            existing = {row[1] for row in await cursor.fetchall()}
+        for column, ddl in columns:
+            if column not in existing:
+                await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+                print(f"Добавлена колонка {column} в {table}")
+
+
+async def _migration_1_baseline(db):
+    # Старую базу (без user_version) сначала дотягиваем до полной схемы,
+    # новая сразу создаётся со всеми колонками
+    legacy = await _table_exists(db, 'profiles')
+    for statement in SCHEMA_V1:
+        await db.execute(statement)
+    if legacy:
+        await _add_legacy_columns(db)
+
+
+# ---------- Миграция 2: индексы для горячих запросов ----------
+# Каждый индекс подобран под конкретный запрос из data.py и по возможности
+# покрывающий, чтобы SQLite не ходил в саму таблицу.
+INDEXES_V2 = [
+    # count_pending_likes, check «кто лайкнул меня», delete_profile
+    'CREATE INDEX IF NOT EXISTS idx_likes_liked_user ON likes(liked_user_id, user_id)',
+    # get_hot_profiles: диапазон по времени + группировка по liked_user_id
+    'CREATE INDEX IF NOT EXISTS idx_likes_created ON likes(created_at, liked_user_id)',
+    # count_today_likes
+    'CREATE INDEX IF NOT EXISTS idx_likes_user_created ON likes(user_id, created_at)',
+    # delete_profile
+    'CREATE INDEX IF NOT EXISTS idx_dislikes_disliked_user ON dislikes(disliked_user_id)',
+    'CREATE INDEX IF NOT EXISTS idx_ratings_to_user ON ratings(to_user_id)',
+    # get_recent_viewers: последние просмотры моей анкеты
+    'CREATE INDEX IF NOT EXISTS idx_profile_views_viewed ON profile_views(viewed_id, viewed_at)',
+    # get_active_meet_task_for_user (OR по двум участникам) и выборки по статусу/дедлайну
+    'CREATE INDEX IF NOT EXISTS idx_meet_tasks_user1 ON meet_tasks(user1_id, status, deadline)',
+    'CREATE INDEX IF NOT EXISTS idx_meet_tasks_user2 ON meet_tasks(user2_id, status, deadline)',
+    'CREATE INDEX IF NOT EXISTS idx_meet_tasks_initiator ON meet_tasks(initiator_id)',
+    'CREATE INDEX IF NOT EXISTS idx_meet_tasks_status_deadline ON meet_tasks(status, deadline)',
+    # get_top_users: топ за месяц, уже отсортированный по очкам
+    'CREATE INDEX IF NOT EXISTS idx_user_points_month ON user_points(year_month, points)',
+    # рулетка и топ института; статистика по полу
+    'CREATE INDEX IF NOT EXISTS idx_profiles_institute ON profiles(institute)',
+    'CREATE INDEX IF NOT EXISTS idx_profiles_gender ON profiles(gender)',
+    # save_verification_request
+    'CREATE INDEX IF NOT EXISTS idx_pending_verifications_user ON pending_verifications(user_id, status)',
+]
+
+
+async def _migration_2_indexes(db):
+    for statement in INDEXES_V2:
+        await db.execute(statement)
+    await db.execute('ANALYZE')
+
+
+# ---------- Миграция 3: битовые карты оценённых анкет (см. seen_sets.py) ----------
+SCHEMA_V3 = [
+    # AUTOINCREMENT: номер удалённого пользователя не достаётся новому,
+    # иначе старые биты в чужих картах указали бы на другого человека
+    '''
+    CREATE TABLE IF NOT EXISTS user_index (
+        idx INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL UNIQUE
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS seen_bitmaps (
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        bits BLOB NOT NULL,
+        PRIMARY KEY (user_id, kind)
+    )
+    ''',
+]
+
+# вид карты -> (таблица, кто оценил, кого оценили)
+SEEN_SOURCES = {
+    'likes': ('likes', 'user_id', 'liked_user_id'),
+    'dislikes': ('dislikes', 'user_id', 'disliked_user_id'),
+    'views': ('profile_views', 'viewer_id', 'viewed_id'),
+}
+
+
+async def rebuild_seen_bitmaps(db):
+    """Пересобирает seen_bitmaps из likes, dislikes и profile_views (миграция, бенчмарки)."""
+    await db.execute('INSERT OR IGNORE INTO user_index (user_id) SELECT user_id FROM profiles ORDER BY user_id')
+    # Строки отсортированы по владельцу, поэтому карта собирается за один проход
+    for kind, (table, owner, target) in SEEN_SOURCES.items():
+        rows, current, indices = [], None, []
+        async with db.execute(
+            f'SELECT t.{owner}, u.idx FROM {table} t JOIN user_index u ON u.user_id = t.{target} ORDER BY t.{owner}'
+        ) as cursor:
+            async for user_id, idx in cursor:
+                if user_id != current:
+                    if indices:
+                        rows.append((current, kind, pack(bits_from_indices(indices))))
+                    current, indices = user_id, []
+                indices.append(idx)
+        if indices:
+            rows.append((current, kind, pack(bits_from_indices(indices))))
+        await db.executemany('INSERT OR REPLACE INTO seen_bitmaps (user_id, kind, bits) VALUES (?, ?, ?)', rows)
+
+
+async def _migration_3_seen_bitmaps(db):
+    for statement in SCHEMA_V3:
+        await db.execute(statement)
+    await rebuild_seen_bitmaps(db)
+
+
+# ---------- Миграция 4: сессии FSM (см. fsm_storage.py) ----------
+SCHEMA_V4 = [
+    '''
+    CREATE TABLE IF NOT EXISTS fsm_sessions (
+        key TEXT PRIMARY KEY,
+        payload BLOB NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+]
+
+
+async def _migration_4_fsm_sessions(db):
+    for statement in SCHEMA_V4:
+        await db.execute(statement)
+
+
+# ---------- Миграция 5: рекомендации коллаборативной фильтрации (см. recommender.py) ----------
+SCHEMA_V5 = [
+    # run_id — номер прогона, который записал строку: прогон перезаписывает
+    # свои строки и в конце удаляет строки прежних прогонов
+    '''
+    CREATE TABLE IF NOT EXISTS recommendations (
+        user_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        target_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        run_id INTEGER NOT NULL,
+        PRIMARY KEY (user_id, rank)
+    )
+    ''',
+]
+
+
+async def _migration_5_recommendations(db):
+    for statement in SCHEMA_V5:
+        await db.execute(statement)
+
+
+# ---------- Миграция 6: привлекательность анкеты (см. elo.py) ----------
+SCHEMA_V6 = [
+    f'ALTER TABLE profiles ADD COLUMN desirability REAL DEFAULT {elo.BASE}',
+    # get_most_desirable
+    'CREATE INDEX IF NOT EXISTS idx_profiles_desirability ON profiles(desirability)',
+]
+
+
+async def rebuild_desirability(db) -> int:
+    """Пересчитывает profiles.desirability по всей истории likes/dislikes (миграция, elo.py)."""
+    async with db.execute('SELECT user_id, liked_user_id FROM likes ORDER BY created_at, rowid') as cursor:
+        likes = np.array(await cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+    async with db.execute('SELECT user_id, disliked_user_id FROM dislikes ORDER BY rowid') as cursor:
+        dislikes = np.array(await cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+    voters, targets, outcomes = elo.interleave((likes[:, 0], likes[:, 1]), (dislikes[:, 0], dislikes[:, 1]))
+    ids, dense = np.unique(np.concatenate([voters, targets]), return_inverse=True)
+    scores = elo.replay(dense[:len(voters)], dense[len(voters):], outcomes, len(ids))
+    rated = np.unique(dense[len(voters):])
+    await db.execute('UPDATE profiles SET desirability = ?', (elo.BASE,))
+    await db.executemany('UPDATE profiles SET desirability = ? WHERE user_id = ?',
+                         zip(scores[rated].tolist(), ids[rated].tolist()))
+    return len(rated)
+
+
+async def _migration_6_desirability(db):
+    for statement in SCHEMA_V6:
+        await db.execute(statement)
+    await rebuild_desirability(db)
+
+
+# ---------- Миграция 7: очередь новых анкет (см. data.CANDIDATE_QUEUE) ----------
+SCHEMA_V7 = [
+    # Строка (user_id, candidate_id) — анкета candidate_id подходит user_id по
+    # полу и ещё не оценена им. WITHOUT ROWID: очередь пользователя лежит
+    # подряд в самом первичном ключе и читается одним диапазоном
+    '''
+    CREATE TABLE IF NOT EXISTS candidate_queue (
+        user_id INTEGER NOT NULL,
+        candidate_id INTEGER NOT NULL,
+        PRIMARY KEY (user_id, candidate_id)
+    ) WITHOUT ROWID
+    ''',
+    # Удаление анкеты из чужих очередей (смена пола, delete_profile)
+    'CREATE INDEX IF NOT EXISTS idx_candidate_queue_candidate ON candidate_queue(candidate_id)',
+    # Кому подходит новая анкета: выборка профилей по интересам
+    'CREATE INDEX IF NOT EXISTS idx_profiles_interests ON profiles(interests)',
+]
+
+
+async def _migration_7_candidate_queue(db):
+    # Таблица создаётся пустой: заполняет её data.init_db, если очередь включена
+    for statement in SCHEMA_V7:
+        await db.execute(statement)
+
+
+# ---------- Миграция 8: класс совместимости анкеты (см. compat.py) ----------
+SCHEMA_V8 = [
+    f'ALTER TABLE profiles ADD COLUMN compat_class INTEGER NOT NULL DEFAULT {compat.UNKNOWN}',
+    # Пулы get_candidate_pools и очередь candidate_queue выбирают анкеты по классу
+    'CREATE INDEX IF NOT EXISTS idx_profiles_compat ON profiles(compat_class)',
+    # Очередь выбирала зрителей по интересам, теперь — тоже по классу
+    'DROP INDEX IF EXISTS idx_profiles_interests',
+    # Очередь строилась по совместимости в одну сторону; если она включена,
+    # data.init_db заполнит её заново
+    'DELETE FROM candidate_queue',
+]
+
+
+async def rebuild_compat_classes(db):
+    """Пересчитывает profiles.compat_class по полу и интересам (миграция, бенчмарки)."""
+    await db.execute('UPDATE profiles SET compat_class = ?', (compat.UNKNOWN,))
+    await db.executemany('UPDATE profiles SET compat_class = ? WHERE gender = ? AND interests = ?',
+                         [(code, gender, interests) for code, (gender, interests) in enumerate(compat.CLASSES)])
+
+
+async def _migration_8_compat_class(db):
+    for statement in SCHEMA_V8:
+        await db.execute(statement)
+    await rebuild_compat_classes(db)
+
+
+# ---------- Миграция 9: счётчики показов анкет (см. exposure.py) ----------
+SCHEMA_V9 = [
+    '''
+    CREATE TABLE IF NOT EXISTS profile_impressions (
+        user_id INTEGER PRIMARY KEY,
+        shown REAL NOT NULL DEFAULT 0
+    )
+    ''',
+    # Начальные значения — сколько человек уже смотрели анкету
+    '''
+    INSERT OR IGNORE INTO profile_impressions (user_id, shown)
+    SELECT p.user_id, (SELECT COUNT(*) FROM profile_views WHERE viewed_id = p.user_id) FROM profiles p
+    ''',
+]
+
+
+async def _migration_9_impressions(db):
+    for statement in SCHEMA_V9:
+        await db.execute(statement)
+
+
+# ---------- Миграция 10: журнал взаимодействий (см. replay.py) ----------
+SCHEMA_V10 = [
+    # Только дописывается: показ анкеты, лайк, дизлайк, суперлайк. Порядок
+    # событий — по id (created_at с точностью до секунды)
+    '''
+    CREATE TABLE IF NOT EXISTS interaction_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TIMESTAMP NOT NULL,
+        viewer_id INTEGER NOT NULL,
+        target_id INTEGER NOT NULL,
+        event TEXT NOT NULL
+    )
+    ''',
+    # delete_profile убирает события пользователя в обе стороны
+    'CREATE INDEX IF NOT EXISTS idx_interaction_log_viewer ON interaction_log(viewer_id)',
+    'CREATE INDEX IF NOT EXISTS idx_interaction_log_target ON interaction_log(target_id)',
+]
+
+
+async def _migration_10_interaction_log(db):
+    for statement in SCHEMA_V10:
+        await db.execute(statement)
+
+
+# ---------- Миграция 11: фильтры просмотра ----------
+SCHEMA_V11 = [
+    '''
+    CREATE TABLE IF NOT EXISTS browse_filters (
+        user_id INTEGER PRIMARY KEY,
+        age_min INTEGER,
+        age_max INTEGER,
+        institutes TEXT,
+        verified_only INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    # Фильтры (data._filters_sql) идут после класса: класс и диапазон возраста
+    # ищутся по индексу, институт и verified проверяются по его же записям,
+    # без чтения строк профилей. Старый индекс по одному классу — его префикс
+    'CREATE INDEX IF NOT EXISTS idx_profiles_browse ON profiles(compat_class, age, institute, verified)',
+    'DROP INDEX IF EXISTS idx_profiles_compat',
+]
+
+
+async def _migration_11_browse_filters(db):
+    for statement in SCHEMA_V11:
+        await db.execute(statement)
+
+
+# ---------- Миграция 12: полнотекстовый поиск по описанию (FTS5) ----------
+# profiles_fts хранит только индекс (content='profiles'): текст берётся из
+# profiles по rowid = user_id. Триггеры обновляют индекс при любой записи в
+# profiles, в том числе из ModeratorBot. save_profile пишет через INSERT OR
+# REPLACE, а при REPLACE триггеры удаления не срабатывают (recursive_triggers
+# выключен), поэтому старую запись из индекса убирает BEFORE INSERT
+SCHEMA_V12 = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS profiles_fts USING fts5(
+        description, content='profiles', content_rowid='user_id', tokenize='unicode61 remove_diacritics 2'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS profiles_fts_before_insert BEFORE INSERT ON profiles BEGIN
+        INSERT INTO profiles_fts (profiles_fts, rowid, description)
+        SELECT 'delete', user_id, description FROM profiles WHERE user_id = NEW.user_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS profiles_fts_after_insert AFTER INSERT ON profiles BEGIN
+        INSERT INTO profiles_fts (rowid, description) VALUES (NEW.user_id, NEW.description);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS profiles_fts_after_delete AFTER DELETE ON profiles BEGIN
+        INSERT INTO profiles_fts (profiles_fts, rowid, description) VALUES ('delete', OLD.user_id, OLD.description);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS profiles_fts_after_update AFTER UPDATE OF description ON profiles BEGIN
+        INSERT INTO profiles_fts (profiles_fts, rowid, description) VALUES ('delete', OLD.user_id, OLD.description);
+        INSERT INTO profiles_fts (rowid, description) VALUES (NEW.user_id, NEW.description);
+    END
+    ''',
+    # Уже существующие анкеты
+    "INSERT INTO profiles_fts (profiles_fts) VALUES ('rebuild')",
+]
+
+
+async def _migration_12_profiles_fts(db):
+    for statement in SCHEMA_V12:
+        await db.execute(statement)
+
+
+# ---------- Миграция 13: время последней активности (см. activity.py) ----------
+SCHEMA_V13 = [
+    'ALTER TABLE profiles ADD COLUMN last_active TIMESTAMP',
+    # Начальные значения — последний лайк, последний просмотр чужой анкеты
+    # или день стрика (конец дня), что позже. Без всего этого — момент
+    # миграции: такие анкеты выпадут из пулов, только если их владельцы не
+    # появятся ещё INACTIVE_DAYS дней
+    '''
+    UPDATE profiles SET last_active = COALESCE(
+        (SELECT MAX(moment) FROM (
+            SELECT MAX(created_at) AS moment FROM likes WHERE user_id = profiles.user_id
+            UNION ALL
+            SELECT MAX(viewed_at) FROM profile_views WHERE viewer_id = profiles.user_id
+            UNION ALL
+            SELECT last_active_date || ' 23:59:59' FROM user_streaks WHERE user_id = profiles.user_id
+        )),
+        CURRENT_TIMESTAMP
+    )
+    ''',
+]
+
+
+async def _migration_13_last_active(db):
+    for statement in SCHEMA_V13:
+        await db.execute(statement)
+
+
+# ---------- Миграция 14: доставляемость сообщений (см. delivery.py) ----------
+SCHEMA_V14 = [
+    # Строка — только у тех, кому отправка не удалась: blocked — бот
+    # заблокирован, failures — неудач подряд, unreachable — не показывать и
+    # не уведомлять
+    '''
+    CREATE TABLE IF NOT EXISTS delivery_health (
+        user_id INTEGER PRIMARY KEY,
+        blocked INTEGER NOT NULL DEFAULT 0,
+        failures INTEGER NOT NULL DEFAULT 0,
+        unreachable INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    # Пулы и рулетка исключают недоступных подзапросом по этому индексу
+    'CREATE INDEX IF NOT EXISTS idx_delivery_unreachable ON delivery_health(unreachable)',
+]
+
+
+async def _migration_14_delivery_health(db):
+    for statement in SCHEMA_V14:
+        await db.execute(statement)
+
+
+MIGRATIONS = [
+    (1, 'базовая схема', _migration_1_baseline),
+    (2, 'индексы для горячих запросов', _migration_2_indexes),
+    (3, 'битовые карты оценённых анкет', _migration_3_seen_bitmaps),
+    (4, 'сессии FSM', _migration_4_fsm_sessions),
+    (5, 'рекомендации коллаборативной фильтрации', _migration_5_recommendations),
+    (6, 'привлекательность анкеты (Elo)', _migration_6_desirability),
+    (7, 'очередь новых анкет', _migration_7_candidate_queue),
+    (8, 'класс совместимости анкеты', _migration_8_compat_class),
+    (9, 'счётчики показов анкет', _migration_9_impressions),
+    (10, 'журнал взаимодействий', _migration_10_interaction_log),
+    (11, 'фильтры просмотра', _migration_11_browse_filters),
+    (12, 'поиск по описанию анкет', _migration_12_profiles_fts),
+    (13, 'время последней активности', _migration_13_last_active),
+    (14, 'доставляемость сообщений', _migration_14_delivery_health),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_version(db) -> int:
+    async with db.execute('PRAGMA user_version') as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def migrate(pool) -> int:
+    """Применяет недостающие миграции. Возвращает итоговую версию схемы.
+
+    Для актуальной базы это один запрос PRAGMA user_version.
+    """
+    async with pool.read() as db:
+        version = await get_version(db)
+    if version >= LATEST_VERSION:
+        return version
+
+    for number, description, step in MIGRATIONS:
+        async with pool.write() as db:
+            # Версию перечитываем под блокировкой писателя: ModeratorBot
+            # мог применить миграцию раньше нас
+            version = await get_version(db)
+            if number <= version:
+                continue
+            await step(db)
+            await db.execute(f'PRAGMA user_version = {number}')
+        logging.info(f"Миграция {number} применена: {description}")
+    return LATEST_VERSION
@@ -0,0 +1,110 @@
+"""Предвыборка следующей анкеты в просмотре.
+
+Пока пользователь смотрит анкету, в фоне для него уже выбирается
+следующая: get_next_profile на копии данных FSM, get_profile и готовая
+карточка. Выбор идёт только по уже загруженным пулам (reload=False): загрузка
+из БД ранжирует и записывает показы (exposure.py), а текущая анкета ещё не
+оценена и вернулась бы как новая. Такой выбор делает show_next_profile
+после оценки. На свайпе show_next_profile забирает результат через take() и
+сразу отправляет его; если предвыборка ещё идёт, дожидается её, а не
+повторяет ту же работу.
+
+Результат отбрасывается, если
+- это сама текущая анкета или уже лайкнутая (а показать её надо как новую);
+- пулы в FSM успели измениться (новый /browse, другой свайп) — сверяется
+  отпечаток курсоров и зёрен пулов;
+- анкета изменилась или удалена после выборки — сверяется data.profile_version;
+- он старше PREFETCH_TTL (правки из других процессов версию не меняют,
+  поэтому держим его не дольше, чем кэш анкет).
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, NamedTuple, Optional
+
+from cache import MISSING, TTLCache
+from cards import Card, get_card
+from data import get_profile, profile_version, seen
+from matching import get_next_profile
+
+PREFETCH_SIZE = 5000
+PREFETCH_TTL = 30  # секунды
+
+_POOL_KEYS = ('current_pool', 'pools_loaded', 'new_pos', 'new_seed', 'disliked_pos', 'disliked_seed',
+              'liked_pos', 'liked_seed')
+
+
+class Prefetched(NamedTuple):
+    profile_id: int
+    is_revisit: bool
+    # Ключи данных FSM, изменённые выбором profile_id (курсоры, пулы) — их
+    # нужно сохранить при показе; остальное могло поменяться после снимка
+    state_data: Dict[str, Any]
+    profile: Dict[str, Any]
+    card: Card
+    version: int
+    made_at: float
+
+
+def _fingerprint(state_data: Dict[str, Any]) -> tuple:
+    return tuple(state_data.get(key) for key in _POOL_KEYS)
+
+
+_pending = TTLCache(PREFETCH_SIZE, PREFETCH_TTL)
+_stats = dict.fromkeys(('scheduled', 'used', 'stale', 'missed'), 0)
+
+
+async def _prefetch(user_id: int, state_data: Dict[str, Any]) -> Optional[Prefetched]:
+    try:
+        # Пулы — неизменяемые bytes, так что поверхностной копии достаточно
+        next_id, updated, is_revisit = await get_next_profile(user_id, dict(state_data), reload=False)
+        if next_id is None or next_id == state_data.get('current_profile_id'):
+            return None
+        changes = {key: value for key, value in updated.items() if state_data.get(key) is not value}
+        version = profile_version(next_id)
+        profile = await get_profile(next_id)
+        if not profile:
+            return None
+        card = get_card(next_id, profile, 'browse_revisit' if is_revisit else 'browse')
+        return Prefetched(next_id, is_revisit, changes, profile, card, version, time.monotonic())
+    except Exception as e:
+        logging.warning(f"Предвыборка анкеты для {user_id} не удалась: {e!r}")
+        return None
+
+
+def schedule(user_id: int, state_data: Dict[str, Any]):
+    """Запускает выбор следующей анкеты для user_id по текущим данным FSM."""
+    task = asyncio.create_task(_prefetch(user_id, state_data))
+    _pending.put(user_id, (_fingerprint(state_data), task))
+    _stats['scheduled'] += 1
+
+
+async def take(user_id: int, state_data: Dict[str, Any]) -> Optional[Prefetched]:
+    """Готовая следующая анкета, если она ещё актуальна для state_data, иначе None."""
+    entry = _pending.get(user_id)
+    if entry is MISSING:
+        _stats['missed'] += 1
+        return None
+    _pending.invalidate(user_id)
+    fingerprint, task = entry
+    if fingerprint != _fingerprint(state_data):
+        task.cancel()
+        _stats['stale'] += 1
+        return None
+    result = await task
+    if (result is None or profile_version(result.profile_id) != result.version
+            or time.monotonic() - result.made_at > PREFETCH_TTL
+            or not result.is_revisit and await _is_liked(user_id, result.profile_id)):
+        _stats['stale'] += 1
+        return None
+    _stats['used'] += 1
+    return result
+
+
+async def _is_liked(user_id: int, profile_id: int) -> bool:
+    idx, = await seen.indices_of([profile_id])
+    return bool(await seen.get(user_id, 'likes') >> idx & 1)
+
+
+def stats() -> Dict[str, Any]:
+    return dict(_stats, size=len(_pending))
@@ -0,0 +1,130 @@
+"""Колоночное хранилище анкет в памяти (NumPy).
+
+get_all_profiles отдаёт по словарю на анкету со всеми строками, включая
+описание и разобранный список фото. Здесь на анкету приходится по элементу
+в нескольких параллельных массивах, отсортированных по user_id: возраст,
+коды пола, интересов и института, verified, рейтинг и день последней
+активности — около 24 байт.
+Текст анкеты, фото и видео сюда не входят: их по id отдаёт data.get_profile
+(с кэшем), когда анкету действительно показывают.
+
+Фильтры и агрегаты — векторные маски по колонкам: mask() выбирает анкеты по
+классам совместимости, институтам, фильтрам просмотра и активности (matching с
+POOL_SOURCE = 'columns'), counts(), labels() и values() дают статистику и
+рейтинги для /stats без запроса на каждого пользователя (при ENABLED).
+
+Рейтинг меняется в rating_system.add_rating без data._profile_changed,
+поэтому хранилище целиком перечитывается раз в STORE_TTL секунд; изменённые
+анкеты перечитываются точечно перед следующим обращением. Загрузка и
+обновление общие с ranking.FeatureTable (column_table.py).
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import activity
+import compat
+from column_table import ColumnTable
+from data import on_profile_change
+
+# Статистика в handlers.cmd_stats берётся из хранилища (по умолчанию — запросами)
+ENABLED = False
+STORE_TTL = 300  # секунды
+# Код незаполненного поля (возраст, пол, интересы)
+UNKNOWN = -1
+
+GENDER_CODES: Dict[str, int] = {gender: code for code, gender in enumerate(compat.GENDERS)}
+INTEREST_CODES: Dict[str, int] = {interests: code for code, interests in enumerate(compat.INTEREST_GENDERS)}
+# [код пола, код интересов] -> класс совместимости (compat.class_of)
+_CLASS_TABLE = np.array([[compat.class_of(gender, interests) for interests in INTEREST_CODES]
+                         for gender in GENDER_CODES], dtype=np.int8)
+
+
+class ProfileStore(ColumnTable):
+    """Колонки анкет: user_ids (по возрастанию) и массивы той же длины."""
+
+    COLUMNS = ('p.age', 'p.gender', 'p.interests', 'p.institute', 'p.verified', 'p.rating_sum', 'p.rating_weight',
+               'p.last_active')
+    TTL = STORE_TTL
+
+    def _columns(self, rows: List[tuple]) -> Dict[str, np.ndarray]:
+        rows = sorted(rows)
+        n = len(rows)
+        gender = np.fromiter((GENDER_CODES.get(row[2], UNKNOWN) for row in rows), dtype=np.int8, count=n)
+        interests = np.fromiter((INTEREST_CODES.get(row[3], UNKNOWN) for row in rows), dtype=np.int8, count=n)
+        known = (gender >= 0) & (interests >= 0)
+        return {
+            'user_ids': np.fromiter((row[0] for row in rows), dtype=np.int64, count=n),
+            'age': np.fromiter((row[1] if row[1] is not None else UNKNOWN for row in rows), dtype=np.int16, count=n),
+            'gender': gender,
+            'interests': interests,
+            'compat_class': np.where(known, _CLASS_TABLE[gender * known, interests * known], compat.UNKNOWN
+                                     ).astype(np.int8),
+            'institute': np.fromiter((self.institute_code(row[4]) for row in rows), dtype=np.int16, count=n),
+            'verified': np.fromiter((bool(row[5]) for row in rows), dtype=np.bool_, count=n),
+            # Как rating_system.get_user_rating: без оценок и ниже 1 — 1.0
+            'rating': np.fromiter((max(row[6] / row[7], 1.0) if (row[7] or 0) > 0 else 1.0 for row in rows),
+                                  dtype=np.float32, count=n),
+            # Номер дня (activity.day) с точностью float32 — около полутора
+            # часов, для сроков в дни хватает; NaN — активность неизвестна
+            'active_day': np.fromiter((activity.day(row[8]) or np.nan for row in rows),
+                                      dtype=np.float32, count=n),
+        }
+
+    def mask(self, classes: Optional[Iterable[int]] = None, institutes: Optional[Iterable[str]] = None,
+             filters: Optional[dict] = None, exclude: Optional[int] = None,
+             active_since: Optional[float] = None) -> np.ndarray:
+        """Маска анкет одного из классов classes (и, если задано, из institutes, под фильтры просмотра filters
+        и активных с дня active_since — activity.day; с неизвестной активностью анкета проходит)."""
+        result = np.ones(len(self.user_ids), dtype=np.bool_)
+        if classes is not None:
+            result &= np.isin(self.compat_class, np.fromiter(classes, dtype=np.int8))
+        if filters and filters['institutes']:
+            institutes = filters['institutes'] if institutes is None else set(institutes) & set(filters['institutes'])
+        if institutes is not None:
+            codes = [self._institutes[name] for name in institutes if name in self._institutes]
+            result &= np.isin(self.institute, np.array(codes, dtype=np.int16))
+        if filters and filters['age_min'] is not None:
+            result &= self.age >= filters['age_min']
+        if filters and filters['age_max'] is not None:
+            result &= (self.age != UNKNOWN) & (self.age <= filters['age_max'])
+        if filters and filters['verified_only']:
+            result &= self.verified
+        if active_since is not None:
+            result &= ~(self.active_day < active_since)
+        if exclude is not None:
+            result &= self.user_ids != exclude
+        return result
+
+    def ids(self, mask: np.ndarray) -> np.ndarray:
+        return self.user_ids[mask]
+
+    def _names(self, column: str) -> Tuple[Optional[str], ...]:
+        if column == 'gender':
+            return compat.GENDERS
+        if column == 'interests':
+            return tuple(INTEREST_CODES)
+        return tuple(self.institute_names)
+
+    def counts(self, column: str, mask: Optional[np.ndarray] = None) -> Dict[Optional[str], int]:
+        """Сколько анкет (под маской mask) с каждым значением column: 'gender', 'interests' или 'institute'."""
+        names = self._names(column)
+        codes = getattr(self, column) if mask is None else getattr(self, column)[mask]
+        counts = np.bincount(codes[codes >= 0], minlength=len(names))
+        return {names[code]: int(n) for code, n in enumerate(counts) if n}
+
+    def labels(self, column: str) -> Dict[int, Optional[str]]:
+        """user_id -> значение column ('gender', 'interests', 'institute') строкой."""
+        names = self._names(column) + (None,)  # код UNKNOWN (-1) указывает на последний элемент
+        return {user_id: names[code] for user_id, code in zip(self.user_ids.tolist(), getattr(self, column).tolist())}
+
+    def values(self, column: str) -> Dict[int, float]:
+        """user_id -> числовое значение column ('age', 'rating')."""
+        return dict(zip(self.user_ids.tolist(), getattr(self, column).tolist()))
+
+    def nbytes(self) -> int:
+        return sum(getattr(self, column).nbytes for column in self._columns([]))
+
+
+profiles = ProfileStore()
+on_profile_change(profiles.mark_dirty)
@@ -0,0 +1,162 @@
+"""Ранжирование пула новых анкет одним проходом NumPy.
+
+Признаки всех анкет держатся в памяти колонками (FeatureTable), строки
+отсортированы по user_id, так что строки кандидатов находятся одним
+np.searchsorted. Оценка кандидата — взвешенная сумма:
+
+- rating    — средняя оценка rating_sum / rating_weight, приведённая к [0, 1]
+              (без оценок — середина шкалы);
+- desirability — привлекательность по свайпам (elo.py) как ожидаемая доля
+              лайков против средней анкеты;
+- recency   — exp(-дней с последней активности / ACTIVITY_DAYS): позже из
+              profiles.last_active (activity.py) и дня стрика;
+- verified  — анкета подтверждена;
+- institute — тот же институт, что у смотрящего;
+- liked_me  — кандидат уже лайкнул смотрящего;
+- noise     — случайная добавка, чтобы порядок не был одинаковым у всех.
+
+Полностью сортируются только первые RANK_HEAD мест (np.argpartition, затем
+сортировка этой головы): дальше пользователь за сессию почти не доходит, и
+на 50k кандидатов полная сортировка стоила бы больше самой оценки. Хвост
+идёт после головы без упорядочивания по оценке.
+
+Рейтинг и активность меняются без data._profile_changed, поэтому таблица
+целиком перечитывается раз в FEATURES_TTL секунд; изменённые анкеты
+перечитываются точечно перед следующим ранжированием (column_table.py).
+"""
+import asyncio
+import datetime
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+import activity
+import elo
+from column_table import ColumnTable
+from data import get_likers, get_profile, on_profile_change
+
+WEIGHTS = {
+    'rating': 1.0,
+    'desirability': 1.0,
+    'recency': 0.8,
+    'verified': 0.3,
+    'institute': 0.4,
+    'liked_me': 1.5,
+    'noise': 0.5,
+}
+ACTIVITY_DAYS = 7.0
+# Сколько первых мест очереди упорядочено по оценке
+RANK_HEAD = 1000
+FEATURES_TTL = 300  # секунды
+RATING_MIN, RATING_MAX = 1.0, 5.0
+
+
+def _day(value: Optional[str]) -> float:
+    if not value:
+        return -np.inf
+    try:
+        return float(datetime.date.fromisoformat(value).toordinal())
+    except ValueError:
+        return -np.inf
+
+
+class FeatureTable(ColumnTable):
+    """Колонки признаков анкет: user_ids (по возрастанию) и массивы той же длины."""
+
+    COLUMNS = ('p.rating_sum', 'p.rating_weight', 'p.verified', 'p.institute', 's.last_active_date',
+               'p.desirability', 'p.last_active')
+    TTL = FEATURES_TTL
+
+    def _columns(self, rows: List[tuple]) -> Dict[str, np.ndarray]:
+        rows = sorted(rows)
+        rating = np.full(len(rows), (RATING_MIN + RATING_MAX) / 2, dtype=np.float32)
+        for i, row in enumerate(rows):
+            if row[2]:
+                rating[i] = row[1] / row[2]
+        return {
+            'user_ids': np.array([row[0] for row in rows], dtype=np.int64),
+            'rating': np.clip((rating - RATING_MIN) / (RATING_MAX - RATING_MIN), 0, 1),
+            'desirability': np.array([elo.expected(row[6] if row[6] is not None else elo.BASE, elo.BASE)
+                                      for row in rows], dtype=np.float32),
+            'active_day': np.array([max(_day(row[5]), activity.day(row[7]) or -np.inf) for row in rows],
+                                   dtype=np.float32),
+            'verified': np.array([bool(row[3]) for row in rows], dtype=np.float32),
+            'institute': np.array([self.institute_code(row[4]) for row in rows], dtype=np.int16),
+        }
+
+    def _set_columns(self, columns: Dict[str, np.ndarray]):
+        super()._set_columns(columns)
+        self._base_day = None
+
+    def base(self, today: float) -> np.ndarray:
+        """Часть оценки, не зависящая от смотрящего; пересчитывается раз в день и после обновлений."""
+        if self._base_day != today:
+            days = np.maximum(today - self.active_day, 0)
+            self._base = (WEIGHTS['rating'] * self.rating + WEIGHTS['desirability'] * self.desirability
+                          + WEIGHTS['verified'] * self.verified
+                          + WEIGHTS['recency'] * np.exp(-days / ACTIVITY_DAYS)).astype(np.float32)
+            self._base_day = today
+        return self._base
+
+    def rows_of(self, candidate_ids: np.ndarray):
+        """Номера строк кандидатов и маска тех, кто есть в таблице (таблица не пуста)."""
+        rows = np.searchsorted(self.user_ids, candidate_ids)
+        rows[rows == len(self.user_ids)] = 0
+        return rows, self.user_ids[rows] == candidate_ids
+
+
+features = FeatureTable()
+on_profile_change(features.mark_dirty)
+
+
+def score(table: FeatureTable, candidate_ids: np.ndarray, institute: int, liked_me: np.ndarray,
+          today: float, rng: np.random.Generator) -> np.ndarray:
+    """Оценки кандидатов (candidate_ids по возрастанию; чем больше, тем раньше показывать)."""
+    result = np.zeros(len(candidate_ids), dtype=np.float32)
+    if len(table):
+        rows, found = table.rows_of(candidate_ids)
+        result += table.base(today)[rows]
+        result += WEIGHTS['institute'] * (table.institute[rows] == institute)
+        result *= found  # анкеты, которых ещё нет в таблице, — только по шуму и лайку
+    # Лайкнувших единицы — ищутся они среди кандидатов, а не кандидаты среди них
+    liked = np.searchsorted(candidate_ids, liked_me)
+    inside = liked < len(candidate_ids)
+    liked = liked[inside]
+    result[liked[candidate_ids[liked] == liked_me[inside]]] += WEIGHTS['liked_me']
+    result += WEIGHTS['noise'] * rng.random(len(candidate_ids), dtype=np.float32)
+    return result
+
+
+def _as_ids(values) -> np.ndarray:
+    if isinstance(values, np.ndarray):
+        return values.astype(np.int64, copy=False)
+    return np.fromiter(values, dtype=np.int64)
+
+
+def order(table: FeatureTable, candidate_ids, institute: int, liked_me: Iterable[int],
+          today: float, seed: int, head: int = RANK_HEAD) -> np.ndarray:
+    """Кандидаты (np.ndarray или итерируемое id): первые head — по убыванию оценки, затем остальные."""
+    # Отсортированные запросы searchsorted проходит почти последовательно —
+    # в разы быстрее, чем те же id в случайном порядке
+    ids = np.sort(_as_ids(candidate_ids))
+    likers = _as_ids(liked_me)
+    scores = -score(table, ids, institute, likers, today, np.random.default_rng(seed))
+    if len(ids) <= head:
+        return ids[np.argsort(scores)]
+    positions = np.argpartition(scores, head - 1)
+    top = positions[:head]
+    positions[:head] = top[np.argsort(scores[top])]
+    return ids[positions]
+
+
+async def rank(user_id: int, candidate_ids, seed: int) -> np.ndarray:
+    """Очередь показа для пула новых анкет user_id: лучшие кандидаты первыми (см. order).
+
+    candidate_ids — np.ndarray (пулы 'index' и 'columns') или итерируемое id.
+    seed задаёт шум в оценке, так что порядок повторим при тех же признаках.
+    """
+    await features.refresh()
+    viewer, likers = await asyncio.gather(get_profile(user_id), get_likers(user_id))
+    institute = features.institute_code(viewer['institute'] if viewer else None)
+    today = float(datetime.date.today().toordinal())
+    return order(features, candidate_ids, institute, likers, today, seed)
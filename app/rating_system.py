@@ -1,9 +1,8 @@
 import math
-import aiosqlite
-from data import DB_PATH
+from data import pool
 
 async def get_user_rating(user_id: int) -> float:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.read() as db:
         async with db.execute(
             'SELECT rating_sum, rating_weight FROM profiles WHERE user_id = ?',
             (user_id,)
@@ -19,7 +18,7 @@ async def get_voter_weight(voter_id: int) -> float:
     return math.log1p(rating)  # log(1+rating)
 
 async def add_rating(from_user_id: int, to_user_id: int, value: int, voter_weight: float):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.write() as db:
         cursor = await db.execute(
             'INSERT OR IGNORE INTO ratings (from_user_id, to_user_id, value, voter_weight) VALUES (?, ?, ?, ?)',
             (from_user_id, to_user_id, value, voter_weight)
@@ -34,4 +33,3 @@ async def add_rating(from_user_id: int, to_user_id: int, value: int, voter_weigh
                 ''',
                 (value, voter_weight, voter_weight, to_user_id)
             )
-        await db.commit()
\ No newline at end of file
@@ -0,0 +1,223 @@
+"""Офлайн-рекомендации «кто лайкнул X, лайкнул и Y» (item-item CF по таблице likes).
+
+Запуск из каталога app (по cron, например раз в ночь):
+    python recommender.py
+
+Прогон:
+1. Читает likes (и dislikes — чтобы не рекомендовать уже оценённое) в
+   массивы NumPy и переводит id в плотные номера.
+2. Считает сходство анкет: косинус по множествам лайкнувших,
+   co(i, j) / sqrt(n_i * n_j). Матрица co-лайков не строится целиком: анкеты
+   обрабатываются кусками, в каждом не больше MAX_PAIRS пар (i, j), и для
+   каждой анкеты остаются NEIGHBORS ближайших соседей.
+3. Для каждого пользователя складывает сходства соседей лайкнутых им анкет
+   (тоже кусками по MAX_PAIRS) и записывает TOP_K лучших неоценённых в
+   recommendations.
+
+Пользователи с числом лайков больше USER_LIKES_CAP в co-лайках не участвуют
+(лайкают всех подряд и сходства не несут), у анкеты учитываются не больше
+ITEM_USERS_CAP случайных лайкнувших — так объём работы на кусок ограничен
+даже для самых популярных анкет.
+
+Matching (matching._set_new_pool) ставит эти анкеты в начало пула новых.
+"""
+import asyncio
+import logging
+import resource
+import time
+import tracemalloc
+from typing import Dict, Tuple
+
+import numpy as np
+
+NEIGHBORS = 20
+TOP_K = 50
+MAX_PAIRS = 2_000_000
+USER_LIKES_CAP = 500
+ITEM_USERS_CAP = 1000
+FETCH_BATCH = 50_000
+
+
+async def _load_pairs(pool, sql: str) -> Tuple[np.ndarray, np.ndarray]:
+    chunks = []
+    async with pool.read() as db:
+        async with db.execute(sql) as cursor:
+            while True:
+                rows = await cursor.fetchmany(FETCH_BATCH)
+                if not rows:
+                    break
+                chunks.append(np.array(rows, dtype=np.int64))
+    pairs = np.concatenate(chunks) if chunks else np.zeros((0, 2), dtype=np.int64)
+    return pairs[:, 0].copy(), pairs[:, 1].copy()
+
+
+def _csr(rows: np.ndarray, cols: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(ptr, cols) — строки rows в сжатом виде: cols[ptr[r]:ptr[r + 1]] для строки r."""
+    order = np.argsort(rows, kind='stable')
+    ptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=size), out=ptr[1:])
+    return ptr, cols[order]
+
+
+def _expand(ptr: np.ndarray, rows: np.ndarray, cap: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Элементы строк rows (не больше cap первых в строке): (номер строки в rows, позиция в массиве значений)."""
+    lengths = ptr[rows + 1] - ptr[rows]
+    if cap is not None:
+        lengths = np.minimum(lengths, cap)
+    total = int(lengths.sum())
+    owner = np.repeat(np.arange(len(rows)), lengths)
+    starts = np.repeat(ptr[rows] - (np.cumsum(lengths) - lengths), lengths)
+    return owner, starts + np.arange(total)
+
+
+def _chunks(work: np.ndarray, limit: int):
+    """Границы подряд идущих кусков, в каждом сумма work не больше limit (или один элемент)."""
+    start, total = 0, 0
+    for i, w in enumerate(work.tolist()):
+        if total and total + w > limit:
+            yield start, i
+            start, total = i, 0
+        total += w
+    if start < len(work):
+        yield start, len(work)
+
+
+def _top_per_group(groups: np.ndarray, scores: np.ndarray, k: int) -> np.ndarray:
+    """Позиции k лучших scores (>= 0) в каждой группе, группы по возрастанию, внутри — по убыванию score."""
+    # Один argsort по ключу «группа, затем 1 - score/max» вместо lexsort — в разы быстрее
+    top = float(scores.max()) if len(scores) else 0.0
+    order = np.argsort(groups * 2.0 + (1.0 - scores / (top or 1.0)))
+    groups = groups[order]
+    first = np.r_[True, groups[1:] != groups[:-1]]
+    group_start = np.maximum.accumulate(np.where(first, np.arange(len(groups)), 0))
+    return order[np.arange(len(groups)) - group_start < k]
+
+
+def neighbors(user_ptr, user_items, item_ptr, item_users, size):
+    """Ближайшие соседи каждой анкеты: (анкета, сосед, сходство), по анкете и убыванию сходства."""
+    degree = np.diff(user_ptr)
+    active = degree <= USER_LIKES_CAP
+    popularity = np.diff(item_ptr).astype(np.float64)
+    # co(i, j) считается по выборке не больше ITEM_USERS_CAP лайкнувших i — приводим к полному числу
+    scale = popularity / np.maximum(np.minimum(popularity, ITEM_USERS_CAP), 1)
+    # Работа на анкету — сколько пар (i, j) она даст: сумма лайков её лайкнувших
+    owner, pos = _expand(item_ptr, np.arange(size), ITEM_USERS_CAP)
+    users = item_users[pos]
+    work = np.bincount(owner, weights=np.where(active[users], degree[users], 0), minlength=size)
+    result_i, result_j, result_sim = [], [], []
+    for lo, hi in _chunks(work, MAX_PAIRS):
+        items = np.arange(lo, hi)
+        owner, pos = _expand(item_ptr, items, ITEM_USERS_CAP)
+        users = item_users[pos]
+        keep = active[users]
+        owner, users = owner[keep], users[keep]
+        pair_owner, pos = _expand(user_ptr, users)
+        i = items[owner[pair_owner]]
+        j = user_items[pos]
+        keep = i != j
+        keys, counts = np.unique(i[keep] * size + j[keep], return_counts=True)
+        i, j = keys // size, keys % size
+        sim = (counts * scale[i] / np.sqrt(popularity[i] * popularity[j])).astype(np.float32)
+        top = _top_per_group(i, sim, NEIGHBORS)
+        result_i.append(i[top].astype(np.int32))
+        result_j.append(j[top].astype(np.int32))
+        result_sim.append(sim[top])
+    if not result_i:
+        empty = np.zeros(0, dtype=np.int32)
+        return empty, empty, np.zeros(0, dtype=np.float32)
+    return np.concatenate(result_i), np.concatenate(result_j), np.concatenate(result_sim)
+
+
+def recommend(user_ptr, user_items, seen_ptr, seen_items, nb_i, nb_j, nb_sim, size):
+    """Кусками по пользователям: (пользователь, место, анкета, оценка) для TOP_K лучших неоценённых."""
+    nb_ptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(nb_i, minlength=size), out=nb_ptr[1:])
+    fanout = np.diff(nb_ptr)
+    owner, pos = _expand(user_ptr, np.arange(size))
+    work = np.bincount(owner, weights=fanout[user_items[pos]], minlength=size)
+    for lo, hi in _chunks(work, MAX_PAIRS):
+        users = np.arange(lo, hi)
+        owner, pos = _expand(user_ptr, users)
+        liked_items = user_items[pos]
+        item_owner, nb_pos = _expand(nb_ptr, liked_items)
+        u = users[owner[item_owner]]
+        j = nb_j[nb_pos].astype(np.int64)
+        keys, inverse = np.unique(u * size + j, return_inverse=True)
+        scores = np.bincount(inverse, weights=nb_sim[nb_pos])
+        # Уже оценённые и сам пользователь
+        seen_owner, seen_pos = _expand(seen_ptr, users)
+        seen_keys = users[seen_owner] * size + seen_items[seen_pos]
+        u, j = keys // size, keys % size
+        keep = ~np.isin(keys, seen_keys) & (u != j)
+        u, j, scores = u[keep], j[keep], scores[keep]
+        if not len(u):
+            continue
+        top = _top_per_group(u, scores, TOP_K)
+        u, j, scores = u[top], j[top], scores[top]
+        first = np.r_[True, u[1:] != u[:-1]]
+        rank = np.arange(len(u)) - np.maximum.accumulate(np.where(first, np.arange(len(u)), 0))
+        yield u, rank, j, scores
+
+
+async def build(pool) -> Dict[str, float]:
+    """Пересчитывает таблицу recommendations. Возвращает время, пиковую память и объёмы."""
+    started = time.perf_counter()
+    tracemalloc.start()
+    run_id = int(time.time())
+
+    likers, liked = await _load_pairs(pool, 'SELECT user_id, liked_user_id FROM likes')
+    dislikers, disliked = await _load_pairs(pool, 'SELECT user_id, disliked_user_id FROM dislikes')
+    ids = np.unique(np.concatenate([likers, liked]))
+    size = len(ids)
+    u, i = np.searchsorted(ids, likers), np.searchsorted(ids, liked)
+    known = np.isin(dislikers, ids) & np.isin(disliked, ids)
+    du, di = np.searchsorted(ids, dislikers[known]), np.searchsorted(ids, disliked[known])
+    del likers, liked, dislikers, disliked
+
+    user_ptr, user_items = _csr(u, i, size)
+    seen_ptr, seen_items = _csr(np.concatenate([u, du]), np.concatenate([i, di]), size)
+    # Случайный порядок лайкнувших внутри анкеты: усечение до ITEM_USERS_CAP — случайная выборка
+    shuffle = np.random.default_rng(run_id).permutation(len(u))
+    item_ptr, item_users = _csr(i[shuffle], u[shuffle], size)
+    del u, i, du, di, shuffle
+
+    nb_i, nb_j, nb_sim = neighbors(user_ptr, user_items, item_ptr, item_users, size)
+
+    rows = 0
+    for u, rank, j, scores in recommend(user_ptr, user_items, seen_ptr, seen_items, nb_i, nb_j, nb_sim, size):
+        batch = list(zip(ids[u].tolist(), rank.tolist(), ids[j].tolist(), scores.tolist(), [run_id] * len(u)))
+        async with pool.write() as db:
+            await db.executemany(
+                'INSERT OR REPLACE INTO recommendations (user_id, rank, target_id, score, run_id) VALUES (?, ?, ?, ?, ?)',
+                batch
+            )
+        rows += len(batch)
+    async with pool.write() as db:
+        await db.execute('DELETE FROM recommendations WHERE run_id <> ?', (run_id,))
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'likes': int(len(user_items)),
+        'profiles': size,
+        'neighbors': int(len(nb_i)),
+        'rows': rows,
+        'seconds': round(time.perf_counter() - started, 2),
+        'peak_mb': round(peak / 2 ** 20, 1),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+async def main():
+    from data import init_db, pool
+    await pool.open()
+    await init_db()
+    try:
+        logging.info(f"Рекомендации пересчитаны: {await build(pool)}")
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
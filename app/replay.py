@@ -0,0 +1,268 @@
+"""Офлайн-прогон алгоритмов подбора по журналу взаимодействий (interaction_log).
+
+Запуск из каталога app (бот можно не останавливать: исходная БД только читается):
+    python replay.py --engines current,random,no_exposure --seed 1
+    python replay.py --engines my_module:get_next_profile
+
+Движок — корутина с сигнатурой matching.get_next_profile: встроенные
+варианты (ENGINES) — это matching с изменёнными настройками, свой можно
+передать как модуль:функция.
+
+Каждый движок прогоняется на своей копии БД (sqlite3 backup), в которой
+очищено всё, что знает об оценках: likes, dislikes, просмотры, рекомендации,
+счётчики показов, привлекательность. Иначе движок подбирал бы анкеты,
+заранее зная ответы. Затем решения из журнала идут по порядку: каждый лайк,
+дизлайк или суперлайк пользователя V в журнале — один вызов движка для V.
+На предложенную анкету T пользователь отвечает, как в журнале, если он
+оценивал T. Иначе ответ случайный, с вероятностью из LikeModel. Ответ
+записывается в копию через data.add_like/add_dislike, так что следующие
+решения движка его видят.
+
+Отчёт по каждому движку и по самому журналу:
+- доля взаимных лайков на показ (match_rate);
+- показов на одну взаимную пару (candidates_per_match);
+- процессорное время на решение (cpu_ms).
+Все случайности (matching, ranking, модель ответов) заданы зерном --seed,
+поэтому повторный прогон даёт те же числа.
+"""
+import argparse
+import asyncio
+import importlib
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import data
+import elo
+import matching
+import profile_store
+import ranking
+
+# (user_id, state_data) -> (profile_id, state_data, is_revisit), как matching.get_next_profile
+Engine = Callable[[int, dict], Awaitable[tuple]]
+
+# Встроенные движки: настройки matching на время прогона
+ENGINES: Dict[str, Dict[str, object]] = {
+    'current': {},
+    'random': {'RANK_NEW_POOL': False, 'USE_RECOMMENDATIONS': False, 'BALANCE_EXPOSURE': False},
+    'no_exposure': {'BALANCE_EXPOSURE': False},
+    'no_recommendations': {'USE_RECOMMENDATIONS': False},
+    'sql': {'POOL_SOURCE': 'sql'},
+    'with_inactive': {'INACTIVE_DAYS': None},
+}
+
+# Что в копии БД очищается перед прогоном
+CLEARED_TABLES = ('likes', 'dislikes', 'profile_views', 'seen_bitmaps', 'recommendations', 'candidate_queue',
+                  'profile_impressions', 'interaction_log', 'fsm_sessions')
+
+# Сглаживание долей лайков: столько «псевдо-оценок» с общей долей у каждого
+PRIOR = 10.0
+
+_REACTIONS = {'like': True, 'superlike': True, 'dislike': False}
+
+
+def load_log(path: str, limit: Optional[int] = None) -> List[Tuple[int, int, str]]:
+    """События журнала (viewer_id, target_id, event) по порядку."""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        sql = 'SELECT viewer_id, target_id, event FROM interaction_log ORDER BY id'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+class LikeModel:
+    """Ответ пользователя на анкету: из журнала, если он её оценивал, иначе — случайно.
+
+    Вероятность лайка — общая доля лайков, умноженная на «щедрость»
+    оценивающего и на «привлекательность» анкеты. Обе доли сглажены через
+    PRIOR.
+    """
+
+    def __init__(self, events: List[Tuple[int, int, str]]):
+        self.known: Dict[Tuple[int, int], bool] = {}
+        given, received = defaultdict(lambda: [0, 0]), defaultdict(lambda: [0, 0])
+        for viewer_id, target_id, event in events:
+            if event in _REACTIONS:
+                liked = _REACTIONS[event]
+                self.known[(viewer_id, target_id)] = liked
+                given[viewer_id][0] += liked
+                given[viewer_id][1] += 1
+                received[target_id][0] += liked
+                received[target_id][1] += 1
+        total = sum(n for _, n in given.values())
+        self.base = sum(likes for likes, _ in given.values()) / total if total else 0.5
+        self._given = {uid: self._rate(*counts) for uid, counts in given.items()}
+        self._received = {uid: self._rate(*counts) for uid, counts in received.items()}
+
+    def _rate(self, likes: int, n: int) -> float:
+        return (likes + PRIOR * self.base) / (n + PRIOR)
+
+    def probability(self, viewer_id: int, target_id: int) -> float:
+        if not self.base:
+            return 0.0
+        given = self._given.get(viewer_id, self.base)
+        received = self._received.get(target_id, self.base)
+        return min(given * received / self.base, 1.0)
+
+    def liked(self, viewer_id: int, target_id: int, rng: random.Random) -> bool:
+        known = self.known.get((viewer_id, target_id))
+        if known is not None:
+            return known
+        return rng.random() < self.probability(viewer_id, target_id)
+
+
+def log_stats(events: List[Tuple[int, int, str]]) -> Dict[str, float]:
+    """Те же метрики для самого журнала (что было на самом деле)."""
+    shown = sum(event == 'shown' for _, _, event in events)
+    liked_by: Dict[int, Set[int]] = defaultdict(set)
+    likes = matches = 0
+    for viewer_id, target_id, event in events:
+        if _REACTIONS.get(event) and viewer_id not in liked_by[target_id]:
+            likes += 1
+            matches += target_id in liked_by[viewer_id]
+            liked_by[target_id].add(viewer_id)
+    return _summary(shown or len(events), likes, matches, [])
+
+
+def _summary(shown: int, likes: int, matches: int, cpu: List[float], empty: int = 0) -> Dict[str, float]:
+    result = {
+        'shown': shown,
+        'likes': likes,
+        'matches': matches,
+        'match_rate': round(matches / shown, 4) if shown else 0.0,
+        'candidates_per_match': round(shown / matches, 1) if matches else None,
+    }
+    if cpu:
+        ms = sorted(t * 1000 for t in cpu)
+        result.update(empty=empty, cpu_ms=round(statistics.fmean(ms), 3),
+                      cpu_ms_p50=round(ms[len(ms) // 2], 3), cpu_ms_p99=round(ms[min(len(ms) - 1, int(len(ms) * 0.99))], 3))
+    return result
+
+
+def _copy_db(source: str) -> str:
+    path = os.path.join(tempfile.mkdtemp(prefix='ratingbot-replay-'), 'replay.db')
+    src, dst = sqlite3.connect(f'file:{source}?mode=ro', uri=True), sqlite3.connect(path)
+    try:
+        src.backup(dst)
+        existing = {row[0] for row in dst.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table in CLEARED_TABLES:
+            if table in existing:
+                dst.execute(f'DELETE FROM {table}')
+        dst.execute('UPDATE profiles SET desirability = ?', (elo.BASE,))
+        dst.commit()
+    finally:
+        src.close()
+        dst.close()
+    return path
+
+
+async def _open(path: str):
+    """Переключает общий пул и все кэши в памяти на копию БД.
+
+    Объекты в памяти сбрасываются, а не создаются заново: на их mark_dirty
+    уже подписан data.on_profile_change.
+    """
+    await data.swipes.close()
+    await data.pool.close()
+    data.pool.path = path
+    data.profile_cache.clear()
+    data.desirability_cache.clear()
+    data.seen.reset()
+    data.exposure.reset()
+    data.activity.reset()
+    data.delivery.reset()
+    matching.candidates.reset()
+    ranking.features.reset()
+    profile_store.profiles.reset()
+    await data.pool.open()
+    await data.init_db()
+
+
+def resolve(name: str) -> Tuple[Engine, Dict[str, object]]:
+    """Движок по имени из ENGINES или по пути модуль:функция."""
+    if name in ENGINES:
+        return matching.get_next_profile, ENGINES[name]
+    module, _, function = name.partition(':')
+    return getattr(importlib.import_module(module), function or 'get_next_profile'), {}
+
+
+async def replay(engine: Engine, settings: Dict[str, object], source: str,
+                 events: List[Tuple[int, int, str]], model: LikeModel, seed: int) -> Dict[str, float]:
+    path = _copy_db(source)
+    saved = {name: getattr(matching, name) for name in settings}
+    log_enabled = data.INTERACTION_LOG
+    try:
+        await _open(path)
+        for name, value in settings.items():
+            setattr(matching, name, value)
+        data.INTERACTION_LOG = False
+        random.seed(seed)
+        rng = random.Random(seed)
+        data.swipes.start()
+        states: Dict[int, dict] = {}
+        liked_by: Dict[int, Set[int]] = defaultdict(set)
+        cpu, shown, likes, matches, empty = [], 0, 0, 0, 0
+        for viewer_id, _, event in events:
+            if event not in _REACTIONS:
+                continue
+            state = states.setdefault(viewer_id, {})
+            start = time.process_time()
+            profile_id, states[viewer_id], _ = await engine(viewer_id, state)
+            cpu.append(time.process_time() - start)
+            if profile_id is None:
+                empty += 1
+                continue
+            shown += 1
+            await data.record_profile_view(viewer_id, profile_id)
+            if model.liked(viewer_id, profile_id, rng):
+                await data.add_like(viewer_id, profile_id)
+                if viewer_id not in liked_by[profile_id]:
+                    likes += 1
+                    matches += profile_id in liked_by[viewer_id]
+                    liked_by[profile_id].add(viewer_id)
+            else:
+                await data.add_dislike(viewer_id, profile_id)
+    finally:
+        await data.swipes.close()
+        data.INTERACTION_LOG = log_enabled
+        for name, value in saved.items():
+            setattr(matching, name, value)
+        # Копия БД нужна только на время прогона
+        await data.pool.close()
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    return _summary(shown, likes, matches, cpu, empty)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db', default=data.DB_PATH)
+    parser.add_argument('--engines', default='current,random')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--limit', type=int, default=None, help='сколько первых событий журнала взять')
+    args = parser.parse_args()
+
+    events = load_log(args.db, args.limit)
+    model = LikeModel(events)
+    logging.info(f"Журнал: {len(events)} событий, доля лайков {model.base:.1%}")
+    logging.info(f"  журнал: {log_stats(events)}")
+    try:
+        for name in args.engines.split(','):
+            engine, settings = resolve(name)
+            logging.info(f"  {name}: {await replay(engine, settings, args.db, events, model, args.seed)}")
+    finally:
+        await data.pool.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
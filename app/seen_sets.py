@@ -0,0 +1,168 @@
+"""Множества оценённых/просмотренных анкет в виде битовых карт.
+
+Каждому пользователю выдаётся плотный номер idx (таблица user_index), и
+«кого лайкнул / дизлайкнул / смотрел пользователь X» хранится как одно
+целое-битовая карта: бит idx установлен, если X оценил анкету с этим
+номером. В БД карта лежит сжатой zlib (таблица seen_bitmaps, строка на
+пользователя и вид), в памяти — обычный int Python, так что пересечение и
+разность множеств — это &, | и & ~ над целыми, без циклов по анкетам.
+
+Таблицы likes/dislikes/profile_views остаются основным хранилищем: по ним
+ищутся обратные связи («кто лайкнул меня», «кто смотрел»). Карты — копия
+для прямых вопросов «что уже видел пользователь», обновляется при каждом
+свайпе и пишется через буфер отложенной записи.
+"""
+import zlib
+from array import array
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from cache import MISSING, TTLCache
+
+KINDS = ('likes', 'dislikes', 'views')
+
+SEEN_CACHE_SIZE = 2000   # пользователей с картами в памяти
+SEEN_CACHE_TTL = 3600    # секунды
+
+# Номера установленных битов для каждого значения байта
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+# ---------- Операции над картами ----------
+def bits_from_indices(indices: Iterable[int]) -> int:
+    # Через bytearray: `bits |= 1 << idx` в цикле копировал бы всё число на каждом шаге
+    indices = list(indices)
+    if not indices:
+        return 0
+    buf = bytearray(max(indices) // 8 + 1)
+    for idx in indices:
+        buf[idx >> 3] |= 1 << (idx & 7)
+    return int.from_bytes(buf, 'little')
+
+
+def iter_indices(bits: int) -> List[int]:
+    """Номера установленных битов по возрастанию."""
+    raw = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    table = _BYTE_BITS
+    return [pos * 8 + bit for pos, value in enumerate(raw) if value for bit in table[value]]
+
+
+def pack(bits: int) -> bytes:
+    return zlib.compress(bits.to_bytes((bits.bit_length() + 7) // 8, 'little'))
+
+
+def unpack(blob: bytes) -> int:
+    return int.from_bytes(zlib.decompress(blob), 'little') if blob else 0
+
+
+class SeenSets:
+    """Плотные номера пользователей и их битовые карты по видам KINDS.
+
+    Карты пользователей держатся в LRU-кэше; незаписанные изменения уходят
+    в buffer (WriteBehindBuffer) видом 'seen' и учитываются при загрузке.
+    """
+
+    def __init__(self, pool, buffer):
+        self.pool = pool
+        self.buffer = buffer
+        buffer.register('seen', 'INSERT OR REPLACE INTO seen_bitmaps (user_id, kind, bits) VALUES (?, ?, ?)')
+        self._idx: Dict[int, int] = {}
+        self._user_ids = array('q', [0])  # idx -> user_id, 0 — номер свободен
+        self._cache = TTLCache(SEEN_CACHE_SIZE, SEEN_CACHE_TTL)
+
+    # ---------- Плотные номера ----------
+    async def _load_index(self, db):
+        # Номера только растут (AUTOINCREMENT), поэтому дочитываем хвост
+        async with db.execute(
+            'SELECT idx, user_id FROM user_index WHERE idx > ? ORDER BY idx', (len(self._user_ids) - 1,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        for idx, user_id in rows:
+            if idx >= len(self._user_ids):
+                self._user_ids.extend([0] * (idx + 1 - len(self._user_ids)))
+            self._user_ids[idx] = user_id
+            self._idx[user_id] = idx
+
+    async def indices_of(self, user_ids: Iterable[int]) -> List[int]:
+        """Плотные номера пользователей; недостающие выдаются сразу."""
+        user_ids = list(user_ids)
+        missing = [uid for uid in user_ids if uid not in self._idx]
+        if missing:
+            async with self.pool.write() as db:
+                await db.executemany('INSERT OR IGNORE INTO user_index (user_id) VALUES (?)', [(uid,) for uid in missing])
+                await self._load_index(db)
+        return [self._idx[uid] for uid in user_ids]
+
+    async def bits_for(self, user_ids: Iterable[int]) -> int:
+        return bits_from_indices(await self.indices_of(user_ids))
+
+    async def to_ids(self, bits: int) -> List[int]:
+        if bits.bit_length() > len(self._user_ids):
+            # В карте есть номера, выданные после последней загрузки (или до старта)
+            async with self.pool.read() as db:
+                await self._load_index(db)
+        user_ids = self._user_ids
+        size = len(user_ids)
+        return [user_ids[idx] for idx in iter_indices(bits) if idx < size and user_ids[idx]]
+
+    async def to_array(self, bits: int) -> np.ndarray:
+        """То же, что to_ids, но np.ndarray без списка Python (пул новых для ranking.rank)."""
+        if bits.bit_length() > len(self._user_ids):
+            async with self.pool.read() as db:
+                await self._load_index(db)
+        raw = np.frombuffer(bits.to_bytes((bits.bit_length() + 7) // 8, 'little'), dtype=np.uint8)
+        indices = np.flatnonzero(np.unpackbits(raw, bitorder='little'))
+        user_ids = np.array(self._user_ids, dtype=np.int64)[indices[indices < len(self._user_ids)]]
+        return user_ids[user_ids != 0]
+
+    # ---------- Карты пользователя ----------
+    async def load(self, user_id: int) -> Dict[str, int]:
+        cached = self._cache.get(user_id)
+        if cached is not MISSING:
+            return cached
+        async with self.pool.read() as db:
+            async with db.execute('SELECT kind, bits FROM seen_bitmaps WHERE user_id = ?', (user_id,)) as cursor:
+                rows = await cursor.fetchall()
+        # Пока ждали чтения, карту мог загрузить и изменить другой обработчик
+        cached = self._cache.get(user_id)
+        if cached is not MISSING:
+            return cached
+        sets = dict.fromkeys(KINDS, 0)
+        for kind, blob in rows:
+            sets[kind] = unpack(blob)
+        for kind in KINDS:
+            row = self.buffer.get('seen', (user_id, kind))
+            if row is not None:
+                sets[kind] = unpack(row[2])
+        self._cache.put(user_id, sets)
+        return sets
+
+    async def get(self, user_id: int, kind: str) -> int:
+        return (await self.load(user_id))[kind]
+
+    async def add(self, user_id: int, kind: str, target_id: int):
+        idx, = await self.indices_of([target_id])
+        sets = await self.load(user_id)
+        bits = sets[kind] | (1 << idx)
+        if bits == sets[kind]:
+            return
+        sets[kind] = bits
+        await self.buffer.add('seen', (user_id, kind), (user_id, kind, pack(bits)), replace=True)
+
+    def forget(self, user_id: int):
+        """Забывает пользователя после удаления анкеты (строки в БД удаляет data.delete_profile)."""
+        self._cache.invalidate(user_id)
+        self.buffer.discard('seen', lambda key: key[0] == user_id)
+        idx = self._idx.pop(user_id, None)
+        if idx is not None:
+            self._user_ids[idx] = 0
+
+    def reset(self):
+        """Забывает все номера и карты (после подмены файла БД)."""
+        self._idx.clear()
+        self._user_ids = array('q', [0])
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._cache.stats(), indexed=len(self._idx))
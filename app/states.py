@@ -19,10 +19,16 @@ class EditProfile(StatesGroup):
     waiting_for_new_description = State()
     waiting_for_new_photos = State()
     waiting_for_new_video = State()
+    choosing_filter = State()
+    waiting_for_filter_age = State()
+    waiting_for_filter_institutes = State()
 
 class BrowseProfiles(StatesGroup):
     browsing = State()
 
+class SearchProfiles(StatesGroup):
+    waiting_for_query = State()
+
 class SuperLike(StatesGroup):
     waiting_for_message = State()
 
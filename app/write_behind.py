@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import sqlite3
+from collections import deque
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple
+
+# Параметры по умолчанию: сброс каждые FLUSH_INTERVAL_MS или как только
+# накопилось FLUSH_ROWS строк; при MAX_PENDING строк add() ждёт сброса.
+FLUSH_INTERVAL_MS = 50
+FLUSH_ROWS = 200
+MAX_PENDING = 5000
+# После стольких неудачных сбросов подряд пачка пишется построчно, и строки,
+# которые БД отвергает (нарушение ограничений, неверные данные), откладываются
+MAX_ATTEMPTS = 3
+# Сколько отложенных строк держать для разбора (parked()); старые забываются
+MAX_PARKED = 1000
+# Ошибки, из-за которых виновата сама строка, а не состояние БД
+_ROW_ERRORS = (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError, ValueError,
+               OverflowError, TypeError)
+
+
+class WriteBehindBuffer:
+    """Отложенная пакетная запись мелких INSERT'ов (лайки, дизлайки, просмотры).
+
+    Строки копятся в памяти и раз в interval_ms (или при batch_rows строк)
+    записываются одной транзакцией писателя через executemany — один fsync
+    на пачку свайпов вместо одного на каждый. Ключ строки уникален внутри
+    своего вида: повторная запись с тем же ключом схлопывается.
+
+    Пока строка не закоммичена, её видно через pending()/has() — на этом
+    data.py строит read-your-writes. Буфер ограничен: при max_pending строк
+    add() ждёт ближайшего сброса (backpressure). Если фоновый сброс не
+    запущен (скрипты), add() пишет сразу.
+
+    Неудачная пачка возвращается в очередь. После MAX_ATTEMPTS неудач подряд
+    она пишется построчно: строки, на которых БД выдаёт ошибку самой строки
+    (_ROW_ERRORS), откладываются в parked() и в лог, остальные записываются.
+    Так одна «ядовитая» строка не держит все последующие свайпы. Ошибки
+    самой БД (занята, диск) по-прежнему только повторяются.
+    """
+
+    def __init__(self, pool, interval_ms: int = FLUSH_INTERVAL_MS,
+                 batch_rows: int = FLUSH_ROWS, max_pending: int = MAX_PENDING):
+        self.pool = pool
+        self.interval = interval_ms / 1000
+        self.batch_rows = batch_rows
+        self.max_pending = max_pending
+        self._sql: Dict[str, str] = {}
+        self._pending: Dict[str, Dict[Hashable, Tuple]] = {}
+        # Строки, которые прямо сейчас пишутся: до коммита они тоже должны быть видны
+        self._inflight: Dict[str, Dict[Hashable, Tuple]] = {}
+        self._size = 0
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        # Неудачных сбросов подряд
+        self._failures = 0
+        self._parked: deque = deque(maxlen=MAX_PARKED)
+        self._stats = dict.fromkeys(('rows', 'flushes', 'max_batch', 'backpressure_waits', 'errors', 'parked'), 0)
+
+    def register(self, kind: str, sql: str):
+        """sql — INSERT с параметрами в порядке полей строки."""
+        self._sql[kind] = sql
+        self._pending[kind] = {}
+        self._inflight[kind] = {}
+
+    # ---------- Чтение незаписанного ----------
+    def has(self, kind: str, key: Hashable) -> bool:
+        return key in self._pending[kind] or key in self._inflight[kind]
+
+    def get(self, kind: str, key: Hashable) -> Optional[Tuple]:
+        """Последняя незаписанная строка с этим ключом или None."""
+        row = self._pending[kind].get(key)
+        return row if row is not None else self._inflight[kind].get(key)
+
+    def pending(self, kind: str) -> Iterator[Tuple[Hashable, Tuple]]:
+        """Все ещё не закоммиченные строки вида kind (ключ, строка)."""
+        yield from self._inflight[kind].items()
+        yield from self._pending[kind].items()
+
+    def discard(self, kind: str, predicate):
+        """Убирает строки, для ключа которых predicate(key) истинно.
+
+        Из очереди строки удаляются, а из пачки, которая сейчас пишется, —
+        только вычёркиваются: если сброс не удастся, в очередь они уже не
+        вернутся. Если же пачка успеет закоммититься, она сделает это раньше
+        следующей транзакции писателя (например, DELETE из delete_profile).
+        """
+        bucket = self._pending[kind]
+        for key in [key for key in bucket if predicate(key)]:
+            del bucket[key]
+            self._size -= 1
+        inflight = self._inflight[kind]
+        for key in [key for key in inflight if predicate(key)]:
+            del inflight[key]
+
+    # ---------- Запись ----------
+    async def add(self, kind: str, key: Hashable, row: Tuple, replace: bool = False):
+        bucket = self._pending[kind]
+        if key in bucket:
+            if replace:
+                bucket[key] = row
+            return
+        if self._task is None:
+            bucket[key] = row
+            self._size += 1
+            await self.flush()
+            return
+        if self._size >= self.max_pending:
+            self._stats['backpressure_waits'] += 1
+            async with self._drained:
+                self._wakeup.set()
+                await self._drained.wait_for(lambda: self._size < self.max_pending)
+            bucket = self._pending[kind]
+            if key in bucket and not replace:
+                return
+        if key not in bucket:
+            self._size += 1
+        bucket[key] = row
+        if self._size >= self.batch_rows:
+            self._wakeup.set()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._size:
+                return
+            batch = self._pending
+            self._inflight = batch
+            self._pending = {kind: {} for kind in self._sql}
+            size, self._size = self._size, 0
+            parked = []
+            try:
+                async with self.pool.write() as db:
+                    for kind, rows in batch.items():
+                        if not rows:
+                            continue
+                        if self._failures < MAX_ATTEMPTS:
+                            await db.executemany(self._sql[kind], list(rows.values()))
+                        else:
+                            parked += await self._write_rows(db, kind, rows)
+            except BaseException as e:
+                # Возвращаем строки в очередь, не затирая более свежие;
+                # вычеркнутые discard() из batch уже удалены
+                self._stats['errors'] += 1
+                self._failures += 1
+                logging.error(f"Ошибка пакетной записи ({size} строк), повторим позже: {e!r}")
+                for kind, rows in batch.items():
+                    for key, row in rows.items():
+                        if key not in self._pending[kind]:
+                            self._pending[kind][key] = row
+                            self._size += 1
+                raise
+            finally:
+                self._inflight = {kind: {} for kind in self._sql}
+            self._failures = 0
+            for kind, key, row, error in parked:
+                logging.error(f"Строка {kind} {key!r} отложена, БД её не принимает: {error!r}")
+            self._parked.extend(parked)
+            self._stats['parked'] += len(parked)
+            size -= len(parked)
+            self._stats['rows'] += size
+            self._stats['flushes'] += 1
+            self._stats['max_batch'] = max(self._stats['max_batch'], size)
+        async with self._drained:
+            self._drained.notify_all()
+
+    async def _write_rows(self, db, kind: str, rows: Dict[Hashable, Tuple]) -> List[Tuple]:
+        """Пишет строки по одной; возвращает (kind, key, row, ошибка) для отвергнутых."""
+        rejected = []
+        # Копия: пока ждём БД, discard() может вычеркнуть строки из rows
+        for key, row in list(rows.items()):
+            try:
+                await db.execute(self._sql[kind], row)
+            except _ROW_ERRORS as e:
+                rejected.append((kind, key, row, e))
+        return rejected
+
+    def parked(self) -> List[Tuple]:
+        """Последние отложенные строки: (kind, key, row, ошибка)."""
+        return list(self._parked)
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Останавливает фоновый сброс и дописывает всё накопленное.
+
+        Не бросает исключений: при остановке бота после буфера закрываются
+        хранилище FSM и пул. Если дописать не удалось (в том числе после
+        построчной записи), оставшиеся строки только пишутся в лог.
+        """
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._closing = False
+        for _ in range(MAX_ATTEMPTS + 1):
+            try:
+                await self.flush()
+                return
+            except Exception:
+                pass
+        logging.error(f"При остановке не записано строк: {self._size}")
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, pending=self._size)
@@ -0,0 +1,155 @@
+"""Время последней активности (activity.py) и исключение неактивных анкет из пулов.
+
+1. Запись активности: USERS пользователей шлют по MESSAGES_PER_USER
+   сообщений. Для сравнения — UPDATE profiles SET last_active в своей
+   транзакции на каждое сообщение против data.activity.touch (строка в
+   swipes не чаще раза в activity.WRITE_EVERY на пользователя). Печатает
+   время на сообщение, коммиты и записанные строки.
+2. Пулы при 10k и 100k анкет, DORMANT_SHARE из них неактивны дольше
+   matching.INACTIVE_DAYS: get_profile_pools без исключения и с ним. Перед
+   замерами проверяет, что в пулах нет неактивных и что 'index', 'sql' и
+   'columns' дают одни и те же анкеты.
+
+Заодно проверяет начальные значения миграции 13 (лайки, просмотры, стрик)
+и то, что save_profile не затирает last_active.
+
+    python benchmarks/bench_activity.py
+"""
+import asyncio
+import random
+import time
+
+from common import GENDERS, INTERESTS, data, open_temp_db, seed_profiles, seed_reactions, report
+from bench_candidate_sql import measure
+import activity
+import matching
+import migrations
+import profile_store
+
+USERS = 50
+MESSAGES_PER_USER = 200
+SIZES = (10_000, 100_000)
+DORMANT_SHARE = 0.4
+CALLS = 30
+
+
+async def check_migration():
+    await open_temp_db('activity_migration.db')
+    await seed_profiles(200)
+    await seed_reactions(200, 10)
+    async with data.pool.write() as db:
+        await db.execute("INSERT INTO user_streaks (user_id, current_streak, longest_streak, last_active_date) "
+                         "VALUES (1, 1, 1, '2099-01-01')")
+        await db.execute('UPDATE profiles SET last_active = NULL')
+        await db.execute('DELETE FROM likes WHERE user_id IN (2, 3)')
+        await db.execute('DELETE FROM profile_views WHERE viewer_id = 3')
+        await db.execute(migrations.SCHEMA_V13[1])
+        async with db.execute('SELECT MAX(viewed_at) FROM profile_views WHERE viewer_id = 2') as cursor:
+            last_view, = await cursor.fetchone()
+        async with db.execute('SELECT user_id, MAX(created_at) FROM likes WHERE user_id > 3 GROUP BY user_id LIMIT 1'
+                              ) as cursor:
+            liker, last_like = await cursor.fetchone()
+        async with db.execute('SELECT MAX(viewed_at) FROM profile_views WHERE viewer_id = ?', (liker,)) as cursor:
+            last_like = max(last_like, (await cursor.fetchone())[0])
+        async with db.execute('SELECT user_id, last_active FROM profiles WHERE user_id IN (1, 2, 3, ?)', (liker,)
+                              ) as cursor:
+            last_active = dict(await cursor.fetchall())
+    assert last_active[1] == '2099-01-01 23:59:59', last_active
+    assert last_active[2] == last_view, (last_active, last_view)  # смотрел анкеты, но никого не лайкнул
+    assert last_active[3] >= activity.timestamp(1), last_active  # ни лайков, ни просмотров, ни стрика — момент миграции
+    assert last_active[liker] == last_like, (last_active, last_like)
+    await data.save_profile(liker, "Тест", 20, GENDERS[0], INTERESTS[1], data.INSTITUTES[0], "Описание", ["photo"])
+    async with data.pool.read() as db:
+        async with db.execute('SELECT last_active FROM profiles WHERE user_id = ?', (liker,)) as cursor:
+            assert (await cursor.fetchone())[0] == last_like
+
+
+async def touch_direct(user_id: int):
+    async with data.pool.write() as db:
+        await db.execute('UPDATE profiles SET last_active = CURRENT_TIMESTAMP WHERE user_id = ?', (user_id,))
+
+
+async def user_session(touch, user_id: int, samples):
+    for _ in range(MESSAGES_PER_USER):
+        start = time.perf_counter()
+        await touch(user_id)
+        samples.append(time.perf_counter() - start)
+        await asyncio.sleep(0)
+
+
+async def run_messages(label: str, touch):
+    samples = []
+    writes_before = data.pool.stats()['writes']
+    rows_before = data.swipes.stats()['rows']
+    start = time.perf_counter()
+    await asyncio.gather(*[user_session(touch, uid, samples) for uid in range(1, USERS + 1)])
+    await data.swipes.flush()
+    elapsed = time.perf_counter() - start
+    commits = data.pool.stats()['writes'] - writes_before
+    report(label, samples)
+    print(f"{'':<40} сообщений/с={len(samples) / elapsed:9.0f}  коммитов: {commits}  "
+          f"строк через swipes: {data.swipes.stats()['rows'] - rows_before}")
+
+
+async def seed_activity(size: int, seed: int = 11):
+    rnd = random.Random(seed)
+    rows = []
+    for uid in range(1, size + 1):
+        days = rnd.uniform(matching.INACTIVE_DAYS + 1, 365) if rnd.random() < DORMANT_SHARE \
+            else rnd.uniform(0, matching.INACTIVE_DAYS - 1)
+        rows.append((activity.timestamp(days), uid))
+    async with data.pool.write() as db:
+        await db.executemany('UPDATE profiles SET last_active = ? WHERE user_id = ?', rows)
+    return {uid for (moment, uid) in rows if moment < activity.timestamp(matching.INACTIVE_DAYS)}
+
+
+async def pools(user_id: int):
+    return [set(pool) for pool in await matching.get_profile_pools(user_id)]
+
+
+async def main():
+    await check_migration()
+
+    await open_temp_db('activity_messages.db')
+    await seed_profiles(USERS)
+    await run_messages("UPDATE на каждое сообщение", touch_direct)
+    data.swipes.start()
+    await run_messages("activity.touch", data.activity.touch)
+    await data.swipes.close()
+    print(f"Активность: {data.activity.stats()}")
+
+    inactive_days = matching.INACTIVE_DAYS
+    for size in SIZES:
+        await open_temp_db(f'activity{size}.db')
+        await seed_profiles(size)
+        await seed_reactions(size, 20)
+        dormant = await seed_activity(size)
+        matching.candidates = matching.CandidateIndex()
+        data.on_profile_change(matching.candidates.mark_dirty)
+        profile_store.profiles = profile_store.ProfileStore()
+        data.on_profile_change(profile_store.profiles.mark_dirty)
+
+        ids = random.Random(4).sample(range(1, size + 1), CALLS)
+        matching.POOL_SAMPLE = None
+        for uid in ids[:3]:
+            results = {}
+            for source in ('index', 'sql', 'columns'):
+                matching.POOL_SOURCE = source
+                results[source] = await pools(uid)
+            assert results['index'] == results['sql'] == results['columns'], uid
+            assert not set.union(*results['index']) & dormant, uid
+        matching.POOL_SOURCE, matching.POOL_SAMPLE = 'index', 200
+
+        print(f"Анкет: {size}, неактивных дольше {inactive_days} дней: {len(dormant)}")
+        for days in (None, inactive_days):
+            matching.INACTIVE_DAYS = days
+            new_sizes = [len((await matching.get_profile_pools(uid))[0]) for uid in ids]
+            label = "без исключения" if days is None else f"INACTIVE_DAYS = {days}"
+            report(f"  get_profile_pools, {label}", await measure(matching.get_profile_pools, ids))
+            print(f"{'':<40} новых в пуле в среднем: {sum(new_sizes) / len(new_sizes):.0f}")
+        matching.INACTIVE_DAYS = inactive_days
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
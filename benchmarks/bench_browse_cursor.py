@@ -0,0 +1,60 @@
+"""Шаг просмотра: random.choice + list.remove против упакованной перестановки с курсором.
+
+Каждый шаг — как в show_next_profile: get_data из MemoryStorage, выбор
+следующей анкеты из пула и update_data. Печатает время шага и размер пула
+в данных FSM для пулов 1k, 10k и 100k анкет.
+"""
+import asyncio
+import random
+import sys
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from common import report
+import matching
+
+SIZES = (1_000, 10_000, 100_000)
+STEPS = 500
+KEY = StorageKey(bot_id=1, chat_id=1, user_id=1)
+
+
+def take_list(data: dict) -> int:
+    # Поведение до курсора
+    next_id = random.choice(data['new_pool'])
+    data['new_pool'].remove(next_id)
+    return next_id
+
+
+async def run(storage: MemoryStorage, take):
+    samples = []
+    for _ in range(STEPS):
+        start = time.perf_counter()
+        data = await storage.get_data(KEY)
+        take(data)
+        await storage.update_data(KEY, data)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def main():
+    for size in SIZES:
+        ids = random.Random(1).sample(range(1, 10 * size), size)
+        print(f"Пул: {size} анкет")
+
+        storage = MemoryStorage()
+        await storage.set_data(KEY, {'new_pool': list(ids)})
+        pool_bytes = sys.getsizeof(ids) + sum(sys.getsizeof(i) for i in ids)
+        report(f"  list ({pool_bytes / 1024:.0f} KB)", await run(storage, take_list))
+
+        storage = MemoryStorage()
+        data = {}
+        matching._set_pool(data, 'new', ids)
+        await storage.set_data(KEY, data)
+        pool_bytes = sys.getsizeof(data['new_pool'])
+        report(f"  курсор ({pool_bytes / 1024:.0f} KB)", await run(storage, lambda d: matching._take(d, 'new')))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
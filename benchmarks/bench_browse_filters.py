@@ -0,0 +1,98 @@
+"""Фильтры просмотра (возраст, институты, только верифицированные): пулы с фильтрами и без.
+
+Для 1k, 10k и 100k анкет (пятая часть верифицирована) у смотрящих
+сохранены фильтры: возраст 19–23, два института, у половины — только
+верифицированные. Сравнивает:
+- все анкеты + фильтр в Python (как сделали бы без индекса);
+- CandidateIndex + битовые карты без фильтров и с ними (POOL_SOURCE = 'index');
+- data.get_candidate_pools с фильтрами, без лимита и с LIMIT POOL_SAMPLE
+  (POOL_SOURCE = 'sql', idx_profiles_browse).
+Перед замерами проверяет, что индекс и SQL дают одни и те же пулы.
+
+    python benchmarks/bench_browse_filters.py
+"""
+import asyncio
+import random
+
+from common import data, open_temp_db, seed_profiles, seed_reactions, report
+from bench_candidate_sql import measure
+from bench_profile_pools import pools_full_read
+import compat
+import matching
+
+SIZES = (1_000, 10_000, 100_000)
+REACTIONS_PER_USER = 20
+VERIFIED_SHARE = 0.2
+CALLS = 30
+
+
+def viewer_filters(user_id: int) -> dict:
+    return {'age_min': 19, 'age_max': 23, 'institutes': ['ИИТ', 'ИКБ'], 'verified_only': user_id % 2 == 0}
+
+
+async def python_pools(user_id: int):
+    """Все анкеты и фильтр по каждой в Python."""
+    filters = viewer_filters(user_id)
+    profiles = await data.get_all_profiles()
+    new_ids, disliked_ids, liked_ids = await pools_full_read(user_id)
+    verified = set()
+    if filters['verified_only']:
+        async with data.pool.read() as db:
+            async with db.execute('SELECT user_id FROM profiles WHERE verified = 1') as cursor:
+                verified = {row[0] for row in await cursor.fetchall()}
+
+    def keep(uid):
+        profile = profiles[uid]
+        return (profile['age'] is not None and filters['age_min'] <= profile['age'] <= filters['age_max']
+                and profile['institute'] in filters['institutes']
+                and (not filters['verified_only'] or uid in verified))
+    return [uid for uid in new_ids if keep(uid)], [uid for uid in disliked_ids if keep(uid)], \
+           [uid for uid in liked_ids if keep(uid)]
+
+
+async def sql_pools(user_id: int, limit=None):
+    profile = await data.get_profile(user_id)
+    classes = compat.MUTUAL[compat.class_of(profile['gender'], profile['interests'])]
+    return await data.get_candidate_pools(user_id, classes, limit, await data.get_browse_filters(user_id))
+
+
+async def unfiltered_pools(user_id: int):
+    profile = await data.get_profile(user_id)
+    classes = compat.MUTUAL[compat.class_of(profile['gender'], profile['interests'])]
+    allowed = await matching.candidates.bits(classes, exclude=user_id)
+    sets = await data.seen.load(user_id)
+    return await data.seen.to_ids(allowed & ~(sets['likes'] | sets['dislikes']))
+
+
+async def main():
+    for size in SIZES:
+        await open_temp_db(f'filters{size}.db')
+        await seed_profiles(size)
+        await seed_reactions(size, REACTIONS_PER_USER)
+        rnd = random.Random(5)
+        verified = rnd.sample(range(1, size + 1), int(size * VERIFIED_SHARE))
+        async with data.pool.write() as db:
+            await db.executemany('UPDATE profiles SET verified = 1 WHERE user_id = ?', [(uid,) for uid in verified])
+            await db.execute('ANALYZE')
+        matching.candidates = matching.CandidateIndex()
+        data.on_profile_change(matching.candidates.mark_dirty)
+        ids = random.Random(4).sample(range(1, size + 1), CALLS)
+        for uid in ids:
+            await data.save_browse_filters(uid, **viewer_filters(uid))
+        for uid in ids[:3]:
+            expected = [sorted(p) for p in await matching.get_profile_pools(uid)]
+            assert [sorted(p) for p in await sql_pools(uid)] == expected, uid
+            assert [sorted(p) for p in await python_pools(uid)] == expected, uid
+
+        print(f"Анкет: {size}, в пуле новых с фильтрами ~{len((await sql_pools(ids[0]))[0])}")
+        report("  все анкеты + фильтр в Python", await measure(python_pools, ids[:10]))
+        report("  CandidateIndex без фильтров", await measure(unfiltered_pools, ids))
+        report("  CandidateIndex + фильтры", await measure(matching.get_profile_pools, ids))
+        report("  SQL + фильтры", await measure(sql_pools, ids))
+        report(f"  SQL + фильтры, LIMIT {matching.POOL_SAMPLE}",
+               await measure(lambda uid: sql_pools(uid, matching.POOL_SAMPLE), ids))
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,134 @@
+"""Очередь новых анкет (data.CANDIDATE_QUEUE): стоимость на чтении против стоимости на записи.
+
+Для каждого размера базы:
+- старт просмотра (get_profile_pools, холодные битовые карты) в режимах
+  'index', 'sql' и 'queue';
+- регистрация (save_profile) и свайп (add_like/add_dislike вместе со
+  сбросом swipes) без очереди и с ней;
+- заполнение очереди с нуля, её объём в строках и на диске.
+
+В конце — время на 1000 свайпов при разных соотношениях регистраций и
+свайпов (старт просмотра — раз в SESSION_SWIPES свайпов), по нему и
+выбирается режим для конкретной установки.
+
+    python benchmarks/bench_candidate_queue.py
+"""
+import asyncio
+import random
+import time
+
+from common import GENDERS, INTERESTS, data, open_temp_db, seed_profiles, seed_reactions, report, percentiles
+import matching
+
+SIZES = (2_000, 5_000)
+REACTIONS_PER_USER = 50
+STARTS = 50
+REGISTRATIONS = 100
+SWIPES = 5000
+SESSION_SWIPES = 30
+# Регистраций на 1000 свайпов
+RATIOS = (1, 10, 50)
+
+
+async def measure_starts(mode: str, user_ids):
+    matching.POOL_SOURCE = mode
+    data.seen.reset()
+    samples = []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        await matching.get_profile_pools(user_id)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def measure_registrations(first_id: int):
+    rnd = random.Random(first_id)
+    samples = []
+    for user_id in range(first_id, first_id + REGISTRATIONS):
+        start = time.perf_counter()
+        await data.save_profile(user_id, f"user{user_id}", 20, rnd.choice(GENDERS), rnd.choice(INTERESTS),
+                                rnd.choice(data.INSTITUTES), "Описание", [f"photo{user_id}"])
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def measure_swipes(size: int, seed: int) -> float:
+    """Среднее время свайпа вместе с его долей в пакетной записи, секунды."""
+    rnd = random.Random(seed)
+    start = time.perf_counter()
+    for n in range(SWIPES):
+        user_id, target_id = rnd.randint(1, size), rnd.randint(1, size)
+        if n % 3:
+            await data.add_dislike(user_id, target_id)
+        else:
+            await data.add_like(user_id, target_id)
+    await data.swipes.flush()
+    return (time.perf_counter() - start) / SWIPES
+
+
+async def db_size() -> int:
+    """Занятый объём БД в байтах."""
+    async with data.pool.read() as db:
+        async with db.execute('SELECT (page_count - freelist_count) * page_size '
+                              'FROM pragma_page_count, pragma_freelist_count, pragma_page_size') as cursor:
+            return (await cursor.fetchone())[0]
+
+
+async def main():
+    for size in SIZES:
+        data.CANDIDATE_QUEUE = False
+        await open_temp_db(f'queue{size}.db')
+        await seed_profiles(size)
+        await seed_reactions(size, REACTIONS_PER_USER)
+        matching.candidates = matching.CandidateIndex()
+        data.on_profile_change(matching.candidates.mark_dirty)
+        users = random.Random(3).sample(range(1, size + 1), STARTS)
+        print(f"Анкет: {size}")
+        data.swipes.start()
+
+        starts = {mode: await measure_starts(mode, users) for mode in ('index', 'sql')}
+        registrations = {'index': await measure_registrations(size + 1)}
+        swipes = {'index': await measure_swipes(size, 1)}
+
+        used = await db_size()
+        data.CANDIDATE_QUEUE = True
+        start = time.perf_counter()
+        async with data.pool.write() as db:
+            rows = await data._rebuild_candidate_queue(db)
+        extra_mb = (await db_size() - used) / 2 ** 20
+        print(f"  очередь заполнена за {time.perf_counter() - start:.1f} с: "
+              f"{rows} строк ({rows / size:.0f} на анкету), ~{extra_mb:.0f} МБ")
+
+        registrations['queue'] = await measure_registrations(size + 1 + REGISTRATIONS)
+        swipes['queue'] = await measure_swipes(size, 2)
+        starts['queue'] = await measure_starts('queue', users)
+        await data.swipes.close()
+
+        # Очередь, которую вели на записи, совпадает с пулом новых из индекса
+        for user_id in users[:10]:
+            matching.POOL_SOURCE = 'queue'
+            from_queue = await matching.get_profile_pools(user_id)
+            matching.POOL_SOURCE = 'index'
+            assert [sorted(p) for p in from_queue] == [sorted(p) for p in await matching.get_profile_pools(user_id)]
+
+        for mode, samples in starts.items():
+            report(f"  старт просмотра ({mode})", samples)
+        for mode in ('index', 'queue'):
+            report(f"  регистрация ({'с очередью' if mode == 'queue' else 'без очереди'})", registrations[mode])
+            print(f"  свайп со сбросом ({'с очередью' if mode == 'queue' else 'без очереди'}): "
+                  f"{swipes[mode] * 1000:.3f} ms")
+
+        print(f"  на 1000 свайпов (старт просмотра раз в {SESSION_SWIPES} свайпов), ms:")
+        for ratio in RATIOS:
+            costs = []
+            for mode in ('index', 'sql', 'queue'):
+                writes = 'queue' if mode == 'queue' else 'index'
+                total = (1000 * swipes[writes] + ratio * percentiles(registrations[writes])[0] / 1000
+                         + 1000 / SESSION_SWIPES * percentiles(starts[mode])[0] / 1000)
+                costs.append(f"{mode}={total * 1000:8.1f}")
+            print(f"    {ratio:>3} регистраций: {'  '.join(costs)}")
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
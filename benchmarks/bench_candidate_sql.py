@@ -0,0 +1,61 @@
+"""Пулы анкет: в Python (полное чтение, CandidateIndex) против запроса с анти-join'ами.
+
+Для 1k, 10k и 100k анкет сравнивает:
+- все анкеты + фильтр в Python (как было до индекса кандидатов);
+- CandidateIndex + битовые карты (matching, POOL_SOURCE = 'index');
+- data.get_candidate_pools без лимита и со случайной выборкой POOL_SAMPLE
+  (POOL_SOURCE = 'sql').
+"""
+import asyncio
+import random
+import time
+
+from common import data, open_temp_db, seed_profiles, seed_reactions, report
+from bench_profile_pools import pools_full_read
+import compat
+import matching
+
+SIZES = (1_000, 10_000, 100_000)
+REACTIONS_PER_USER = 20
+CALLS = 30
+
+
+async def measure(fn, ids):
+    samples = []
+    for uid in ids:
+        start = time.perf_counter()
+        await fn(uid)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def sql_pools(user_id: int, limit=None):
+    profile = await data.get_profile(user_id)
+    classes = compat.MUTUAL[compat.class_of(profile['gender'], profile['interests'])]
+    return await data.get_candidate_pools(user_id, classes, limit)
+
+
+async def main():
+    for size in SIZES:
+        await open_temp_db(f'candidates{size}.db')
+        await seed_profiles(size)
+        await seed_reactions(size, REACTIONS_PER_USER)
+        async with data.pool.write() as db:
+            await db.execute('ANALYZE')
+        matching.candidates = matching.CandidateIndex()
+        ids = random.Random(4).sample(range(1, size + 1), CALLS)
+        for uid in ids[:3]:
+            expected = [sorted(p) for p in await matching.get_profile_pools(uid)]
+            assert [sorted(p) for p in await sql_pools(uid)] == expected, uid
+
+        print(f"Анкет: {size}")
+        report("  все анкеты + фильтр в Python", await measure(pools_full_read, ids[:10]))
+        report("  CandidateIndex + карты", await measure(matching.get_profile_pools, ids))
+        report("  SQL, анти-join", await measure(sql_pools, ids))
+        report(f"  SQL, анти-join, LIMIT {matching.POOL_SAMPLE}",
+               await measure(lambda uid: sql_pools(uid, matching.POOL_SAMPLE), ids))
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,162 @@
+"""Недоступные пользователи (delivery.py): лишние отправки и исключение из пулов.
+
+1. Лайки через handlers.send_like_notification ботом-заглушкой: BLOCKED_SHARE
+   получателей заблокировали бота, у FAILING_SHARE отправка падает с «chat
+   not found», у BROKEN_SHARE не разбирается разметка (ошибка в сообщении, а
+   не в получателе). Каждый из ROUNDS раундов — по лайку каждому получателю.
+   Печатает отправки по раундам: после первых неудач недоступным больше не
+   отправляется, а получатели с битой разметкой доступны. Проверяет, что
+   успешная отправка сбрасывает счётчик неудач.
+2. Исключение недоступных: их нет в пулах ('index', 'sql', 'columns' дают одно
+   и то же), в поиске и в рулетке. После сообщения боту
+   (handlers._DeliveryMiddleware) пользователь возвращается.
+3. Время get_profile_pools при 100k анкет без недоступных и с 10% недоступных
+   и цена проверки в middleware на каждое обновление.
+
+    python benchmarks/bench_delivery.py
+"""
+import asyncio
+import random
+import time
+import types
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from common import data, open_temp_db, seed_profiles, seed_reactions, report
+from bench_candidate_sql import measure
+import compat
+import delivery
+import handlers
+import matching
+import profile_store
+
+RECIPIENTS = 1000
+BLOCKED_SHARE = 0.1
+FAILING_SHARE = 0.05
+BROKEN_SHARE = 0.05
+ROUNDS = 5
+SIZE = 100_000
+UNREACHABLE_SHARE = 0.1
+CALLS = 30
+
+
+class FakeBot:
+    """Отправки без сети: заблокировавшим — TelegramForbiddenError, «пропавшим» и с битой разметкой — TelegramBadRequest."""
+
+    def __init__(self, blocked, failing, broken):
+        self.blocked, self.failing, self.broken = set(blocked), set(failing), set(broken)
+        self.attempts = 0
+
+    async def _send(self, chat_id, *args, **kwargs):
+        self.attempts += 1
+        if chat_id in self.blocked:
+            raise TelegramForbiddenError(method=None, message="Forbidden: bot was blocked by the user")
+        if chat_id in self.failing:
+            raise TelegramBadRequest(method=None, message="Bad Request: chat not found")
+        if chat_id in self.broken:
+            raise TelegramBadRequest(method=None, message="Bad Request: can't parse entities: "
+                                                          "can't find end of the entity starting at byte offset 10")
+
+    send_message = send_photo = send_media_group = _send
+
+
+async def check_notifications():
+    await open_temp_db('delivery_notify.db')
+    await seed_profiles(RECIPIENTS + 1)
+    rnd = random.Random(3)
+    targets = list(range(2, RECIPIENTS + 2))
+    blocked = rnd.sample(targets, int(RECIPIENTS * BLOCKED_SHARE))
+    failing = rnd.sample(sorted(set(targets) - set(blocked)), int(RECIPIENTS * FAILING_SHARE))
+    broken = rnd.sample(sorted(set(targets) - set(blocked) - set(failing)), int(RECIPIENTS * BROKEN_SHARE))
+    bot = FakeBot(blocked, failing, broken)
+    print(f"Получателей: {RECIPIENTS}, заблокировали бота: {len(blocked)}, «chat not found»: {len(failing)}, "
+          f"битая разметка: {len(broken)}")
+    for round_no in range(1, ROUNDS + 1):
+        before = bot.attempts
+        for target in targets:
+            await handlers.send_like_notification(bot, 1, target)
+        print(f"  раунд {round_no}: отправок {bot.attempts - before}")
+    assert data.delivery.unreachable == set(blocked) | set(failing)
+    print(f"  {data.delivery.stats()}")
+
+    # Неудача, потом успех — счётчик сбрасывается, строки в БД больше нет
+    target = next(uid for uid in targets if uid not in bot.blocked | bot.failing | bot.broken)
+    bot.failing.add(target)
+    await handlers.send_like_notification(bot, 1, target)
+    bot.failing.discard(target)
+    await handlers.send_like_notification(bot, 1, target)
+    for _ in range(delivery.MAX_FAILURES - 1):
+        bot.failing.add(target)
+        await handlers.send_like_notification(bot, 1, target)
+    assert not data.delivery.is_unreachable(target)
+    async with data.pool.read() as db:
+        async with db.execute('SELECT failures, unreachable FROM delivery_health WHERE user_id = ?', (target,)) as cursor:
+            assert await cursor.fetchone() == (delivery.MAX_FAILURES - 1, 0)
+
+    # Состояние переживает перезапуск
+    data.delivery.reset()
+    await data.delivery.load()
+    assert data.delivery.unreachable == set(blocked) | set(failing)
+
+
+async def message_from(user_id: int):
+    async def handler(event, handler_data):
+        return None
+    await handlers._DeliveryMiddleware()(handler, object(), {'event_from_user': types.SimpleNamespace(id=user_id)})
+
+
+async def pools_by_source(user_id: int):
+    result = {}
+    for source in ('index', 'sql', 'columns'):
+        matching.POOL_SOURCE = source
+        # int(): 'index' и 'columns' отдают пул новых массивом NumPy, а id уходят в SQL
+        result[source] = [set(map(int, pool)) for pool in await matching.get_profile_pools(user_id)]
+    matching.POOL_SOURCE = 'index'
+    assert result['index'] == result['sql'] == result['columns'], user_id
+    return set.union(*result['index'])
+
+
+async def block(user_ids):
+    for user_id in user_ids:
+        await data.delivery.blocked(user_id, TelegramForbiddenError(method=None, message="Forbidden"))
+
+
+async def main():
+    await check_notifications()
+
+    await open_temp_db('delivery_pools.db')
+    await seed_profiles(SIZE)
+    await seed_reactions(SIZE, 20)
+    matching.candidates = matching.CandidateIndex()
+    data.on_profile_change(matching.candidates.mark_dirty)
+    profile_store.profiles = profile_store.ProfileStore()
+    data.on_profile_change(profile_store.profiles.mark_dirty)
+    matching.POOL_SAMPLE = None
+    ids = random.Random(4).sample(range(1, SIZE + 1), CALLS)
+    report("get_profile_pools, все доступны", await measure(matching.get_profile_pools, ids))
+
+    viewer = ids[0]
+    everyone = await pools_by_source(viewer)
+    unreachable = random.Random(5).sample(sorted(everyone), int(SIZE * UNREACHABLE_SHARE))
+    start = time.perf_counter()
+    await block(unreachable)
+    print(f"Недоступных: {len(unreachable)} (запись {(time.perf_counter() - start) * 1000 / len(unreachable):.2f} мс на каждого)")
+    assert not await pools_by_source(viewer) & set(unreachable)
+    profile = await data.get_profile(viewer)
+    classes = compat.MUTUAL[compat.class_of(profile['gender'], profile['interests'])]
+    assert not set(await data.search_profiles(viewer, "Описание", classes, limit=1000)) & set(unreachable)
+    for _ in range(20):
+        assert await data.get_random_profile_other_institute(viewer, profile['institute']) not in unreachable
+    report(f"get_profile_pools, {UNREACHABLE_SHARE:.0%} недоступны", await measure(matching.get_profile_pools, ids))
+
+    returned = unreachable[:10]
+    for user_id in returned:
+        await message_from(user_id)
+    assert set(returned) <= await pools_by_source(viewer)
+    report("middleware: доступный пользователь", await measure(message_from, ids * 30))
+    print(f"Доставка: {data.delivery.stats()}")
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""Привлекательность анкет (elo.py): шаг на свайп, полный пересчёт, выборка лучших.
+
+- add_like/add_dislike с фоновым сбросом swipes — до и после учёта оценки
+  (ELO_ON = False отключает _update_desirability);
+- rebuild_desirability по ~1M событий истории;
+- get_most_desirable против агрегата get_hot_profiles по лайкам за сутки.
+"""
+import asyncio
+import random
+import time
+
+from common import data, open_temp_db, seed_profiles, seed_reactions, report
+from migrations import rebuild_desirability
+
+SIZE = 20_000
+REACTIONS_PER_USER = 50
+SWIPES = 3000
+CALLS = 50
+
+
+async def swipe_samples(offset: int):
+    rnd = random.Random(offset)
+    samples = []
+    for n in range(SWIPES):
+        user_id, target_id = rnd.randint(1, SIZE), rnd.randint(1, SIZE)
+        start = time.perf_counter()
+        if n % 3:
+            await data.add_dislike(user_id, target_id)
+        else:
+            await data.add_like(user_id, target_id)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def measure(fn):
+    samples = []
+    for _ in range(CALLS):
+        start = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def main():
+    await open_temp_db('desirability.db')
+    await seed_profiles(SIZE)
+    await seed_reactions(SIZE, REACTIONS_PER_USER)
+    # Лайки «за сутки» для get_hot_profiles
+    async with data.pool.write() as db:
+        await db.execute("UPDATE likes SET created_at = datetime('now', '-1 hours') WHERE rowid % 5 = 0")
+
+    async with data.pool.read() as db:
+        async with db.execute('SELECT (SELECT COUNT(*) FROM likes) + (SELECT COUNT(*) FROM dislikes)') as cursor:
+            events = (await cursor.fetchone())[0]
+    start = time.perf_counter()
+    async with data.pool.write() as db:
+        rated = await rebuild_desirability(db)
+    print(f"rebuild_desirability: {events} событий, {rated} анкет за {time.perf_counter() - start:.2f} с")
+
+    data.swipes.start()
+    update = data._update_desirability
+
+    async def no_update(*args, **kwargs):
+        pass
+
+    data._update_desirability = no_update
+    report("свайп без оценки", await swipe_samples(1))
+    data._update_desirability = update
+    report("свайп с оценкой Elo", await swipe_samples(2))
+    await data.swipes.close()
+
+    report("get_hot_profiles (агрегат за сутки)", await measure(lambda: data.get_hot_profiles(3)))
+    report("get_most_desirable (индекс)", await measure(lambda: data.get_most_desirable(3)))
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
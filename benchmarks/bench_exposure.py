@@ -0,0 +1,109 @@
+"""Выравнивание показов (exposure.py): распределение показов при ranking с ним и без.
+
+Симуляция: SESSIONS сессий просмотра случайных пользователей по SESSION_SWIPES
+анкет (get_next_profile, record_profile_view и лайк/дизлайк), на середине
+регистрируются NEW_PROFILES новых анкет. Для BALANCE_EXPOSURE False/True
+печатает неравномерность показов (коэффициент Джини), долю анкет без единого
+показа, долю показов у 1% самых показываемых, показы новых анкет во второй
+половине и время построения пула новых (_set_new_pool). Проверяет, что
+построение пула не пишет строк в буфер (начальные значения новых анкет —
+только в памяти), а в profile_impressions нет отрицательных shown.
+
+    python benchmarks/bench_exposure.py
+"""
+import asyncio
+import random
+import time
+from collections import Counter
+
+from common import GENDERS, INTERESTS, data, open_temp_db, seed_profiles, report
+from bench_ranking import seed_features
+import matching
+
+SIZE = 3000
+SESSIONS = 600
+SESSION_SWIPES = 30
+NEW_PROFILES = 50
+LIKE_SHARE = 0.3
+POOL_CALLS = 30
+
+
+def gini(counts) -> float:
+    values = sorted(counts)
+    n, total = len(values), sum(values)
+    if not total:
+        return 0.0
+    return sum((2 * i - n + 1) * v for i, v in enumerate(values)) / (n * total)
+
+
+async def simulate(seed: int):
+    rnd = random.Random(seed)
+    random.seed(seed)
+    shown, new_ids = Counter(), []
+    for session in range(SESSIONS):
+        if session == SESSIONS // 2:
+            for n in range(NEW_PROFILES):
+                user_id = SIZE + 1 + n
+                await data.save_profile(user_id, f"new{n}", 20, rnd.choice(GENDERS), rnd.choice(INTERESTS),
+                                        rnd.choice(data.INSTITUTES), "Описание", [f"photo{user_id}"])
+                new_ids.append(user_id)
+        viewer, state = rnd.randint(1, SIZE), {}
+        for _ in range(SESSION_SWIPES):
+            profile_id, state, _ = await matching.get_next_profile(viewer, state)
+            if profile_id is None:
+                break
+            shown[profile_id] += 1
+            await data.record_profile_view(viewer, profile_id)
+            if rnd.random() < LIKE_SHARE:
+                await data.add_like(viewer, profile_id)
+            else:
+                await data.add_dislike(viewer, profile_id)
+    return shown, new_ids
+
+
+async def pool_samples(user_ids):
+    samples = []
+    for user_id in user_ids:
+        new_ids, _, _ = await matching.get_profile_pools(user_id)
+        start = time.perf_counter()
+        await matching._set_new_pool(user_id, {}, new_ids)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def main():
+    for balance in (False, True):
+        matching.BALANCE_EXPOSURE = balance
+        await open_temp_db(f'exposure{int(balance)}.db')
+        await seed_profiles(SIZE)
+        await seed_features(SIZE)
+        matching.candidates = matching.CandidateIndex()
+        data.on_profile_change(matching.candidates.mark_dirty)
+        data.swipes.start()
+        shown, new_ids = await simulate(1)
+        await data.swipes.flush()
+
+        counts = [shown[user_id] for user_id in range(1, SIZE + 1)]
+        top = sorted(counts, reverse=True)[:SIZE // 100]
+        fresh = [shown[user_id] for user_id in new_ids]
+        print(f"BALANCE_EXPOSURE = {balance}: показов {sum(shown.values())}")
+        print(f"  Джини {gini(counts):.2f}, без показов {counts.count(0) / SIZE:.0%}, "
+              f"у топ-1% {sum(top) / max(sum(counts), 1):.0%} показов")
+        print(f"  новые анкеты: в среднем {sum(fresh) / len(fresh):.1f} показов, "
+              f"без показов {fresh.count(0)} из {len(fresh)}")
+        data.exposure.reset()  # все анкеты пула, кроме загруженных из БД, — холодный старт
+        pending = data.swipes.stats()['pending']
+        report("  _set_new_pool", await pool_samples(random.Random(4).sample(range(1, SIZE + 1), POOL_CALLS)))
+        assert data.swipes.stats()['pending'] == pending, data.swipes.stats()
+        await data.swipes.flush()
+        async with data.pool.read() as db:
+            async with db.execute('SELECT COUNT(*), MIN(shown) FROM profile_impressions') as cursor:
+                rows, lowest = await cursor.fetchone()
+        assert not rows or lowest >= 0, lowest
+        print(f"  profile_impressions: {rows} строк, наименьшее shown {lowest}")
+        await data.swipes.close()
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+"""Память FSM: MemoryStorage против SQLiteStorage с лимитом сессий в памяти.
+
+Имитирует SESSIONS пользователей, открывших просмотр анкет: у каждого в
+данных FSM три упакованных пула (matching._set_pool) и служебные поля
+cmd_browse. Каждое хранилище меряется в отдельном процессе, чтобы RSS не
+смешивались. Затем для SQLiteStorage — время get_data для сессии в памяти
+и для выгруженной в БД. Под конец проверяет устойчивость: нечитаемая
+строка в БД (в том числе pickle) — пустая сессия, при ошибке записи сессии остаются в памяти
+несохранёнными, лимит max_bytes держит объём сессий в памяти.
+
+    python benchmarks/bench_fsm_storage.py
+"""
+import asyncio
+import os
+import pickle
+import random
+import subprocess
+import sys
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from common import data, open_temp_db, report
+from fsm_storage import SQLiteStorage
+import matching
+
+SESSIONS = 50_000
+POOL_SIZE = 300
+HOT_SESSIONS = 2_000
+CALLS = 500
+
+
+def rss_kb() -> int:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def key(uid: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=uid, user_id=uid)
+
+
+def browse_data(uid: int) -> dict:
+    random.seed(uid)  # _set_pool берёт зерно перестановки из глобального random
+    state = {'current_pool': 'new', 'pools_loaded': True, 'current_profile_id': uid}
+    for i, name in enumerate(('new', 'disliked', 'liked')):
+        start = (uid * 3 + i) * POOL_SIZE
+        matching._set_pool(state, name, range(start, start + POOL_SIZE))
+    return state
+
+
+async def fill(kind: str):
+    if kind == 'memory':
+        storage = MemoryStorage()
+    else:
+        await open_temp_db('fsm.db')
+        storage = SQLiteStorage(data.pool, max_sessions=HOT_SESSIONS)
+    before = rss_kb()
+    start = time.perf_counter()
+    for uid in range(1, SESSIONS + 1):
+        await storage.set_state(key(uid), 'BrowsingStates:browsing')
+        await storage.set_data(key(uid), browse_data(uid))
+    elapsed = time.perf_counter() - start
+    print(f"{kind}: {SESSIONS} сессий за {elapsed:.1f} с, RSS +{(rss_kb() - before) / 1024:.0f} MB")
+
+    if kind == 'sqlite':
+        hot = list(range(SESSIONS - HOT_SESSIONS + 1, SESSIONS + 1))
+        samples = []
+        for uid in random.Random(1).sample(hot, CALLS):
+            t = time.perf_counter()
+            await storage.get_data(key(uid))
+            samples.append(time.perf_counter() - t)
+        report("  get_data, сессия в памяти", samples)
+        samples = []
+        for uid in random.Random(2).sample(range(1, SESSIONS - HOT_SESSIONS), CALLS):
+            t = time.perf_counter()
+            restored = await storage.get_data(key(uid))
+            samples.append(time.perf_counter() - t)
+            assert restored == browse_data(uid), uid
+        report("  get_data, выгруженная сессия", samples)
+        async with data.pool.read() as db:
+            async with db.execute('SELECT COUNT(*), SUM(LENGTH(payload)) FROM fsm_sessions') as cursor:
+                rows, size = await cursor.fetchone()
+        print(f"  в БД: {rows} сессий, {size / rows:.0f} байт на сессию; {storage.stats()}")
+        await storage.close()
+        await data.pool.close()
+
+
+async def check_failures():
+    await open_temp_db('fsm_checks.db')
+    storage = SQLiteStorage(data.pool, max_sessions=HOT_SESSIONS)
+    name = storage._key_builder.build(key(1))
+    # pickle, который при загрузке вызвал бы os.system, — не разбирается, а не исполняется
+    exploit = pickle.dumps(type('Exploit', (), {'__reduce__': lambda self: (os.system, ('touch /tmp/fsm-pwned',))})())
+    async with data.pool.write() as db:
+        await db.executemany("INSERT INTO fsm_sessions (key, payload) VALUES (?, ?)",
+                             [(name, b'x-not-a-session'), (storage._key_builder.build(key(12)), exploit)])
+    assert await storage.get_data(key(1)) == {} and await storage.get_state(key(1)) is None
+    assert await storage.get_data(key(12)) == {} and not os.path.exists('/tmp/fsm-pwned')
+    assert storage.stats()['corrupt'] == 2
+
+    # Ошибка записи: сессии остаются в памяти и несохранёнными, следующая выгрузка их пишет
+    for uid in range(2, 12):
+        await storage.set_data(key(uid), browse_data(uid))
+    names = list(storage._hot)
+    dirty = [name for name in names if storage._hot[name].dirty]
+    execute = storage._execute
+
+    async def failing(upserts, deletes):
+        raise RuntimeError("database is locked")
+    storage._execute = failing
+    await storage._spill(names)
+    # Чистые (с битыми строками) выгружаются, изменённые остаются
+    assert list(storage._hot) == dirty and all(storage._hot[name].dirty for name in dirty)
+    storage._execute = execute
+    await storage._spill(names)
+    assert not storage._hot and storage._bytes == 0
+    assert await storage.get_data(key(5)) == browse_data(5)
+    print(f"Проверки: {storage.stats()}")
+
+    # Лимит по объёму: большие сессии вытесняются раньше, чем набирается max_sessions
+    limit = 2 * 2**20
+    storage = SQLiteStorage(data.pool, max_sessions=HOT_SESSIONS, max_bytes=limit)
+    for uid in range(1, 1001):
+        await storage.set_data(key(uid), browse_data(uid))
+        await storage.get_state(key(uid + 5000))
+    stats = storage.stats()
+    assert stats['hot_bytes'] <= limit + max(s.size for s in storage._hot.values()), stats
+    assert stats['hot_bytes'] == sum(s.size for s in storage._hot.values()), stats
+    print(f"max_bytes = {limit}: в памяти {stats['hot']} сессий, {stats['hot_bytes']} байт")
+    await storage.close()
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        asyncio.run(check_failures() if sys.argv[1] == 'checks' else fill(sys.argv[1]))
+    else:
+        for kind in ('memory', 'sqlite', 'checks'):
+            subprocess.run([sys.executable, __file__, kind], check=True)
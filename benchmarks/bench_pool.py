@@ -0,0 +1,55 @@
+"""Латентность get_profile/add_like: соединение на каждый вызов против общего пула."""
+import asyncio
+import random
+import time
+
+import aiosqlite
+
+from common import data, open_temp_db, seed_profiles, report
+
+PROFILES = 2000
+CALLS = 2000
+
+
+async def get_profile_per_call(path: str, user_id: int):
+    # Поведение до пула: новое соединение (и новый поток) на каждый запрос
+    async with aiosqlite.connect(path) as db:
+        async with db.execute(
+            'SELECT name, age, gender, interests, institute, description, photos, verified, video_file_id '
+            'FROM profiles WHERE user_id = ?', (user_id,)
+        ) as cursor:
+            return await cursor.fetchone()
+
+
+async def add_like_per_call(path: str, user_id: int, target_id: int):
+    async with aiosqlite.connect(path) as db:
+        await db.execute('INSERT OR IGNORE INTO likes (user_id, liked_user_id) VALUES (?, ?)', (user_id, target_id))
+        await db.commit()
+
+
+async def measure(fn, args_list):
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        await fn(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def main():
+    path = await open_temp_db()
+    await seed_profiles(PROFILES)
+    rnd = random.Random(1)
+    ids = [(rnd.randint(1, PROFILES),) for _ in range(CALLS)]
+    pairs = [(rnd.randint(1, PROFILES), rnd.randint(1, PROFILES)) for _ in range(CALLS)]
+
+    report("get_profile (соединение на вызов)", await measure(lambda uid: get_profile_per_call(path, uid), ids))
+    report("get_profile (пул)", await measure(data.get_profile, ids))
+    report("add_like (соединение на вызов)", await measure(lambda u, t: add_like_per_call(path, u, t), pairs))
+    pairs = [(u + PROFILES, t) for u, t in pairs]
+    report("add_like (пул)", await measure(data.add_like, pairs))
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
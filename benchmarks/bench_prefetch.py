@@ -0,0 +1,66 @@
+"""Свайп в просмотре: холодный выбор следующей анкеты против предвыборки.
+
+Без предвыборки на свайпе последовательно выполняются get_next_profile,
+get_profile, сборка карточки и record_profile_view. С предвыборкой всё,
+кроме записи просмотра, делается в фоне, пока пользователь смотрит
+текущую анкету (здесь — THINK_S секунд). Меряется только путь свайпа до
+отправки сообщения. Анкеты из пула новые, так что в холодном пути
+get_profile идёт в БД.
+"""
+import asyncio
+import random
+import time
+
+from common import data, open_temp_db, seed_profiles, seed_reactions, report
+import cards
+import matching
+import prefetch
+
+SIZE = 10_000
+STEPS = 300
+THINK_S = 0.005
+
+
+async def swipe(user_id: int, state_data: dict, use_prefetch: bool):
+    if use_prefetch:
+        ready = await prefetch.take(user_id, state_data)
+        if ready:
+            state_data.update(ready.state_data)
+            await data.record_profile_view(user_id, ready.profile_id)
+            return ready.card
+    next_id, state_data, is_revisit = await matching.get_next_profile(user_id, state_data)
+    profile = await data.get_profile(next_id)
+    await data.record_profile_view(user_id, next_id)
+    return cards.get_card(next_id, profile, 'browse_revisit' if is_revisit else 'browse')
+
+
+async def run(use_prefetch: bool):
+    users = random.Random(3).sample(range(1, SIZE + 1), STEPS // 30)
+    samples = []
+    for user_id in users:
+        state_data = {'pools_loaded': False}
+        await matching.get_next_profile(user_id, state_data)
+        for _ in range(30):
+            start = time.perf_counter()
+            await swipe(user_id, state_data, use_prefetch)
+            samples.append(time.perf_counter() - start)
+            if use_prefetch:
+                prefetch.schedule(user_id, dict(state_data))
+            await asyncio.sleep(THINK_S)
+    return samples
+
+
+async def main():
+    await open_temp_db('prefetch.db')
+    await seed_profiles(SIZE)
+    await seed_reactions(SIZE, 20)
+    data.swipes.start()
+    report("холодный выбор", await run(False))
+    report("с предвыборкой", await run(True))
+    print(f"  {prefetch.stats()}")
+    await data.swipes.close()
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+"""get_profile с кэшем анкет против чтения из БД на каждый вызов.
+
+Нагрузка похожа на реальную: один лайк читает обе анкеты трижды
+(handle_reaction, notify_mutual_like, create_meet_after_like), меню —
+проверка has_profile, часть запросов от незарегистрированных пользователей.
+"""
+import asyncio
+import random
+import time
+
+from common import data, open_temp_db, seed_profiles, report
+
+PROFILES = 2000
+ACTIVE_USERS = 200
+CALLS = 5000
+
+
+def workload(seed: int = 5):
+    rnd = random.Random(seed)
+    active = rnd.sample(range(1, PROFILES + 1), ACTIVE_USERS)
+    calls = []
+    while len(calls) < CALLS:
+        user, target = rnd.choice(active), rnd.randint(1, PROFILES)
+        if rnd.random() < 0.5:
+            calls.extend([user, target] * 3)   # лайк
+        elif rnd.random() < 0.8:
+            calls.append(user)                 # меню
+        else:
+            calls.append(PROFILES + rnd.randint(1, 500))  # ещё без анкеты
+    return calls[:CALLS]
+
+
+async def measure(fn, ids):
+    samples = []
+    for uid in ids:
+        start = time.perf_counter()
+        await fn(uid)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def main():
+    await open_temp_db()
+    await seed_profiles(PROFILES)
+    ids = workload()
+    report("get_profile (без кэша)", await measure(data._load_profile, ids))
+    report("get_profile (кэш)", await measure(data.get_profile, ids))
+    print(f"Кэш: {data.profile_cache.stats()}")
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""Построение пулов анкет: get_all_profiles + фильтр в Python против индекса кандидатов.
+
+Старый вариант на каждый старт просмотра читал все анкеты целиком (с
+описанием и JSON фото) только ради поля gender. Новый берёт карты по полу
+из matching.candidates и вычитает оценки пользователя (seen_sets).
+"""
+import asyncio
+import random
+import time
+
+from common import data, open_temp_db, seed_profiles, seed_reactions, report
+import compat
+import matching
+
+SIZES = (2_000, 10_000)
+CALLS = 50
+
+
+async def pools_full_read(user_id: int):
+    # Поведение до индекса: все анкеты из БД, фильтр по полу циклом
+    all_profiles = await data.get_all_profiles()
+    current_user = await data.get_profile(user_id)
+    allowed_genders = compat.INTEREST_GENDERS.get(current_user['interests'], ())
+    ratings = await data.get_ratings(user_id)
+    liked, disliked = ratings['liked'], ratings['disliked']
+    new_ids, disliked_ids, liked_ids = [], [], []
+    for uid, profile in all_profiles.items():
+        if uid == user_id or profile.get('gender') not in allowed_genders:
+            continue
+        if not compat.is_compatible(current_user['gender'], profile.get('interests')):
+            continue
+        if uid in liked:
+            liked_ids.append(uid)
+        elif uid in disliked:
+            disliked_ids.append(uid)
+        else:
+            new_ids.append(uid)
+    return new_ids, disliked_ids, liked_ids
+
+
+async def measure(fn, ids):
+    samples = []
+    for uid in ids:
+        start = time.perf_counter()
+        await fn(uid)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def main():
+    for size in SIZES:
+        await open_temp_db(f'pools{size}.db')
+        await seed_profiles(size)
+        await seed_reactions(size, 50)
+        matching.candidates = matching.CandidateIndex()
+        ids = random.Random(2).sample(range(1, size + 1), CALLS)
+        for uid in ids[:5]:
+            old = await pools_full_read(uid)
+            new = await matching.get_profile_pools(uid)
+            assert [sorted(p) for p in old] == [sorted(p) for p in new], uid
+        print(f"Анкет: {size}")
+        report("  get_profile_pools (все анкеты)", await measure(pools_full_read, ids))
+        report("  get_profile_pools (индекс)", await measure(matching.get_profile_pools, ids))
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+"""Колоночное хранилище анкет (profile_store.py): память и время против словарей и запросов.
+
+Для 10k и 100k анкет (пятая часть верифицирована, у части есть оценки):
+- память: get_all_profiles (словарь на анкету) против колонок ProfileStore
+  (tracemalloc: всё, что выделено при загрузке и осталось после неё);
+- пулы get_profile_pools: CandidateIndex (POOL_SOURCE = 'index') против масок
+  по колонкам ('columns'), без фильтров и с фильтрами просмотра; перед
+  замерами пулы обоих вариантов сверяются;
+- статистика для /stats: пол одним запросом и рейтинг запросом на каждого
+  (как без ENABLED) против counts/labels/values по колонкам.
+
+    python benchmarks/bench_profile_store.py
+"""
+import asyncio
+import random
+import time
+import tracemalloc
+
+from common import data, open_temp_db, seed_profiles, seed_reactions, report
+from bench_candidate_sql import measure
+import matching
+import profile_store
+from rating_system import get_user_rating
+
+SIZES = (10_000, 100_000)
+REACTIONS_PER_USER = 20
+VERIFIED_SHARE = 0.2
+RATED_SHARE = 0.5
+CALLS = 30
+FILTERS = {'age_min': 19, 'age_max': 23, 'institutes': ['ИИТ', 'ИКБ'], 'verified_only': False}
+
+
+async def seed_extra(size: int, seed: int = 5):
+    rnd = random.Random(seed)
+    verified = rnd.sample(range(1, size + 1), int(size * VERIFIED_SHARE))
+    rated = [(rnd.uniform(1, 5) * 3, 3.0, uid) for uid in rnd.sample(range(1, size + 1), int(size * RATED_SHARE))]
+    async with data.pool.write() as db:
+        await db.executemany('UPDATE profiles SET verified = 1 WHERE user_id = ?', [(uid,) for uid in verified])
+        await db.executemany('UPDATE profiles SET rating_sum = ?, rating_weight = ? WHERE user_id = ?', rated)
+
+
+async def allocated(load) -> tuple:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = await load()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+async def stats_queries():
+    async with data.pool.read() as db:
+        async with db.execute('SELECT user_id, gender FROM profiles') as cursor:
+            genders = {row[0]: row[1] for row in await cursor.fetchall()}
+    return {uid: await get_user_rating(uid) for uid in genders}, genders
+
+
+async def stats_columns():
+    store = profile_store.profiles
+    await store.refresh()
+    return store.values('rating'), store.labels('gender'), store.counts('gender'), store.counts('institute')
+
+
+async def main():
+    for size in SIZES:
+        await open_temp_db(f'store{size}.db')
+        await seed_profiles(size)
+        await seed_reactions(size, REACTIONS_PER_USER)
+        await seed_extra(size)
+        matching.candidates = matching.CandidateIndex()
+        data.on_profile_change(matching.candidates.mark_dirty)
+        profile_store.profiles = profile_store.ProfileStore()
+        data.on_profile_change(profile_store.profiles.mark_dirty)
+
+        all_profiles, dict_bytes, dict_time = await allocated(data.get_all_profiles)
+        del all_profiles
+
+        async def load_store():
+            store = profile_store.ProfileStore()
+            await store.refresh()
+            return store
+        store, store_bytes, store_time = await allocated(load_store)
+        print(f"Анкет: {size}")
+        print(f"  get_all_profiles: {dict_bytes / size:7.0f} байт на анкету, загрузка {dict_time * 1000:.0f} мс")
+        print(f"  ProfileStore:     {store_bytes / size:7.0f} байт на анкету (колонки {store.nbytes() / size:.0f}), "
+              f"загрузка {store_time * 1000:.0f} мс")
+
+        ids = random.Random(4).sample(range(1, size + 1), CALLS)
+        for filters in (None, FILTERS):
+            for uid in ids[:3]:
+                await data.save_browse_filters(uid, **(filters or {}))
+                matching.POOL_SOURCE = 'index'
+                expected = [sorted(p) for p in await matching.get_profile_pools(uid)]
+                matching.POOL_SOURCE = 'columns'
+                assert [sorted(p) for p in await matching.get_profile_pools(uid)] == expected, uid
+            for uid in ids:
+                await data.save_browse_filters(uid, **(filters or {}))
+            label = 'с фильтрами' if filters else 'без фильтров'
+            for source in ('index', 'columns'):
+                matching.POOL_SOURCE = source
+                report(f"  get_profile_pools, {source}, {label}", await measure(matching.get_profile_pools, ids))
+        matching.POOL_SOURCE = 'index'
+
+        ratings, _ = await stats_queries()
+        assert all(abs(ratings[uid] - rating) < 1e-3 for uid, rating in (await stats_columns())[0].items())
+        report("  /stats: рейтинг запросом на каждого", await measure(lambda _: stats_queries(), range(3)))
+        report("  /stats: колонки", await measure(lambda _: stats_columns(), range(10)))
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""Ранжирование пула новых анкет (ranking.py) на 50k кандидатов.
+
+Печатает время оценки (ranking.score: поиск строк и один проход NumPy),
+ranking.order (плюс сортировка id и упорядочивание первых RANK_HEAD мест) и
+полного ranking.rank с чтением анкеты смотрящего и его лайков — для пула
+списком Python и массивом NumPy (так его отдают пулы 'index' и 'columns'),
+всего matching._set_new_pool — от пула до упакованной очереди в FSM, — а
+также однократную загрузку таблицы признаков. Проверяет, что голова очереди
+совпадает с полной сортировкой по оценке.
+"""
+import asyncio
+import datetime
+import random
+import time
+
+import numpy as np
+
+from common import data, open_temp_db, seed_profiles, report
+import matching
+import ranking
+
+SIZE = 50_000
+CALLS = 200
+
+
+async def seed_features(count: int, seed: int = 5):
+    rnd = random.Random(seed)
+    today = datetime.date.today()
+    ratings = [(rnd.uniform(0, 40), rnd.uniform(0, 10), rnd.random() < 0.2, uid)
+               for uid in range(1, count + 1) if rnd.random() < 0.7]
+    streaks = [(uid, (today - datetime.timedelta(days=rnd.randint(0, 60))).isoformat())
+               for uid in range(1, count + 1) if rnd.random() < 0.8]
+    likes = [(rnd.randint(1, count), uid) for uid in range(1, 200) for _ in range(30)]
+    async with data.pool.write() as db:
+        await db.executemany('UPDATE profiles SET rating_sum = ?, rating_weight = ?, verified = ? WHERE user_id = ?', ratings)
+        await db.executemany('INSERT INTO user_streaks (user_id, current_streak, longest_streak, last_active_date) '
+                             'VALUES (?, 1, 1, ?)', streaks)
+        await db.executemany('INSERT OR IGNORE INTO likes (user_id, liked_user_id) VALUES (?, ?)', likes)
+
+
+async def main():
+    await open_temp_db('ranking.db')
+    await seed_profiles(SIZE)
+    await seed_features(SIZE)
+
+    start = time.perf_counter()
+    await ranking.features.refresh()
+    print(f"Загрузка признаков {len(ranking.features)} анкет: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    candidates = list(range(1, SIZE + 1))
+    random.Random(1).shuffle(candidates)
+    likers = await data.get_likers(1)
+    today = float(datetime.date.today().toordinal())
+    ids = np.sort(np.array(candidates, dtype=np.int64))
+    liked_me = np.array(sorted(likers), dtype=np.int64)
+    samples = []
+    for seed in range(CALLS):
+        start = time.perf_counter()
+        ranking.score(ranking.features, ids, 0, liked_me, today, np.random.default_rng(seed))
+        samples.append(time.perf_counter() - start)
+    report(f"score, {SIZE} кандидатов", samples)
+
+    pool = np.array(candidates, dtype=np.int64)
+    head = ranking.RANK_HEAD
+    scores = ranking.score(ranking.features, ids, 0, liked_me, today, np.random.default_rng(0))
+    queue = ranking.order(ranking.features, pool, 0, likers, today, 0)
+    # Равные оценки (float32) могут идти в любом порядке — сравниваются оценки, а не id
+    assert (scores[np.searchsorted(ids, queue[:head])] == -np.sort(-scores)[:head]).all()
+    assert sorted(queue.tolist()) == ids.tolist()
+
+    samples = []
+    for seed in range(CALLS):
+        start = time.perf_counter()
+        ranking.order(ranking.features, pool, 0, likers, today, seed)
+        samples.append(time.perf_counter() - start)
+    report(f"order, {SIZE} кандидатов", samples)
+
+    for label, source in (("список", candidates), ("np.ndarray", pool)):
+        samples = []
+        for user_id in range(1, CALLS + 1):
+            start = time.perf_counter()
+            await ranking.rank(user_id, source, user_id)
+            samples.append(time.perf_counter() - start)
+        report(f"rank, {SIZE} кандидатов, {label}", samples)
+
+    # Первый вызов загружает счётчики показов и заводит стартовые значения всему пулу
+    await matching._set_new_pool(CALLS + 1, {}, pool)
+    samples = []
+    for user_id in range(1, CALLS + 1):
+        start = time.perf_counter()
+        await matching._set_new_pool(user_id, {}, pool)
+        samples.append(time.perf_counter() - start)
+    report(f"_set_new_pool, {SIZE} кандидатов", samples)
+
+    queue = (await ranking.rank(1, pool, 0)).tolist()
+    head = set(queue[:100])
+    print(f"Лайкнувших смотрящего в первой сотне: {len(head & likers)} из {len(likers)}")
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
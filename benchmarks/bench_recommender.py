@@ -0,0 +1,56 @@
+"""Офлайн-джоб рекомендаций (recommender.build) на 1M и 3M лайков.
+
+Пользователи разбиты на сообщества по COMMUNITY человек; LOCAL_SHARE лайков
+каждый ставит внутри своего сообщества, остальные — случайно. Печатает
+время прогона, пиковую память NumPy/Python (tracemalloc) и долю
+рекомендаций, попавших в сообщество пользователя.
+
+    python benchmarks/bench_recommender.py
+"""
+import asyncio
+import random
+import time
+
+from common import data, open_temp_db
+import recommender
+
+SIZES = ((20_000, 50), (60_000, 50))  # пользователей, лайков на пользователя
+COMMUNITY = 200
+LOCAL_SHARE = 0.6
+
+
+async def seed_likes(users: int, per_user: int, seed: int = 11):
+    rnd = random.Random(seed)
+    batch = []
+    async with data.pool.write() as db:
+        for uid in range(users):
+            base = uid - uid % COMMUNITY
+            local = int(per_user * LOCAL_SHARE)
+            targets = {base + rnd.randrange(COMMUNITY) for _ in range(local)}
+            targets.update(rnd.randrange(users) for _ in range(per_user - local))
+            targets.discard(uid)
+            batch.extend((uid + 1, t + 1) for t in targets)
+            if len(batch) > 100_000:
+                await db.executemany('INSERT OR IGNORE INTO likes (user_id, liked_user_id) VALUES (?, ?)', batch)
+                batch.clear()
+        await db.executemany('INSERT OR IGNORE INTO likes (user_id, liked_user_id) VALUES (?, ?)', batch)
+
+
+async def main():
+    for users, per_user in SIZES:
+        await open_temp_db(f'recommender{users}.db')
+        start = time.perf_counter()
+        await seed_likes(users, per_user)
+        print(f"{users} пользователей: лайки записаны за {time.perf_counter() - start:.0f} с")
+        stats = await recommender.build(data.pool)
+        print(f"  {stats}")
+        async with data.pool.read() as db:
+            async with db.execute('SELECT user_id, target_id FROM recommendations') as cursor:
+                rows = await cursor.fetchall()
+        local = sum((u - 1) // COMMUNITY == (t - 1) // COMMUNITY for u, t in rows)
+        print(f"  рекомендаций из своего сообщества: {local / max(len(rows), 1):.0%}")
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""Журнал взаимодействий и replay.py: сравнение движков подбора на записанном трафике.
+
+1. Симуляция трафика с включённым журналом: у каждой анкеты скрытая
+   привлекательность, у каждого пользователя — разборчивость; сессии по
+   SESSION_SWIPES анкет через matching.get_next_profile.
+2. replay.py по этому журналу для нескольких движков. 'current' прогоняется
+   дважды с одним зерном — метрики (кроме времени) должны совпасть.
+
+    python benchmarks/bench_replay.py
+"""
+import asyncio
+import random
+
+from common import data, open_temp_db, seed_profiles
+from bench_ranking import seed_features
+import matching
+import replay
+
+SIZE = 2000
+SESSIONS = 400
+SESSION_SWIPES = 25
+ENGINES = ('current', 'random', 'no_exposure', 'sql')
+SEED = 1
+
+
+async def record_traffic(seed: int):
+    rnd = random.Random(seed)
+    random.seed(seed)
+    appeal = {uid: rnd.betavariate(2, 5) for uid in range(1, SIZE + 1)}
+    pickiness = {uid: rnd.uniform(0.5, 1.5) for uid in range(1, SIZE + 1)}
+    for _ in range(SESSIONS):
+        viewer, state = rnd.randint(1, SIZE), {}
+        for _ in range(SESSION_SWIPES):
+            profile_id, state, _ = await matching.get_next_profile(viewer, state)
+            if profile_id is None:
+                break
+            await data.record_profile_view(viewer, profile_id)
+            if rnd.random() < min(appeal[profile_id] / pickiness[viewer], 1.0):
+                await data.add_like(viewer, profile_id, event='superlike' if rnd.random() < 0.05 else 'like')
+            else:
+                await data.add_dislike(viewer, profile_id)
+    await data.swipes.flush()
+
+
+async def main():
+    source = await open_temp_db('replay_source.db')
+    await seed_profiles(SIZE)
+    await seed_features(SIZE)
+    data.swipes.start()
+    await record_traffic(SEED)
+    await data.swipes.close()
+
+    events = replay.load_log(source)
+    model = replay.LikeModel(events)
+    print(f"Журнал: {len(events)} событий, доля лайков {model.base:.1%}")
+    print(f"  {'журнал':<12} {replay.log_stats(events)}")
+    results = {}
+    for name in ENGINES + ('current',):
+        engine, settings = replay.resolve(name)
+        stats = await replay.replay(engine, settings, source, events, model, SEED)
+        if name in results:
+            same = {k: v for k, v in stats.items() if not k.startswith('cpu')} == \
+                   {k: v for k, v in results[name].items() if not k.startswith('cpu')}
+            print(f"  повтор {name} с тем же зерном: {'совпал' if same else 'НЕ совпал'}")
+            continue
+        results[name] = stats
+        print(f"  {name:<12} {stats}")
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
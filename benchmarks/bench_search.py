@@ -0,0 +1,105 @@
+"""Поиск по описанию анкет (FTS5, data.search_profiles): время запроса при 1k, 10k и 100k анкет.
+
+Описания собираются из 3–8 слов из небольшого словаря, так что каждое слово
+есть примерно в пятой части анкет — худший случай для ранжирования (см.
+data.SEARCH_WINDOW). Запросы — 1–3 слова, в том числе в другой форме
+(«музыку» при «музыка» в описании). Для
+сравнения — тот же поиск перебором описаний из get_all_profiles в Python.
+Перед замерами проверяет, что триггеры держат индекс в актуальном виде:
+новое описание находится сразу после save_profile, старое — больше нет,
+удалённая анкета пропадает из результатов.
+
+    python benchmarks/bench_search.py
+"""
+import asyncio
+import random
+import time
+
+from common import GENDERS, INTERESTS, data, open_temp_db, seed_profiles, report
+from bench_candidate_sql import measure
+import compat
+
+SIZES = (1_000, 10_000, 100_000)
+WORDS = ("музыка", "кино", "походы", "книги", "спорт", "бег", "йога", "кофе", "путешествия", "аниме",
+         "программирование", "настолки", "театр", "фотография", "танцы", "гитара", "горы", "море",
+         "кошки", "собаки", "готовка", "рисование", "шахматы", "волейбол", "сериалы", "джаз", "рок")
+QUERIES = ("музыку", "кино сериалы", "горы походы море", "программирование шахматы", "джаз гитара", "йога")
+CALLS = 30
+
+
+async def seed_descriptions(size: int, seed: int = 3):
+    rnd = random.Random(seed)
+    rows = [(" ".join(rnd.sample(WORDS, rnd.randint(3, 8))).capitalize(), uid) for uid in range(1, size + 1)]
+    async with data.pool.write() as db:
+        await db.executemany('UPDATE profiles SET description = ? WHERE user_id = ?', rows)
+
+
+async def classes_of(user_id: int):
+    profile = await data.get_profile(user_id)
+    return compat.MUTUAL[compat.class_of(profile['gender'], profile['interests'])]
+
+
+async def python_search(user_id: int, text: str):
+    """Перебор: все анкеты, совпадения по префиксам слов, больше совпадений — выше."""
+    classes = set(await classes_of(user_id))
+    stems = [word[:-1] if len(word) > 4 else word for word in text.lower().split()]
+    scored = []
+    for uid, profile in (await data.get_all_profiles()).items():
+        if uid == user_id or compat.class_of(profile['gender'], profile['interests']) not in classes:
+            continue
+        words = (profile['description'] or '').lower().split()
+        hits = sum(any(word.startswith(stem) for word in words) for stem in stems)
+        if hits:
+            scored.append((-hits, uid))
+    return [uid for _, uid in sorted(scored)[:data.SEARCH_LIMIT]]
+
+
+async def check_triggers(size: int):
+    user_id = size + 1
+    await data.save_profile(user_id, "Тест", 20, GENDERS[0], INTERESTS[2], data.INSTITUTES[0],
+                            "Люблю керлинг", ["photo"])
+    mutual = compat.MUTUAL[compat.class_of(GENDERS[0], INTERESTS[2])]
+    async with data.pool.read() as db:
+        async with db.execute(f'SELECT user_id FROM profiles WHERE compat_class IN ({",".join(map(str, mutual))}) '
+                              'AND user_id != ? LIMIT 1', (user_id,)) as cursor:
+            viewer = (await cursor.fetchone())[0]
+    classes = await classes_of(viewer)
+    assert await data.search_profiles(viewer, "керлинг", classes) == [user_id]
+    await data.save_profile(user_id, "Тест", 20, GENDERS[0], INTERESTS[2], data.INSTITUTES[0],
+                            "Люблю бадминтон", ["photo"])
+    assert await data.search_profiles(viewer, "керлинг", classes) == []
+    assert await data.search_profiles(viewer, "бадминтон", classes) == [user_id]
+    await data.delete_profile(user_id)
+    assert await data.search_profiles(viewer, "бадминтон", classes) == []
+    async with data.pool.write() as db:
+        await db.execute("INSERT INTO profiles_fts (profiles_fts, rank) VALUES ('integrity-check', 1)")
+
+
+async def main():
+    for size in SIZES:
+        await open_temp_db(f'search{size}.db')
+        await seed_profiles(size)
+        await seed_descriptions(size)
+        await check_triggers(size)
+
+        rnd = random.Random(4)
+        ids = rnd.sample(range(1, size + 1), CALLS)
+        queries = {uid: rnd.choice(QUERIES) for uid in ids}
+
+        async def fts(uid):
+            return await data.search_profiles(uid, queries[uid], await classes_of(uid))
+
+        async def brute(uid):
+            return await python_search(uid, queries[uid])
+
+        start = time.perf_counter()
+        found = [len(await fts(uid)) for uid in ids]
+        print(f"Анкет: {size}, найдено в среднем {sum(found) / len(found):.0f} "
+              f"(не больше SEARCH_LIMIT = {data.SEARCH_LIMIT}), прогрев {time.perf_counter() - start:.2f} с")
+        report("  перебор описаний в Python", await measure(brute, ids[:5]))
+        report("  FTS5 + bm25", await measure(fts, ids))
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
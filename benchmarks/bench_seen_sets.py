@@ -0,0 +1,91 @@
+"""Битовые карты против множеств Python для «что пользователь уже видел».
+
+Для 10k и 100k анкет сравнивает:
+- память оценок одного пользователя: set из int против int-карты и сжатого
+  BLOB из seen_bitmaps;
+- загрузку при старте просмотра: set из строк fetchall (как get_ratings)
+  против распаковки BLOB;
+- разбиение анкет на пулы new/disliked/liked, как в get_profile_pools:
+  цикл по анкетам с проверкой по set против & / & ~ над картами (отдельно
+  сама операция над картами и она же со списками id на выходе).
+"""
+import random
+import sys
+import time
+
+from common import percentiles
+from seen_sets import bits_from_indices, iter_indices, pack, unpack
+
+SIZES = (10_000, 100_000)
+SEEN_SHARE = (0.01, 0.1, 0.5)   # доля анкет, которые пользователь уже оценил
+REPEATS = 20
+
+
+def set_bytes(values: set) -> int:
+    return sys.getsizeof(values) + sum(sys.getsizeof(v) for v in values)
+
+
+def pools_with_sets(profiles, liked: set, disliked: set):
+    new_ids, disliked_ids, liked_ids = [], [], []
+    for uid in profiles:
+        if uid in liked:
+            liked_ids.append(uid)
+        elif uid in disliked:
+            disliked_ids.append(uid)
+        else:
+            new_ids.append(uid)
+    return new_ids, disliked_ids, liked_ids
+
+
+def pools_with_bitmaps(allowed: int, liked: int, disliked: int):
+    # Плотные номера здесь совпадают с id, поэтому обратное отображение не нужно
+    return (iter_indices(allowed & ~(liked | disliked)),
+            iter_indices(allowed & disliked & ~liked),
+            iter_indices(allowed & liked))
+
+
+def sets_from_rows(liked_rows, disliked_rows):
+    return {row[0] for row in liked_rows}, {row[0] for row in disliked_rows}
+
+
+def bitmaps_from_blobs(liked_blob, disliked_blob):
+    return unpack(liked_blob), unpack(disliked_blob)
+
+
+def timed(fn, *args):
+    samples = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)[0]
+
+
+def main():
+    rnd = random.Random(11)
+    for size in SIZES:
+        profiles = [uid for uid in range(1, size + 1) if rnd.random() < 0.5]  # подходящие по полу
+        allowed = bits_from_indices(profiles)
+        print(f"\nАнкет: {size}")
+        for share in SEEN_SHARE:
+            seen = rnd.sample(range(1, size + 1), int(size * share))
+            liked = set(seen[:len(seen) * 2 // 5])
+            disliked = set(seen[len(seen) * 2 // 5:])
+            liked_bits, disliked_bits = bits_from_indices(liked), bits_from_indices(disliked)
+            assert [sorted(p) for p in pools_with_sets(profiles, liked, disliked)] == \
+                   [sorted(p) for p in pools_with_bitmaps(allowed, liked_bits, disliked_bits)]
+
+            memory_set = set_bytes(liked) + set_bytes(disliked)
+            memory_bits = sys.getsizeof(liked_bits) + sys.getsizeof(disliked_bits)
+            blobs = pack(liked_bits), pack(disliked_bits)
+            rows = [(uid,) for uid in liked], [(uid,) for uid in disliked]
+            print(f"  оценено {share:>4.0%} ({len(seen):>6}): память set {memory_set / 1024:7.1f} KB, "
+                  f"карта {memory_bits / 1024:5.1f} KB, BLOB {sum(map(len, blobs)) / 1024:5.1f} KB")
+            print(f"{'':<24}загрузка: set {timed(sets_from_rows, *rows):6.2f} ms, "
+                  f"BLOB {timed(bitmaps_from_blobs, *blobs):6.2f} ms")
+            print(f"{'':<24}пулы: set {timed(pools_with_sets, profiles, liked, disliked):6.2f} ms, "
+                  f"& ~ {timed(lambda: allowed & ~(liked_bits | disliked_bits)):6.3f} ms, "
+                  f"& ~ со списками id {timed(pools_with_bitmaps, allowed, liked_bits, disliked_bits):6.2f} ms")
+
+if __name__ == "__main__":
+    main()
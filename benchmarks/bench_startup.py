@@ -0,0 +1,48 @@
+"""Время старта init_db на базе со 100k анкет: старые проверки PRAGMA table_info
+на каждом запуске против версионных миграций (одна проверка user_version)."""
+import asyncio
+import time
+
+from common import data, temp_db_path, seed_profiles, report
+import migrations
+
+PROFILES = 100_000
+RUNS = 20
+
+
+async def legacy_boot():
+    # То, что старый init_db делал на каждом запуске: CREATE IF NOT EXISTS + пробы колонок
+    async with data.pool.write() as db:
+        await migrations._migration_1_baseline(db)
+
+
+async def main():
+    # База «как до миграций»: схема старого init_db и user_version = 0. Полная
+    # схема не годится — поздние миграции добавляют колонки в profiles
+    data.pool.path = temp_db_path()
+    await data.pool.open()
+    await legacy_boot()
+    await seed_profiles(PROFILES, compat_classes=False)
+
+    samples = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        await legacy_boot()
+        samples.append(time.perf_counter() - start)
+    report("старый init_db (каждый запуск)", samples)
+
+    start = time.perf_counter()
+    await data.init_db()
+    report("первый запуск: миграция v0 -> v1", [time.perf_counter() - start])
+
+    samples = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        await data.init_db()
+        samples.append(time.perf_counter() - start)
+    report("повторный запуск (только user_version)", samples)
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
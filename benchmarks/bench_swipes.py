@@ -0,0 +1,127 @@
+"""Пропускная способность свайпов: коммит на каждый лайк/просмотр против пакетной записи.
+
+Имитирует USERS одновременно листающих анкеты пользователей: каждый свайп —
+record_profile_view + add_like/add_dislike. Печатает свайпы/с и коммиты/с
+(по счётчику writes пула) для прямой записи и для буфера data.swipes.
+Затем проверяет, что строка, которую БД отвергает, не держит очередь:
+через write_behind.MAX_ATTEMPTS сбросов она откладывается, а свайпы,
+пришедшие после неё, записываются, и что лайки удалённого пользователя
+из неудачной пачки не возвращаются в очередь после delete_profile.
+"""
+import asyncio
+import random
+import time
+
+from common import data, open_temp_db, seed_profiles, report
+import write_behind
+
+PROFILES = 2000
+USERS = 50
+SWIPES_PER_USER = 100
+
+
+async def swipe_direct(user_id: int, target_id: int, like: bool):
+    # Поведение до буфера: отдельная транзакция писателя на каждое действие
+    async with data.pool.write() as db:
+        await db.execute(
+            'INSERT OR REPLACE INTO profile_views (viewer_id, viewed_id, viewed_at) VALUES (?, ?, CURRENT_TIMESTAMP)',
+            (user_id, target_id)
+        )
+    async with data.pool.write() as db:
+        if like:
+            await db.execute('INSERT OR IGNORE INTO likes (user_id, liked_user_id) VALUES (?, ?)', (user_id, target_id))
+        else:
+            await db.execute('INSERT OR IGNORE INTO dislikes (user_id, disliked_user_id) VALUES (?, ?)', (user_id, target_id))
+
+
+async def swipe_buffered(user_id: int, target_id: int, like: bool):
+    await data.record_profile_view(user_id, target_id)
+    if like:
+        await data.add_like(user_id, target_id)
+    else:
+        await data.add_dislike(user_id, target_id)
+
+
+async def user_session(swipe, user_id: int, rnd: random.Random, samples):
+    for target in rnd.sample(range(1, PROFILES + 1), SWIPES_PER_USER):
+        start = time.perf_counter()
+        await swipe(user_id, target, rnd.random() < 0.4)
+        samples.append(time.perf_counter() - start)
+
+
+async def run(label: str, swipe, user_offset: int):
+    rnd = random.Random(3)
+    samples = []
+    writes_before = data.pool.stats()['writes']
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        user_session(swipe, user_offset + uid, random.Random(rnd.random()), samples)
+        for uid in range(1, USERS + 1)
+    ])
+    await data.swipes.flush()
+    elapsed = time.perf_counter() - start
+    commits = data.pool.stats()['writes'] - writes_before
+    report(label, samples)
+    print(f"{'':<40} свайпов/с={len(samples) / elapsed:9.0f}  коммитов/с={commits / elapsed:7.0f}  (коммитов: {commits})")
+
+
+async def check_poison_row():
+    async with data.pool.write() as db:
+        await db.execute('CREATE TABLE IF NOT EXISTS poison_check (id INTEGER PRIMARY KEY, value INTEGER CHECK (value >= 0))')
+    data.swipes.register('poison_check', 'INSERT INTO poison_check (id, value) VALUES (?, ?)')
+    data.swipes.start()
+    await data.swipes.add('poison_check', 1, (1, -1))
+    user_id = PROFILES * 3  # лайков у него ещё нет
+    for target in range(1, 51):
+        await data.swipes.add('likes', (user_id, target), (user_id, target, '2024-01-01 00:00:00'))
+    start = time.perf_counter()
+    while data.swipes.stats()['pending']:
+        assert time.perf_counter() - start < 10, data.swipes.stats()
+        await asyncio.sleep(0.01)
+    await data.swipes.flush()  # дождаться пачки, которая ещё пишется
+    async with data.pool.read() as db:
+        async with db.execute('SELECT COUNT(*) FROM likes WHERE user_id = ?', (user_id,)) as cursor:
+            assert (await cursor.fetchone())[0] == 50
+    (kind, key, row, error), = data.swipes.parked()
+    assert (kind, key) == ('poison_check', 1), data.swipes.parked()
+    print(f"Отвергнутая строка отложена за {(time.perf_counter() - start) * 1000:.0f} мс "
+          f"(MAX_ATTEMPTS = {write_behind.MAX_ATTEMPTS}): {error!r}")
+    await data.swipes.close()
+
+
+async def check_discard_inflight():
+    # Фоновый сброс падает на таблице, которой нет, пока удаляется профиль
+    data.swipes.register('broken', 'INSERT INTO no_such_table (id) VALUES (?)')
+    data.swipes.start()
+    user_id = PROFILES * 3 + 1
+    for target in range(1, 21):
+        await data.swipes.add('likes', (user_id, target), (user_id, target, '2024-01-01 00:00:00'))
+    await data.swipes.add('broken', 1, (1,))
+    while data.swipes.stats()['pending']:
+        await asyncio.sleep(0)
+    assert data.swipes.has('likes', (user_id, 1))  # строки в пишущейся пачке
+    await data.delete_profile(user_id)
+    assert not data.swipes.has('likes', (user_id, 1))
+    data.swipes.discard('broken', lambda key: True)
+    await data.swipes.close()
+    async with data.pool.read() as db:
+        async with db.execute('SELECT COUNT(*) FROM likes WHERE user_id = ?', (user_id,)) as cursor:
+            assert (await cursor.fetchone())[0] == 0
+    print("Лайки удалённого пользователя из неудачной пачки не вернулись в очередь")
+
+
+async def main():
+    await open_temp_db()
+    await seed_profiles(PROFILES)
+    await run("свайп (коммит на действие)", swipe_direct, 0)
+    data.swipes.start()
+    await run("свайп (пакетная запись)", swipe_buffered, PROFILES)
+    await data.swipes.close()
+    print(f"Буфер: {data.swipes.stats()}")
+    await check_poison_row()
+    await check_discard_inflight()
+    await data.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,167 @@
+"""Регрессионная проверка планов запросов data.py.
+
+Наполняет временную БД, вызывает каждую корутину из data.py, перехватывает
+все выполненные SQL-запросы и прогоняет их через EXPLAIN QUERY PLAN.
+Завершается с кодом 1, если какой-то запрос читает таблицу целиком
+(SCAN <таблица>, в том числе полный обход индекса) или если для новой
+функции data.py не задан вызов.
+
+    python benchmarks/check_query_plans.py
+"""
+import asyncio
+import datetime
+import inspect
+import re
+import sqlite3
+import sys
+
+from common import data, open_temp_db, seed_profiles, seed_reactions
+import activity
+import compat
+import ranking
+
+PROFILES = 2000
+
+# Функции, которым по смыслу нужна вся таблица
+FULL_SCAN_ALLOWED = {'get_all_profiles', 'get_all_usernames', 'get_user_stats', 'reset_all_points', 'init_db'}
+
+# Функции, которые читают первые N строк индекса по порядку (ORDER BY ... LIMIT):
+# в плане это SCAN ... USING INDEX, но читается не вся таблица
+INDEX_ORDER_ALLOWED = {'get_most_desirable'}
+
+SCAN_RE = re.compile(r'^SCAN (\w+)')
+# Поиск по FTS5: в плане это SCAN ... VIRTUAL TABLE, но с ограничением MATCH
+# (M в idxStr) читается только найденное
+FTS_MATCH_RE = re.compile(r' VIRTUAL TABLE INDEX \d+:.*M')
+# Служебные запросы самого FTS5 к его теневым таблицам (profiles_fts_config и т.п.)
+FTS_SHADOW_RE = re.compile(r"^SELECT .* FROM 'main'\.'\w+_fts_")
+
+
+class _NoChatBot:
+    async def get_chat(self, user_id):
+        raise RuntimeError("нет сети")
+
+
+def build_calls():
+    deadline = datetime.datetime.now() + datetime.timedelta(hours=24)
+    classes = compat.MUTUAL[compat.class_of('Парень', 'Девушки')]
+    filters = {'age_min': 18, 'age_max': 22, 'institutes': ['ИИТ', 'ИКБ'], 'verified_only': True}
+    since = activity.timestamp(30)
+    return {
+        'init_db': (),
+        'save_profile': (5000, 'Имя', 20, 'Парень', 'Девушки', 'ИИТ', 'Описание', ['p1']),
+        'get_profile': (1,),
+        'get_all_profiles': (),
+        'get_profile_partitions': ([1, 2, 3],),
+        'get_profile_columns': (ranking.FeatureTable.COLUMNS, [1, 2, 3]),
+        'update_profile_institute': (5000, 'ИКБ'),
+        'log_interaction': (1, 2, 'shown'),
+        'add_like': (5000, 1),
+        'check_like_exists': (1, 2),
+        'add_dislike': (5000, 2),
+        'get_ratings': (1,),
+        'get_likers': (1,),
+        'get_recommendations': (1,),
+        'save_browse_filters': (1, 18, 22, ['ИИТ', 'ИКБ'], True),
+        'get_browse_filters': (1,),
+        'get_candidate_pools': (1, classes, 50, filters, since),
+        'get_candidate_queue': (1, filters, since),
+        'search_profiles': (1, 'описание кино', classes, 50, filters, since),
+        'get_user_stats': (),
+        'get_all_usernames': (_NoChatBot(),),
+        'create_meet_task': (1, 2, 1, 'ИИТ', 'Коворкинг', deadline),
+        'get_meet_task_by_id': (1,),
+        'get_active_meet_task_for_user': (1, 'pending'),
+        'update_meet_task_status': (1, 'pending', 10, 1),
+        'update_meet_agreement': (1, 1, True),
+        'add_points': (1, 5),
+        'get_top_users': (),
+        'reset_all_points': (),
+        'delete_profile': (5000,),
+        'get_hot_profiles': (),
+        'get_desirability': ([1, 2, 3],),
+        'get_most_desirable': (),
+        'update_streak': (1,),
+        'get_streak': (1,),
+        'count_pending_likes': (1,),
+        'get_top_users_by_institute': ('ИИТ',),
+        'award_badge': (1, 'verified'),
+        'get_user_badges': (1,),
+        'get_daily_task_completions': (1,),
+        'complete_daily_task': (1, 'login'),
+        'count_today_likes': (1,),
+        'can_use_roulette': (1,),
+        'set_roulette_used': (1,),
+        'get_random_profile_other_institute': (1, 'ИИТ'),
+        'set_verified': (1, 1),
+        'save_verification_request': (1, 'file', None),
+        'record_profile_view': (1, 3),
+        'get_recent_viewers': (1,),
+        'save_profile_video': (1, 'video'),
+    }
+
+
+def is_query(sql: str) -> bool:
+    if FTS_SHADOW_RE.match(sql.lstrip()):
+        return False
+    head = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+    return head in {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE'}
+
+
+async def main() -> int:
+    path = await open_temp_db('plans.db')
+    await seed_profiles(PROFILES)
+    await seed_reactions(PROFILES, 30)
+    async with data.pool.write() as db:
+        await db.execute('ANALYZE')
+
+    # Очередь новых анкет включена, чтобы проверить и её запросы (init_db её заполнит)
+    data.CANDIDATE_QUEUE = True
+    calls = build_calls()
+    coroutines = {
+        name for name, fn in inspect.getmembers(data, inspect.iscoroutinefunction)
+        if fn.__module__ == 'data' and not name.startswith('_')
+    }
+    missing = sorted(coroutines - set(calls))
+    if missing:
+        print(f"Нет тестового вызова для: {', '.join(missing)}")
+        return 1
+
+    # Счётчики показов (exposure.py) загружаются целиком один раз на процесс —
+    # не в каком-то из вызовов ниже
+    await data.exposure.load()
+    traced = []
+    await data.pool.set_trace_callback(traced.append)
+    statements = {}
+    for name, args in calls.items():
+        traced.clear()
+        await getattr(data, name)(*args)
+        for sql in traced:
+            if is_query(sql):
+                statements.setdefault(' '.join(sql.split()), name)
+    await data.pool.set_trace_callback(None)
+
+    failures = 0
+    conn = sqlite3.connect(path)
+    for sql, name in statements.items():
+        plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+        full_scans = [
+            line for line in plan
+            if (m := SCAN_RE.match(line)) and m.group(1) != 'CONSTANT' and not FTS_MATCH_RE.search(line)
+        ]
+        if name in INDEX_ORDER_ALLOWED:
+            full_scans = [line for line in full_scans if ' USING ' not in line]
+        bad = full_scans and name not in FULL_SCAN_ALLOWED
+        failures += bool(bad)
+        print(f"{'FAIL' if bad else 'ok  '} {name}: {sql[:110]}")
+        for line in plan:
+            print(f"       {line}")
+    conn.close()
+    await data.pool.close()
+
+    print(f"\nЗапросов: {len(statements)}, с полным сканированием: {failures}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
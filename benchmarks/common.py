@@ -0,0 +1,91 @@
+"""Общие помощники для бенчмарков: временная БД, наполнение, перцентили.
+
+Скрипты запускаются из корня репозитория, например:
+    python benchmarks/bench_pool.py
+"""
+import os
+import sys
+import json
+import random
+import tempfile
+import statistics
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / 'app'
+sys.path.insert(0, str(APP_DIR))
+
+import data  # noqa: E402
+from migrations import rebuild_compat_classes, rebuild_seen_bitmaps  # noqa: E402
+
+GENDERS = ["Парень", "Девушка"]
+INTERESTS = ["Парни", "Девушки", "Все"]
+
+
+def temp_db_path(name: str = 'bench.db') -> str:
+    return os.path.join(tempfile.mkdtemp(prefix='ratingbot-bench-'), name)
+
+
+async def open_temp_db(name: str = 'bench.db') -> str:
+    """Перенаправляет общий пул на временную БД и создаёт схему."""
+    path = temp_db_path(name)
+    await data.pool.close()
+    data.pool.path = path
+    # Кэши в памяти относятся к прежней БД
+    data.profile_cache.clear()
+    data.seen.reset()
+    data.exposure.reset()
+    data.activity.reset()
+    data.delivery.reset()
+    await data.pool.open()
+    await data.init_db()
+    return path
+
+
+async def seed_profiles(count: int, seed: int = 42, compat_classes: bool = True):
+    """count анкет; compat_classes=False — без profiles.compat_class (схема до миграции 8)."""
+    rnd = random.Random(seed)
+    rows = []
+    for uid in range(1, count + 1):
+        rows.append((
+            uid, f"user{uid}", rnd.randint(17, 30), rnd.choice(GENDERS), rnd.choice(INTERESTS),
+            rnd.choice(data.INSTITUTES), "Описание " * 10, json.dumps([f"photo{uid}"]),
+        ))
+    async with data.pool.write() as db:
+        await db.executemany(
+            'INSERT INTO profiles (user_id, name, age, gender, interests, institute, description, photos) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows
+        )
+        if compat_classes:
+            await rebuild_compat_classes(db)
+
+
+async def seed_reactions(count: int, per_user: int, seed: int = 7):
+    """Лайки, дизлайки и просмотры: каждый из count пользователей оценивает per_user анкет."""
+    rnd = random.Random(seed)
+    likes, dislikes, views = [], [], []
+    for uid in range(1, count + 1):
+        for target in rnd.sample(range(1, count + 1), min(per_user, count)):
+            if target == uid:
+                continue
+            ts = f"2026-01-{rnd.randint(1, 28):02d} {rnd.randint(0, 23):02d}:00:00"
+            views.append((uid, target, ts))
+            if rnd.random() < 0.4:
+                likes.append((uid, target, ts))
+            else:
+                dislikes.append((uid, target))
+    async with data.pool.write() as db:
+        await db.executemany('INSERT OR IGNORE INTO likes (user_id, liked_user_id, created_at) VALUES (?, ?, ?)', likes)
+        await db.executemany('INSERT OR IGNORE INTO dislikes (user_id, disliked_user_id) VALUES (?, ?)', dislikes)
+        await db.executemany('INSERT OR IGNORE INTO profile_views (viewer_id, viewed_id, viewed_at) VALUES (?, ?, ?)', views)
+        await rebuild_seen_bitmaps(db)
+
+
+def percentiles(samples_s):
+    ms = sorted(s * 1000 for s in samples_s)
+    p99_idx = min(len(ms) - 1, int(len(ms) * 0.99))
+    return statistics.median(ms), ms[p99_idx]
+
+
+def report(label: str, samples_s):
+    p50, p99 = percentiles(samples_s)
+    print(f"{label:<40} p50={p50:8.3f} ms  p99={p99:8.3f} ms  (n={len(samples_s)})")